@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2011 by Xueqiao Xu <xueqiaoxu@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+from heapq import *
+from array import array
+
+import sys
+sys.path.insert(0, '..')
+
+from astar import ArrayAStar
+from graph import MASK_MOVES
+from components import unreachable
+from const.constants import *
+
+
+class ARAStar(ArrayAStar):
+    """Anytime Repairing A* (ARA*).
+    Runs a series of weighted A* searches with a decreasing weight W,
+    so that a first path is found quickly and then improved for as 
+    long as the caller keeps running step().
+
+    Each search reuses the G values and parents left by the previous
+    ones: a node whose G drops after it has been closed is kept in an
+    INCONS list instead of being opened again, and INCONS is merged 
+    back into the open list when W is lowered. So each search only 
+    repairs the part of the previous one that the new W makes worth
+    revisiting.
+
+    Whenever a path is found, self.path is replaced by it, its cost is
+    at most self.bound times the shortest one, and a ('PATH', path) 
+    record is pushed. The search ends when W reaches 1 or the path is
+    proven to be the shortest, which requires an admissible and 
+    consistent heuristic, so the default heuristic is OCTILE.
+
+    The search state is kept in flat arrays as in ArrayAStar, as the
+    time to set up the finder counts against the deadline of the 
+    latency-bounded queries it serves.
+    """
+
+    def __init__(self, raw_graph, heuristic = OCTILE, 
+                 weight = DEFAULT_WEIGHT, weight_step = ARA_WEIGHT_STEP):
+        """Create a new instance of ARA* path finder.
+        Refer to AStar.__init__ for the other parameters.
+
+        :Parameters:
+            weight : int or float
+                the weight of the first search, no less than 1.
+            weight_step : int or float
+                the amount W is lowered by after each path found.
+        """
+        ArrayAStar.__init__(self, raw_graph, heuristic, max(weight, 1))
+        self.weight_step = weight_step
+
+        # the cost of self.path is at most this times the shortest one
+        self.bound = None
+
+        # the indices of the nodes in the open list, and of those whose
+        # G dropped after they had been closed in the current search
+        self.opened = set()
+        self.incons = set()
+
+    def _init_nodes(self):
+        """Allocate the per-node search state.
+        """
+        ArrayAStar._init_nodes(self)
+        size = self.n_row * self.n_col
+        # -1 for the H values not calculated yet
+        self.h = array('i', [-1]) * size
+        # the number of the search in which each node was closed
+        self.closed = array('i', [-1]) * size
+        self.search = 0
+
+    def step(self, record = None):
+        """Starts the computation of the paths.
+        Refer to AStar.step for the details.
+        """
+        if unreachable(self.grid, self.source, self.target):
+            return
+
+        g, h = self.g, self.h
+        n_col = self.n_col
+        sx, sy = self.source
+        tx, ty = self.target
+        src = sy * n_col + sx
+        dst = ty * n_col + tx
+
+        g[src] = 0
+        h[src] = self._calc_h(self.source)
+        self.opened.add(src)
+        self.open_list.append((self._calc_f(0, h[src]), h[src], src))
+
+        while True:
+            for i in self._improve_path(dst, record):
+                yield
+            if g[dst] == INF:
+                # the target is unreachable
+                break
+            self._retrace()
+            self.bound = self._bound(g[dst])
+            if record != None:
+                record.append(('PATH', self.path))
+            yield
+
+            if self.bound <= 1:
+                break
+            self.weight = max(self.weight - self.weight_step, 1)
+            self.search += 1
+
+            # move INCONS into the open list and re-key it with the 
+            # new weight
+            self.opened |= self.incons
+            self.incons.clear()
+            self.open_list = [(self._calc_f(g[i], h[i]), h[i], i) 
+                              for i in self.opened]
+            heapify(self.open_list)
+
+    def solve(self):
+        """Run all the searches of step, down to the weight of 1, and 
+        return the last path.
+        """
+        for i in self.step():
+            pass
+        return self.path
+
+    def _improve_path(self, dst, record):
+        """Run a weighted A* search with the current weight until no
+        node in the open list can lead to a path cheaper than the one
+        through the target's parent.
+        """
+        g, h, parent, closed = self.g, self.h, self.parent, self.closed
+        opened, open_list = self.opened, self.open_list
+        masks, n_col = self.grid.masks(), self.n_col
+        search = self.search
+
+        while open_list:
+            f, hi, i = open_list[0]
+            # skip the outdated entries
+            if i not in opened or f != self._calc_f(g[i], hi):
+                heappop(open_list)
+                continue
+            if g[dst] <= f:
+                break
+            heappop(open_list)
+            opened.remove(i)
+            closed[i] = search
+            y, x = divmod(i, n_col)
+            if record != None:
+                record.append(('CLOSE', (x, y)))
+
+            for dx, dy, dist in MASK_MOVES[masks[i]]:
+                nx = x + dx
+                ny = y + dy
+                j = i + dy * n_col + dx
+                ng = g[i] + dist
+                if ng >= g[j]:
+                    continue
+                g[j] = ng
+                parent[j] = i
+                if h[j] < 0:
+                    h[j] = self._calc_h((nx, ny))
+                if record != None:
+                    pos = (nx, ny)
+                    record.append(('VALUE', ('g', pos, ng)))
+                    record.append(('VALUE', ('h', pos, h[j])))
+                    record.append(('VALUE', ('f', pos, 
+                                             self._calc_f(ng, h[j]))))
+                    record.append(('PARENT', (pos, (x, y))))
+                if closed[j] == search:
+                    self.incons.add(j)
+                    continue
+                if j not in opened:
+                    opened.add(j)
+                    if record != None:
+                        record.append(('OPEN', (nx, ny)))
+                heappush(open_list, (self._calc_f(ng, h[j]), h[j], j))
+            yield
+
+    def _bound(self, cost):
+        """Return the suboptimality bound of a path of the given cost:
+        no path is cheaper than the smallest G + H of the nodes left in
+        the open list and INCONS.
+        """
+        g, h = self.g, self.h
+        nodes = self.opened | self.incons
+        if not nodes:
+            return 1
+        lowest = min([g[i] + h[i] for i in nodes])
+        if lowest >= cost:
+            return 1
+        return min(self.weight, float(cost) / lowest)
+
+
+def _test():
+    nodes_map_raw = '''
+                    S0000000000000000000000000100000000000
+                    00000000000000000000110000010000000000
+                    00000000000000000000100000001000000000
+                    10000111110101000001100000001000000000
+                    01111100010001000010100000010000000000
+                    00000100001111100100100001110000110000
+                    00001100000001011000000100000001000000
+                    00000100000000101000000000011110000001
+                    00000010000000000111111111100000000011
+                    00000001000000000000000001100000111100
+                    00000000110000000000000000010011000000
+                    00000000010000000001100000001000000000
+                    00000000010000000000110000000111111000
+                    00000000010000000000010000000000000000
+                    00000000011000111111111111111111111111
+                    000000000100000110000010000000000000T0
+                    00000000001100000100001000000000000000
+                    00000000000100000011000000000000000000
+                    00000000000010000000000000000000000000
+                    '''
+    graph2 = [list(row) for row in nodes_map_raw.split()]
+    nr = len(graph2)
+    nc = len(graph2[0])
+    ara = ARAStar(nodes_map_raw, OCTILE, 3)
+    record = []
+    for i in ara.step(record):
+        while record:
+            r = record.pop(0)
+            if r[0] == 'PATH':
+                print 'W = %.1f, bound = %.2f, route length: %d' % (
+                        ara.weight, ara.bound, len(r[1]))
+    if ara.path:
+        for y in xrange(nr):
+            for x in xrange(nc):
+                if (x, y) == ara.source:
+                    print 'S',
+                elif (x, y) == ara.target:
+                    print 'T',
+                elif (x, y) in ara.path:
+                    print '.',
+                elif graph2[y][x] == BLOCKED:
+                    print 'X',
+                else:
+                    print ' ',
+            print
+        print 'Route length:', len(ara.path)
+    else:
+        print 'Failed to find the path'
+
+if __name__ == '__main__':
+    from cProfile import Profile
+    p = Profile()
+    p.runcall(_test)
+    p.print_stats(sort = 1)
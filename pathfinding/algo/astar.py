@@ -22,11 +22,15 @@
 
 from math import hypot
 from heapq import *
+from array import array
 
 import sys
 sys.path.insert(0, '..')
 
-from graph import is_walkable, InvalidMap
+from graph import MASK_MOVES, InvalidMap
+from mapcache import load_map
+from landmarks import landmarks_of
+from components import unreachable
 from const.constants import *
 
 class _Node(object):
@@ -44,35 +48,6 @@ class _Node(object):
         self.f = None
 
 
-class _QNode(object):
-    """This class is used for storing the coordinates of the 
-    opened nodes in the open list. It provides a comparison 
-    method used by the priority queue.
-    """
-    __slots__ = ['pos', '_nodes']
-
-    def __init__(self, pos, nodes):
-        """Creates a new instance of QNode.
-        :Parameters:
-            pos : (x, y)
-                the coordinate of this node.
-            nodes: [str]
-                a reference to AStar.nodes.
-        """
-        self.pos = pos
-        self._nodes = nodes
-
-    def __lt__(self, other):
-        """Used by heapq for maintaining the priority queue.
-        """
-        x, y = self.pos
-        ox, oy = other.pos
-        if self._nodes[y][x].f == self._nodes[oy][ox].f:
-            return self._nodes[y][x].h < self._nodes[oy][ox].h
-        else:
-            return self._nodes[y][x].f < self._nodes[oy][ox].f
-
-
 class AStar(object):
     """Each node has three main properties:
         F, G and H 
@@ -89,14 +64,36 @@ class AStar(object):
         1. Manhattan: h = x + y
         2. Euclidean: h = hypot(x, y)
         3. Chebyshev: h = max(x, y)
+        4. Octile: h = max(x, y) + (sqrt(2) - 1) * min(x, y)
+        5. ALT: the largest of Octile and the landmark lower bounds,
+           see landmarks.Landmarks. Its tables are computed once per 
+           map, and it is exact far more often than Octile on maps 
+           with walls to go around.
         and so on.
         (Of course you can define your own heuristic methods.)
+    With horizontal and vertical moves costing DIST and diagonal moves
+    costing DDIST, only Chebyshev and Octile never overestimate the 
+    remaining cost, see h_admissible. Octile is the exact distance on
+    a map without obstacles, so it is the tightest of them.
     also, you can give H a weight, i.e.
         F = G + W * H
     The higher the W value is, The more important the heuristic will
-    be in this algorithm.
+    be in this algorithm. With an admissible heuristic and W >= 1, the
+    path found costs at most W times the shortest one (weighted A*),
+    and usually far fewer nodes are expanded.
     """
-    def __init__(self, raw_graph, heuristic = MANHATTAN):
+
+    # whether each heuristic is admissible, i.e. never overestimates 
+    # the cost to the target, which makes the path found the shortest.
+    # Manhattan ignores diagonal moves, and Euclidean exceeds DDIST per
+    # diagonal step, e.g. int(hypot(10, 10) * SCALE) = 141 > 10 * DDIST.
+    h_admissible = {MANHATTAN: False,
+                    EUCLIDEAN: False,
+                    CHEBYSHEV: True,
+                    OCTILE: True,
+                    ALT: True}
+
+    def __init__(self, raw_graph, heuristic = MANHATTAN, weight = 1):
         """Create a new instance of A* path finder.
 
         :Parameters:
@@ -109,48 +106,57 @@ class AStar(object):
                     T000
                     '''
             heuristic : 
-                Currently three types of heuristic are supported,
-                namely MANHATTAN, EUCLIDEAN and CHEBYSHEV
+                Currently five types of heuristic are supported,
+                namely MANHATTAN, EUCLIDEAN, CHEBYSHEV, OCTILE and ALT
+            weight : int or float
+                W in F = G + W * H. 
         """
-        self.graph = raw_graph.split()
-        self.n_row = len(self.graph)
-        self.n_col = len(self.graph[0])
+        self.grid, self.source, self.target = load_map(raw_graph)
+        self.graph = self.grid.rows
+        self.n_row = self.grid.n_row
+        self.n_col = self.grid.n_col
 
         # determine heuristic function
         self.h_list = {MANHATTAN: self._manhattan,
                        EUCLIDEAN: self._euclidean,
-                       CHEBYSHEV: self._chebyshev}
+                       CHEBYSHEV: self._chebyshev,
+                       OCTILE: self._octile,
+                       ALT: self._octile}
         if heuristic not in self.h_list:
             self.heuristic = MANHATTAN
         else:
             self.heuristic = heuristic
         self.h_func = self.h_list[self.heuristic]
+        self.weight = weight
 
-        self.source = None
-        self.target = None
         self.path = []
 
-        # 2D array of nodes
-        self.nodes = [[_Node()
-                        for x in xrange(self.n_col)]
-                            for y in xrange(self.n_row)]
+        self._init_nodes()
 
-        # get source and target coordinates
-        for y in xrange(self.n_row):
-            for x in xrange(self.n_col):
-                if self.graph[y][x] == SOURCE:
-                    self.source = (x, y)
-                elif self.graph[y][x] == TARGET:
-                    self.target = (x, y)
-        
         # guarantee that both source and target is present on the graph
         if not all((self.source, self.target)):
             raise InvalidMap("No source or target given")
 
-        # a priority queue holding the coordinates waiting 
-        # for inspection
+        # ALT looks up the landmark tables by the position of the node,
+        # so it replaces _calc_h instead of h_func. Where H is computed
+        # from the offsets only, as in BiDirAStar, Octile is used.
+        if self.heuristic == ALT:
+            self._calc_h = landmarks_of(self.grid).estimator(self.target)
+
+        # a priority queue of (f, h, (x, y)) entries waiting for 
+        # inspection. When a node's F drops, a new entry is pushed 
+        # instead of re-heapifying the queue, and the outdated entries
+        # are discarded when they are popped (lazy deletion).
         self.open_list = []
 
+    def _init_nodes(self):
+        """Allocate the per-node search state.
+        """
+        # 2D array of nodes
+        self.nodes = [[_Node()
+                        for x in xrange(self.n_col)]
+                            for y in xrange(self.n_row)]
+
     def step(self, record = None):
         """Starts the computation of the shortest path.
         *Note* : 
@@ -166,18 +172,30 @@ class AStar(object):
                 if a queue is specified, a record of each operation 
                 (OPEN, CLOSE, etc) will be pushed into the queue.
         """
+        # the target lies in another component of the map, so there is
+        # nothing to search
+        if unreachable(self.grid, self.source, self.target):
+            return
+
+        masks = self.grid.masks()
+
         # add the source node into the open list
         sx, sy = self.source
         self.nodes[sy][sx].g = 0
         self.nodes[sy][sx].f = 0
-        self.open_list.append(_QNode(self.source, self.nodes))
+        self.open_list.append((0, 0, self.source))
         self.nodes[sy][sx].status = OPENED
 
         # while the open list is not empty
         while self.open_list:
 
             # get the node with lowest F from the heap
-            x, y = heappop(self.open_list).pos
+            x, y = heappop(self.open_list)[2]
+
+            # the node has been closed through a cheaper entry, 
+            # so this one is outdated.
+            if self.nodes[y][x].status == CLOSED:
+                continue
             self.nodes[y][x].status = CLOSED
             if record != None:
                 record.append(('CLOSE', (x, y)))
@@ -188,31 +206,61 @@ class AStar(object):
                 self._retrace()
                 break
 
-            # inspect the horizontal and vertical adjacent nodes
-            for i in xrange(len(XOFFSET)):
-
-                # next x and y
-                nx = x + XOFFSET[i]
-                ny = y + YOFFSET[i]
-
-                # if the next coordinate is walkable, inspect it.
-                if is_walkable(nx, ny, self.n_row, self.n_col, 
-                               self.graph):
-                    self._inspect_node((nx, ny), (x, y), False, record)
-
-                    # further investigate the diagonal nodes
-                    nx1 = x + DAXOFFSET[i]
-                    ny1 = y + DAYOFFSET[i]
-                    nx2 = x + DBXOFFSET[i]
-                    ny2 = y + DBYOFFSET[i]
-                    npos = ((nx1, ny1), (nx2, ny2))
-                    for nx, ny in npos:
-                        if is_walkable(nx, ny, self.n_row, self.n_col, 
-                                       self.graph):
-                            self._inspect_node((nx, ny), (x, y), 
-                                                True, record)
+            # inspect the adjacent nodes the node can move to, as set
+            # in its neighbour mask
+            for dx, dy, dist in MASK_MOVES[masks[y * self.n_col + x]]:
+                self._inspect_node((x + dx, y + dy), (x, y), 
+                                   dist == DDIST, record)
             yield
 
+    def solve(self):
+        """Find the shortest path like step, but in a plain loop without
+        the yields and the records, and return it. This is the faster 
+        way to search when nobody watches the steps, e.g. in batches.
+        """
+        if unreachable(self.grid, self.source, self.target):
+            return self.path
+
+        nodes, masks = self.nodes, self.grid.masks()
+        n_col = self.n_col
+        calc_h, weight = self._calc_h, self.weight
+        open_list, target = self.open_list, self.target
+
+        sx, sy = self.source
+        node = nodes[sy][sx]
+        node.g = node.f = 0
+        node.status = OPENED
+        open_list.append((0, 0, self.source))
+
+        while open_list:
+            pos = heappop(open_list)[2]
+            x, y = pos
+            node = nodes[y][x]
+            if node.status == CLOSED:
+                continue
+            node.status = CLOSED
+            if pos == target:
+                self._retrace()
+                break
+
+            for dx, dy, dist in MASK_MOVES[masks[y * n_col + x]]:
+                nx = x + dx
+                ny = y + dy
+                adj = nodes[ny][nx]
+                if adj.status == CLOSED:
+                    continue
+                ng = node.g + dist
+                if adj.g == None:
+                    adj.h = calc_h((nx, ny))
+                elif ng >= adj.g:
+                    continue
+                adj.status = OPENED
+                adj.parent = pos
+                adj.g = ng
+                adj.f = ng + int(weight * adj.h)
+                heappush(open_list, (adj.f, adj.h, (nx, ny)))
+        return self.path
+
     def _retrace(self):
         """After the search completes, this method will be called to 
         reconstruct the path according to the nodes' parents.
@@ -228,7 +276,7 @@ class AStar(object):
         """Push the node into the open list if this node is not 
         in the open list. Otherwise, if the node can be accessed 
         with a lower cost from the given parent position, update 
-        its parent and cost, then heapify the open list.
+        its parent and cost, then push it again with the new F.
         """
         x, y = node_pos
         px, py = parent_pos
@@ -239,12 +287,19 @@ class AStar(object):
                 if record != None:
                     record.append(('OPEN', (x, y)))
                 self._try_update((x, y), (px, py), diagonal, record)
-                heappush(self.open_list, 
-                         _QNode((x, y), self.nodes))
+                self._push((x, y))
             else:
                 if self._try_update((x, y), (px, py), diagonal, 
                                     record):
-                    heapify(self.open_list)
+                    self._push((x, y))
+
+    def _push(self, pos):
+        """Push the node into the open list with its current F 
+        and H values. Nodes with equal F are ordered by H.
+        """
+        x, y = pos
+        node = self.nodes[y][x]
+        heappush(self.open_list, (node.f, node.h, pos))
 
 
     def _try_update(self, node_pos, parent_pos, diagonal, record):
@@ -267,7 +322,7 @@ class AStar(object):
             node.parent = (px, py)
             node.g = ng
             node.h = self._calc_h((x, y))
-            node.f = node.g + node.h
+            node.f = self._calc_f(node.g, node.h)
 
             if record != None:
                 record.append(('VALUE', ('g', (x, y), node.g)))
@@ -278,6 +333,12 @@ class AStar(object):
         return False
         
 
+    def _calc_f(self, g, h):
+        """Calculate the F value from the G and H values. F is kept an
+        integer so that the heap compares integers only.
+        """
+        return g + int(self.weight * h)
+
     def _calc_h(self, pos):
         """Caculate the H value of the node.
         """
@@ -294,6 +355,182 @@ class AStar(object):
     def _chebyshev(self, dx, dy):
         return max(dx, dy) * SCALE
 
+    def _octile(self, dx, dy):
+        if dx < dy:
+            return DDIST * dx + DIST * (dy - dx)
+        return DDIST * dy + DIST * (dx - dy)
+
+
+class ArrayAStar(AStar):
+    """A* path finder which keeps the search state in flat typed arrays
+    instead of a 2D list of _Node objects.
+
+    The node at (x, y) is stored at index y * n_col + x of each array,
+    and the open list holds plain (f, h, index) tuples, so the heap 
+    compares integers only. Each node costs 13 bytes of state, which 
+    lets a 2000x2000 map fit in about 50MB.
+
+    Apart from the order in which nodes with equal F and H are
+    expanded, it behaves exactly like AStar.
+    """
+    def _init_nodes(self):
+        """Allocate the per-node search state.
+        """
+        size = self.n_row * self.n_col
+        self.g = array('i', [INF]) * size
+        self.h = array('i', [0]) * size
+        self.parent = array('i', [-1]) * size
+        self.status = array('c', '\0') * size
+
+    def step(self, record = None):
+        """Starts the computation of the shortest path.
+        Refer to AStar.step for the details.
+        """
+        if unreachable(self.grid, self.source, self.target):
+            return
+
+        n_col = self.n_col
+        masks = self.grid.masks()
+        sx, sy = self.source
+        tx, ty = self.target
+        src = sy * n_col + sx
+        dst = ty * n_col + tx
+
+        # add the source node into the open list
+        self.g[src] = 0
+        self.open_list.append((0, 0, src))
+        self.status[src] = OPENED
+
+        # while the open list is not empty
+        while self.open_list:
+
+            # get the node with lowest F from the heap
+            i = heappop(self.open_list)[2]
+
+            # skip the outdated entries
+            if self.status[i] == CLOSED:
+                continue
+            self.status[i] = CLOSED
+            y, x = divmod(i, n_col)
+            if record != None:
+                record.append(('CLOSE', (x, y)))
+
+            # if the node is the target, reconstruct the path 
+            # and break the loop
+            if i == dst:
+                self._retrace()
+                break
+
+            # inspect the adjacent nodes the node can move to
+            for dx, dy, dist in MASK_MOVES[masks[i]]:
+                self._inspect_node(i + dy * n_col + dx, i, dist == DDIST, 
+                                   record)
+            yield
+
+    def solve(self):
+        """Find the shortest path like step, but in a plain loop without
+        the yields and the records, and return it.
+        """
+        if unreachable(self.grid, self.source, self.target):
+            return self.path
+
+        g, h, parent, status = self.g, self.h, self.parent, self.status
+        masks = self.grid.masks()
+        n_col = self.n_col
+        calc_h, weight = self._calc_h, self.weight
+        open_list = self.open_list
+        sx, sy = self.source
+        tx, ty = self.target
+        src = sy * n_col + sx
+        dst = ty * n_col + tx
+
+        g[src] = 0
+        status[src] = OPENED
+        open_list.append((0, 0, src))
+
+        while open_list:
+            i = heappop(open_list)[2]
+            if status[i] == CLOSED:
+                continue
+            status[i] = CLOSED
+            if i == dst:
+                self._retrace()
+                break
+
+            y, x = divmod(i, n_col)
+            for dx, dy, dist in MASK_MOVES[masks[i]]:
+                j = i + dy * n_col + dx
+                if status[j] == CLOSED:
+                    continue
+                ng = g[i] + dist
+                if status[j] != OPENED:
+                    h[j] = calc_h((x + dx, y + dy))
+                elif ng >= g[j]:
+                    continue
+                status[j] = OPENED
+                parent[j] = i
+                g[j] = ng
+                heappush(open_list, (ng + int(weight * h[j]), h[j], j))
+        return self.path
+
+    def _retrace(self):
+        """Reconstruct the path according to the parent array.
+        """
+        n_col = self.n_col
+        tx, ty = self.target
+        sx, sy = self.source
+        i = ty * n_col + tx
+        src = sy * n_col + sx
+        path = [i]
+        while i != src:
+            i = self.parent[i]
+            path.append(i)
+        path.reverse()
+        self.path = [(i % n_col, i // n_col) for i in path]
+
+    def _inspect_node(self, i, pi, diagonal, record):
+        """Same as AStar._inspect_node, but takes the indices of the 
+        node and its parent.
+        """
+        status = self.status[i]
+        if status != CLOSED:
+            if status != OPENED:
+                self.status[i] = OPENED
+                if record != None:
+                    record.append(('OPEN', (i % self.n_col, 
+                                            i // self.n_col)))
+                self._try_update(i, pi, diagonal, record)
+                heappush(self.open_list, 
+                         (self._calc_f(self.g[i], self.h[i]), self.h[i], i))
+            elif self._try_update(i, pi, diagonal, record):
+                heappush(self.open_list, 
+                         (self._calc_f(self.g[i], self.h[i]), self.h[i], i))
+
+    def _try_update(self, i, pi, diagonal, record):
+        """Same as AStar._try_update, but takes the indices of the 
+        node and its parent.
+        """
+        dd = DDIST if diagonal else DIST # whether is diagonal
+        ng = self.g[pi] + dd # next G value
+
+        if ng < self.g[i]:
+            n_col = self.n_col
+            x, y = i % n_col, i // n_col
+            self.parent[i] = pi
+            self.g[i] = ng
+            self.h[i] = h = self._calc_h((x, y))
+
+            if record != None:
+                pos = (x, y)
+                record.append(('VALUE', ('g', pos, ng)))
+                record.append(('VALUE', ('h', pos, h)))
+                record.append(('VALUE', ('f', pos, self._calc_f(ng, h))))
+                record.append(('PARENT', (pos, (pi % n_col, 
+                                                pi // n_col))))
+            return True
+        return False
+
+
 
 def _test():
     nodes_map_raw = '''
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2011 by Xueqiao Xu <xueqiaoxu@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import multiprocessing
+
+import sys
+sys.path.insert(0, '..')
+
+from astar import ArrayAStar
+from graph import InvalidMap
+from mapcache import map_key, load_map
+from const.constants import *
+
+# the map of the queries sent to a worker process, loaded once by 
+# _init_worker
+_worker_map = None
+
+
+def route_batch(raw_graph, pairs, finder = None, processes = None, 
+                pool = None):
+    """Find the paths between many pairs of nodes on the same map.
+
+    The map is parsed once and shared by all the queries, instead of 
+    being sent and parsed again with each pair of endpoints. The 
+    queries are spread over a pool of worker processes, each of which
+    loads the map once when it starts.
+
+    :Parameters:
+        raw_graph : str
+            A multi-line string representing the graph. The source and
+            target in it, if any, are ignored.
+
+        pairs : list
+            The list of (source, target) coordinates to query.
+
+        finder : callable
+            Called with a (grid, source, target) tuple returned by
+            load_map, it returns the finder of a query, e.g. AStar or
+            functools.partial(AStar, heuristic = OCTILE). It must be 
+            picklable to be sent to the worker processes. Defaults to
+            ArrayAStar with octile distance, whose search state is the
+            cheapest to set up for each query.
+
+        processes : int
+            The number of worker processes, cpu_count() by default. 
+            With 1 the queries are run in this process.
+
+        pool : multiprocessing.Pool
+            A running pool to use instead of starting one. The map is
+            sent along with the queries, and loaded through the map 
+            cache of each worker.
+
+    :Return:
+        paths : list
+            The path of each pair, in the same order. The path of a
+            pair is empty if it is not connected, or if either end is
+            blocked or out of the map.
+    """
+    if finder is None:
+        finder = _octile_astar
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    tasks = [(finder, tuple(s), tuple(t)) for s, t in pairs]
+
+    if pool is None and (processes <= 1 or len(tasks) <= 1):
+        grid = load_map(raw_graph)[0]
+        return [_route_on(grid, task) for task in tasks]
+
+    stripped = map_key(raw_graph)[0]
+    if not stripped:
+        raise InvalidMap("The given raw map may be invalid")
+    # a few chunks per worker keep them busy until the end, without 
+    # sending each query on its own.
+    chunk = max(1, len(tasks) // (processes * 4))
+    if pool is not None:
+        # the map is pickled once per chunk, as all its tasks refer to
+        # the same string
+        return pool.map(_route_map, [(stripped,) + task for task in tasks],
+                        chunk)
+    pool = multiprocessing.Pool(processes, _init_worker, (stripped,))
+    try:
+        return pool.map(_route, tasks, chunk)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _octile_astar(loaded):
+    return ArrayAStar(loaded, OCTILE)
+
+
+def _init_worker(stripped):
+    global _worker_map
+    _worker_map = load_map(stripped)[0]
+
+
+def _route(task):
+    return _route_on(_worker_map, task)
+
+
+def _route_map(task):
+    return _route_on(load_map(task[0])[0], task[1:])
+
+
+def _route_on(grid, task):
+    """Run the finder of a (finder, source, target) task on the grid 
+    and return its path.
+    """
+    finder, source, target = task
+    for x, y in (source, target):
+        if not (0 <= x < grid.n_col and 0 <= y < grid.n_row) or \
+                grid.rows[y][x] == BLOCKED:
+            return []
+    a = finder((grid, source, target))
+    # nobody watches the steps of a batch, so the finders which have
+    # a loop without them use it
+    if hasattr(a, 'solve'):
+        return a.solve()
+    for i in a.step():
+        pass
+    return a.path
+
+
+def _test():
+    nodes_map_raw = '''
+                    00000000000000000000000000100000000000
+                    00000000000000000000110000010000000000
+                    00000000000000000000100000001000000000
+                    10000111110101000001100000001000000000
+                    01111100010001000010100000010000000000
+                    00000100001111100100100001110000110000
+                    00001100000001011000000100000001000000
+                    00000100000000101000000000011110000001
+                    00000010000000000111111111100000000011
+                    00000001000000000000000001100000111100
+                    00000000110000000000000000010011000000
+                    00000000010000000001100000001000000000
+                    00000000010000000000110000000111111000
+                    00000000010000000000010000000000000000
+                    00000000011000111111111111111111111111
+                    00000000010000011000001000000000000000
+                    00000000001100000100001000000000000000
+                    00000000000100000011000000000000000000
+                    00000000000010000000000000000000000000
+                    '''
+    pairs = [((0, 0), (36, 15)), ((0, 18), (37, 0)), ((5, 2), (30, 17)),
+             ((0, 0), (0, 3))]
+    for (s, t), path in zip(pairs, route_batch(nodes_map_raw, pairs, 
+                                               processes = 1)):
+        print s, '->', t, 'route length:', len(path)
+
+if __name__ == '__main__':
+    from cProfile import Profile
+    p = Profile()
+    p.runcall(_test)
+    p.print_stats(sort = 1)
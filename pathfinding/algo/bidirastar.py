@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2011 by Xueqiao Xu <xueqiaoxu@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from heapq import *
+
+import sys
+sys.path.insert(0, '..')
+
+from astar import AStar, _Node
+from graph import MASK_MOVES
+from components import unreachable
+from const.constants import *
+
+
+class BiDirAStar(AStar):
+    """Bi-Directional A*.
+    Runs a search from the source towards the target and another one
+    from the target towards the source, each time expanding the
+    direction with the smaller open list.
+
+    Both searches share the average potential 
+        p(v) = (Ht(v) - Hs(v)) / 2
+    where Ht and Hs are the heuristic distances to the target and to
+    the source. The search from the source orders its nodes by 
+    G + p(v), and the one from the target by G - p(v). When the
+    heuristic is consistent, this is a bi-directional Dijkstra on 
+    edges reweighted with p, whose weights stay non-negative and
+    whose shortest paths are the same as the original ones.
+
+    Whenever a node reached by one search is relaxed by the other, the
+    length of the path through it is a candidate for the answer, and
+    the best candidate so far is kept as mu. Unlike BiDirBFS, the search
+    does not stop at the first meeting: it goes on until the sum of the
+    smallest keys of the two open lists is no less than mu, after which
+    no shorter path can exist. A node already closed by the opposite
+    search is closed without being expanded, as the paths through it 
+    have already been counted in mu.
+
+    The keys are doubled to keep them integers.
+
+    *NOTE* The path is guaranteed to be the shortest one when the
+    heuristic is consistent. On grids with diagonal moves costing
+    DDIST, CHEBYSHEV and OCTILE are; MANHATTAN and EUCLIDEAN may 
+    overestimate diagonal moves (see AStar.h_admissible), so the 
+    default heuristic here is OCTILE.
+    """
+
+    def __init__(self, raw_graph, heuristic = OCTILE):
+        """Create a new instance of Bi-Directional A* path finder.
+        Refer to AStar.__init__ for the parameters.
+        """
+        AStar.__init__(self, raw_graph, heuristic)
+
+        # the open list of the search from the target
+        self.ropen_list = []
+
+        # the length of the shortest path found so far, and the node
+        # where the two searches met on it
+        self.mu = INF
+        self.meet = None
+
+    def _init_nodes(self):
+        """Allocate the nodes of both searches. self.nodes are the
+        nodes of the search from the source, and self.rnodes those of
+        the search from the target.
+        """
+        AStar._init_nodes(self)
+        self.rnodes = [[_Node()
+                        for x in xrange(self.n_col)]
+                            for y in xrange(self.n_row)]
+
+    def step(self, record = None):
+        """Starts the computation of the shortest path.
+        Refer to AStar.step for the details. Records of the search from
+        the source carry G values, and those of the search from the
+        target carry the distances to the target as H values.
+        """
+        if unreachable(self.grid, self.source, self.target):
+            return
+
+        # the potentials of the source and the target cancel out in
+        # the sum of the keys, so both can start from zero.
+        for nodes, open_list, (x, y) in ((self.nodes, self.open_list,
+                                          self.source),
+                                         (self.rnodes, self.ropen_list,
+                                          self.target)):
+            nodes[y][x].g = 0
+            nodes[y][x].f = 0
+            nodes[y][x].status = OPENED
+            open_list.append((0, 0, (x, y)))
+
+        while self.open_list and self.ropen_list:
+
+            # drop the outdated entries on top of the open lists, so
+            # that the tops hold the smallest keys.
+            for nodes, open_list in ((self.nodes, self.open_list),
+                                     (self.rnodes, self.ropen_list)):
+                while open_list:
+                    x, y = open_list[0][2]
+                    if nodes[y][x].status != CLOSED:
+                        break
+                    heappop(open_list)
+            if not self.open_list or not self.ropen_list:
+                break
+
+            if self.open_list[0][0] + self.ropen_list[0][0] >= \
+                    2 * self.mu:
+                break
+
+            if len(self.open_list) <= len(self.ropen_list):
+                self._expand(self.nodes, self.rnodes, self.open_list,
+                             self.target, record)
+            else:
+                self._expand(self.rnodes, self.nodes, self.ropen_list,
+                             self.source, record)
+            yield
+
+        if self.meet:
+            self._retrace()
+        yield
+
+    def solve(self):
+        """Run step to its end and return the path, instead of the 
+        search from the source only of AStar.solve.
+        """
+        for i in self.step():
+            pass
+        return self.path
+
+    def _expand(self, nodes, other, open_list, goal, record):
+        """Close the node with the smallest key of one search and relax
+        its neighbours.
+
+        :Parameters:
+            nodes : the nodes of this search.
+            other : the nodes of the opposite search.
+            open_list : the open list of this search.
+            goal : (x, y) the node this search is heading to.
+        """
+        x, y = heappop(open_list)[2]
+        node = nodes[y][x]
+        node.status = CLOSED
+        if record != None:
+            record.append(('CLOSE', (x, y)))
+
+        if other[y][x].status == CLOSED:
+            return
+
+        # the record key of the distance from the search's origin
+        which = 'g' if nodes is self.nodes else 'h'
+        gx, gy = goal
+        ox, oy = self.source if goal == self.target else self.target
+        masks = self.grid.masks()
+        for dx, dy, dist in MASK_MOVES[masks[y * self.n_col + x]]:
+            nx = x + dx
+            ny = y + dy
+            nxt = nodes[ny][nx]
+            if nxt.status == CLOSED:
+                continue
+            ng = node.g + dist
+            if nxt.g == None or ng < nxt.g:
+                if nxt.status != OPENED:
+                    nxt.status = OPENED
+                    if record != None:
+                        record.append(('OPEN', (nx, ny)))
+                nxt.g = ng
+                nxt.parent = (x, y)
+                # the doubled key 2 * (G + p), with p the potential of
+                # this search
+                h = self.h_func(abs(nx - gx), abs(ny - gy))
+                nxt.f = 2 * ng + h - self.h_func(abs(nx - ox), 
+                                                 abs(ny - oy))
+                heappush(open_list, (nxt.f, h, (nx, ny)))
+                if record != None:
+                    record.append(('VALUE', (which, (nx, ny), ng)))
+                    record.append(('PARENT', ((nx, ny), (x, y))))
+
+                # the two searches meet at this node
+                og = other[ny][nx].g
+                if og != None and ng + og < self.mu:
+                    self.mu = ng + og
+                    self.meet = (nx, ny)
+
+    def _retrace(self):
+        """Join the path from the source to the meeting node and the
+        path from the meeting node to the target.
+        """
+        s_path = [self.meet]
+        while s_path[-1] != self.source:
+            x, y = s_path[-1]
+            s_path.append(self.nodes[y][x].parent)
+        s_path.reverse()
+
+        t_path = [self.meet]
+        while t_path[-1] != self.target:
+            x, y = t_path[-1]
+            t_path.append(self.rnodes[y][x].parent)
+        self.path = s_path + t_path[1:]
+
+
+def _test():
+    nodes_map_raw = '''
+                    S0000000000000000000000000100000000000
+                    00000000000000000000110000010000000000
+                    00000000000000000000100000001000000000
+                    10000111110101000001100000001000000000
+                    01111100010001000010100000010000000000
+                    00000100001111100100100001110000110000
+                    00001100000001011000000100000001000000
+                    00000100000000101000000000011110000001
+                    00000010000000000111111111100000000011
+                    00000001000000000000000001100000111100
+                    00000000110000000000000000010011000000
+                    00000000010000000001100000001000000000
+                    00000000010000000000110000000111111000
+                    00000000010000000000010000000000000000
+                    00000000011000111111111111111111111111
+                    000000000100000110000010000000000000T0
+                    00000000001100000100001000000000000000
+                    00000000000100000011000000000000000000
+                    00000000000010000000000000000000000000
+                    '''
+    graph2 = [list(row) for row in nodes_map_raw.split()]
+    nr = len(graph2)
+    nc = len(graph2[0])
+    bda = BiDirAStar(nodes_map_raw)
+    for i in bda.step():
+        pass
+    if bda.path:
+        for y in xrange(nr):
+            for x in xrange(nc):
+                if (x, y) == bda.source:
+                    print 'S',
+                elif (x, y) == bda.target:
+                    print 'T',
+                elif (x, y) in bda.path:
+                    print '.',
+                elif graph2[y][x] == BLOCKED:
+                    print 'X',
+                else:
+                    print ' ',
+            print
+        print 'Route length:', len(bda.path)
+    else:
+        print 'Failed to find the path'
+
+if __name__ == '__main__':
+    from cProfile import Profile
+    p = Profile()
+    p.runcall(_test)
+    p.print_stats(sort = 1)
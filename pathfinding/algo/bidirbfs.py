@@ -25,7 +25,9 @@ from heapq import *
 import sys
 sys.path.insert(0, '..')
 
-from graph import is_walkable, InvalidMap
+from graph import MASK_MOVES, InvalidMap
+from mapcache import load_map
+from components import unreachable
 from const.constants import *
 
 class _Node(object):
@@ -63,11 +65,11 @@ class BiDirBFS(object):
                     T000
                     '''
         """
-        self.graph = raw_graph.split()
-        self.n_row = len(self.graph)
-        self.n_col = len(self.graph[0])
-        self.source = None
-        self.target = None
+        self.grid, self.source, self.target = load_map(raw_graph)
+        self.graph = self.grid.rows
+        self.n_row = self.grid.n_row
+        self.n_col = self.grid.n_col
+        self.masks = self.grid.masks()
         self.path = []
         self.success = False
 
@@ -76,13 +78,6 @@ class BiDirBFS(object):
                         for x in xrange(self.n_col)]
                             for y in xrange(self.n_row)]
        
-        # get source and target coordinates
-        for y in xrange(self.n_row):
-            for x in xrange(self.n_col):
-                if self.graph[y][x] == SOURCE:
-                    self.source = (x, y)
-                elif self.graph[y][x] == TARGET:
-                    self.target = (x, y)
         if not all((self.source, self.target)):
             raise InvalidMap('No source or target given')
 
@@ -98,6 +93,9 @@ class BiDirBFS(object):
                 if a queue is specified, a record of each operation 
                 (OPEN, CLOSE, etc) will be pushed into the queue.
         """
+        if unreachable(self.grid, self.source, self.target):
+            return
+
         # push the source node into the source queue and the
         # target node into the target queue
         sx, sy = self.source
@@ -123,6 +121,55 @@ class BiDirBFS(object):
 
 
 
+    def solve(self):
+        """Find the path like step, but in a plain loop without the 
+        yields and the records, and return it.
+        """
+        if unreachable(self.grid, self.source, self.target):
+            return self.path
+
+        sx, sy = self.source
+        tx, ty = self.target
+        self.queue_source.append((0, self.source))
+        self.queue_target.append((0, self.target))
+        self.nodes[sy][sx].g = 0
+        self.nodes[ty][tx].h = 0
+        self.nodes[sy][sx].visited_by = CSOURCE
+        self.nodes[ty][tx].visited_by = CTARGET
+
+        while self.queue_source and self.queue_target:
+            meet = self._sweep(self.queue_source, CSOURCE, CTARGET)
+            if meet:
+                self._retrace(*meet)
+                break
+            meet = self._sweep(self.queue_target, CTARGET, CSOURCE)
+            if meet:
+                self._retrace(meet[1], meet[0])
+                break
+        self.success = bool(self.path)
+        return self.path
+
+    def _sweep(self, queue, mine, theirs):
+        """Expand the first node of the queue of one of the trees, as 
+        _expand_source and _expand_target do. Return the positions of 
+        the node and of the node of the other tree it meets, if any.
+        The costs are only kept in the queue.
+        """
+        nodes, masks, n_col = self.nodes, self.masks, self.n_col
+        d, (x, y) = heappop(queue)
+        for dx, dy, dist in MASK_MOVES[masks[y * n_col + x]]:
+            nx = x + dx
+            ny = y + dy
+            nxt_node = nodes[ny][nx]
+            if nxt_node.visited_by == mine:
+                continue
+            if nxt_node.visited_by == theirs:
+                return (x, y), (nx, ny)
+            nxt_node.visited_by = mine
+            nxt_node.parent = (x, y)
+            heappush(queue, (d + dist, (nx, ny)))
+        return None
+
     def _expand_source(self, rec):
         """Searches from the source. Until it meets a node which 
         has been visited by the other tree.
@@ -131,78 +178,42 @@ class BiDirBFS(object):
         v, (x, y) = heappop(self.queue_source)
         node = self.nodes[y][x]
 
-        diagonal_can = [] # stores the diagonal positions that can be accessed
-
         if rec != None:
             rec.append(('CLOSE', (x, y)))
 
-        # inspect horizontally and vertically adjacent nodes
-        for i in xrange(len(XOFFSET)):
-            nx = x + XOFFSET[i]
-            ny = y + YOFFSET[i]
-            if is_walkable(nx, ny, self.n_row, self.n_col, 
-                    self.graph):
-                # if this node can be accessed, then then correponding
-                # diagonal node can be accessed.
-                diagonal_can.append(i)
-
-                nxt_node = self.nodes[ny][nx]
-                # if this node has been visited by source queue before,
-                # then there's no need to inspect it again.
-                if nxt_node.visited_by == CSOURCE:
-                    continue
-                
-                # if this node has been visited by *target* queue.
-                # Then a path from source to target exists.
-                # Reconstructs the path and return.
-                if nxt_node.visited_by == CTARGET:
-                    if rec:
-                        rec.append(('CLOSE', (nx, ny)))
-                    self._retrace((x, y), (nx, ny))
-                    self.success = True
-                    return 
-                
-                # mark this node and update its info, then push the node
-                # into the source queue
-                nxt_node.visited_by = CSOURCE
-                nxt_node.g = node.g + DIST
-                nxt_node.parent = (x, y)
-                heappush(self.queue_source, (nxt_node.g, (nx, ny)))
-
-                if rec != None:
-                    rec.append(('OPEN', (nx, ny)))
-                    rec.append(('VALUE', ('g', (nx, ny), nxt_node.g)))
-                    rec.append(('PARENT', ((nx, ny), (x, y))))
-
-        # further investigate the diagonal nodes, the procedure is identical
-        # with above
-        for i in diagonal_can:
-            nx1 = x + DAXOFFSET[i]
-            ny1 = y + DAYOFFSET[i]
-            nx2 = x + DBXOFFSET[i]
-            ny2 = y + DBYOFFSET[i]
-            npos = ((nx1, ny1), (nx2, ny2))
-            for nx, ny in npos:
-                if is_walkable(nx, ny, self.n_row, self.n_col,
-                     self.graph) and \
-                     self.nodes[ny][nx].visited_by != CSOURCE:
-                    nxt_node = self.nodes[ny][nx]
-                    if nxt_node.visited_by == CTARGET:
-                        if rec:
-                            rec.append(('CLOSE', (nx, ny)))
-                        self._retrace((x, y), (nx, ny))
-                        self.success = True
-                        return 
-                    nxt_node.visited_by = CSOURCE
-                    nxt_node.g = node.g + DDIST
-                    nxt_node.parent = (x, y)
-                    heappush(self.queue_source, (nxt_node.g, (nx, ny)))
-                    if rec != None:
-                        rec.append(('OPEN', (nx, ny)))
-                        rec.append(('VALUE', ('g', (nx, ny), 
-                            nxt_node.g)))
-                        rec.append(('PARENT', ((nx, ny), (x, y))))
-                        
+        # inspect the adjacent nodes, the horizontal and vertical ones
+        # first
+        for dx, dy, dist in MASK_MOVES[self.masks[y * self.n_col + x]]:
+            nx = x + dx
+            ny = y + dy
+            nxt_node = self.nodes[ny][nx]
+            # if this node has been visited by source queue before,
+            # then there's no need to inspect it again.
+            if nxt_node.visited_by == CSOURCE:
+                continue
+            
+            # if this node has been visited by *target* queue.
+            # Then a path from source to target exists.
+            # Reconstructs the path and return.
+            if nxt_node.visited_by == CTARGET:
+                if rec:
+                    rec.append(('CLOSE', (nx, ny)))
+                self._retrace((x, y), (nx, ny))
+                self.success = True
+                return 
+            
+            # mark this node and update its info, then push the node
+            # into the source queue
+            nxt_node.visited_by = CSOURCE
+            nxt_node.g = node.g + dist
+            nxt_node.parent = (x, y)
+            heappush(self.queue_source, (nxt_node.g, (nx, ny)))
+
+            if rec != None:
+                rec.append(('OPEN', (nx, ny)))
+                rec.append(('VALUE', ('g', (nx, ny), nxt_node.g)))
+                rec.append(('PARENT', ((nx, ny), (x, y))))
+
 
 
     def _expand_target(self, rec):
@@ -212,61 +223,29 @@ class BiDirBFS(object):
         # the procedure is identical with _expand_source.
         v, (x, y) = heappop(self.queue_target)
         node = self.nodes[y][x]
-        diagonal_can = [] 
         if rec != None:
             rec.append(('CLOSE', (x, y)))
-        for i in xrange(len(XOFFSET)):
-            nx = x + XOFFSET[i]
-            ny = y + YOFFSET[i]
-            if is_walkable(nx, ny, self.n_row, self.n_col, 
-                    self.graph):
-                diagonal_can.append(i)
-                if self.nodes[ny][nx].visited_by == CTARGET:
-                    continue
-                nxt_node = self.nodes[ny][nx]
-                if nxt_node.visited_by == CSOURCE:
-                    if rec:
-                        rec.append(('CLOSE', (nx, ny)))
-                    self._retrace((nx, ny), (x, y))
-                    self.success = True
-                    return
-                nxt_node.visited_by = CTARGET
-                nxt_node.h = node.h + DIST
-                nxt_node.parent = (x, y)
-                heappush(self.queue_target, (nxt_node.h, (nx, ny)))
-                if rec != None:
-                    rec.append(('OPEN', (nx, ny)))
-                    rec.append(('VALUE', ('h', (nx, ny), 
-                        nxt_node.h)))
-                    rec.append(('PARENT', ((nx, ny), (x, y))))
-        
-        # further investigate the diagonal nodes
-        for i in diagonal_can:
-            nx1 = x + DAXOFFSET[i]
-            ny1 = y + DAYOFFSET[i]
-            nx2 = x + DBXOFFSET[i]
-            ny2 = y + DBYOFFSET[i]
-            npos = ((nx1, ny1), (nx2, ny2))
-            for nx, ny in npos:
-                if is_walkable(nx, ny, self.n_row, self.n_col,
-                     self.graph) and \
-                     self.nodes[ny][nx].visited_by != CTARGET:
-                    nxt_node = self.nodes[ny][nx]
-                    if nxt_node.visited_by == CSOURCE:
-                        if rec:
-                            rec.append(('CLOSE', (nx, ny)))
-                        self._retrace((nx, ny), (x, y))
-                        self.success = True
-                        return
-                    nxt_node.visited_by = CTARGET
-                    nxt_node.h = node.h + DDIST
-                    nxt_node.parent = (x, y)
-                    heappush(self.queue_target, (nxt_node.h, (nx, ny)))
-                    if rec != None:
-                        rec.append(('OPEN', (nx, ny)))
-                        rec.append(('VALUE', ('h', (nx, ny), 
-                            nxt_node.h)))
-                        rec.append(('PARENT', ((nx, ny), (x, y))))
+        for dx, dy, dist in MASK_MOVES[self.masks[y * self.n_col + x]]:
+            nx = x + dx
+            ny = y + dy
+            nxt_node = self.nodes[ny][nx]
+            if nxt_node.visited_by == CTARGET:
+                continue
+            if nxt_node.visited_by == CSOURCE:
+                if rec:
+                    rec.append(('CLOSE', (nx, ny)))
+                self._retrace((nx, ny), (x, y))
+                self.success = True
+                return
+            nxt_node.visited_by = CTARGET
+            nxt_node.h = node.h + dist
+            nxt_node.parent = (x, y)
+            heappush(self.queue_target, (nxt_node.h, (nx, ny)))
+            if rec != None:
+                rec.append(('OPEN', (nx, ny)))
+                rec.append(('VALUE', ('h', (nx, ny), 
+                    nxt_node.h)))
+                rec.append(('PARENT', ((nx, ny), (x, y))))
 
 
 
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2011 by Xueqiao Xu <xueqiaoxu@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import re
+import collections
+from array import array
+
+import sys
+sys.path.insert(0, '..')
+
+from const.constants import *
+
+# the runs of walkable cells in a row
+_RUNS = re.compile('[^%s]+' % re.escape(BLOCKED))
+
+
+class Components(object):
+    """The connected components of the walkable cells of a map.
+
+    In every neighbour mode, a diagonal move is only allowed when one
+    of the two orthogonal cells beside it is walkable, and then the 
+    move can be made through that cell as well, so the components are
+    those of the horizontal and vertical moves, whatever the mode.
+
+    Each walkable cell carries a label, and the labels of a component 
+    are joined in a union-find forest. Two cells are connected exactly
+    when their labels have the same root, which any finder can check 
+    before searching, instead of exploring the whole component of the
+    source to find out that the target is not in it.
+    """
+    def __init__(self, grid):
+        self.n_row = grid.n_row
+        self.n_col = grid.n_col
+        # the label of each cell at y * n_col + x, -1 if blocked
+        self.labels = array('i', [-1]) * (grid.n_row * grid.n_col)
+        # the union-find parent of each label
+        self.parent = array('i')
+        self._label_runs(grid.rows)
+
+    def connected(self, a, b):
+        """Return whether a path exists between the cells a and b.
+        """
+        la = self.labels[a[1] * self.n_col + a[0]]
+        lb = self.labels[b[1] * self.n_col + b[0]]
+        return la >= 0 and lb >= 0 and self._find(la) == self._find(lb)
+
+    def patched(self, grid, cells):
+        """Return the Components of an edited version of the map. Only
+        the components around the changed cells are searched again,
+        unless the searches grow larger than labelling the whole map.
+        """
+        comp = Components.__new__(Components)
+        comp.n_row = self.n_row
+        comp.n_col = self.n_col
+        comp.labels = array('i', self.labels)
+        comp.parent = array('i', self.parent)
+        if not comp._update(grid.rows, cells):
+            return Components(grid)
+        return comp
+
+    def nbytes(self):
+        return self.labels.itemsize * len(self.labels) + \
+               self.parent.itemsize * len(self.parent)
+
+    def _label_runs(self, rows):
+        """Label the map one run of walkable cells at a time, joining
+        each run with the runs it touches in the row above. The runs are
+        found again in a second pass to give their cells the label of 
+        their root, rather than kept in between.
+        """
+        labels, parent, n_col = self.labels, self.parent, self.n_col
+        above = []
+        for y, row in enumerate(rows):
+            current = []
+            k = 0
+            for match in _RUNS.finditer(row):
+                x0, x1 = match.span()
+                label = len(parent)
+                parent.append(label)
+                # the runs above ending before this one can not touch
+                # the next ones either
+                while k < len(above) and above[k][1] <= x0:
+                    k += 1
+                j = k
+                while j < len(above) and above[j][0] < x1:
+                    self._union(label, above[j][2])
+                    j += 1
+                current.append((x0, x1, label))
+            above = current
+
+        # give all the cells the label of their root, the runs being 
+        # labelled in the same order as above
+        label = 0
+        for y, row in enumerate(rows):
+            for match in _RUNS.finditer(row):
+                x0, x1 = match.span()
+                labels[y * n_col + x0:y * n_col + x1] = \
+                    array('i', [self._find(label)]) * (x1 - x0)
+                label += 1
+
+    def _update(self, rows, cells):
+        """Update the labels for the changed cells, return False if 
+        the searches have been given up.
+        """
+        labels, n_col = self.labels, self.n_col
+        blocked = []
+        opened = []
+        for x, y in cells:
+            i = y * n_col + x
+            if rows[y][x] == BLOCKED and labels[i] >= 0:
+                blocked.append(i)
+            elif rows[y][x] != BLOCKED and labels[i] < 0:
+                opened.append(i)
+
+        # an opened cell joins the components around it
+        for i in opened:
+            label = labels[i] = len(self.parent)
+            self.parent.append(label)
+            for j in self._neighbours(i):
+                self._union(label, labels[j])
+
+        # the cells are blocked one at a time, so that each part a 
+        # blocked cell cuts its component in touches it
+        budget = int(len(labels) * SPLIT_SEARCH_SHARE)
+        for i in blocked:
+            labels[i] = -1
+            starts = self._neighbours(i)
+            if len(starts) > 1:
+                budget = self._split(starts, budget)
+                if budget < 0:
+                    return False
+        return True
+
+    def _split(self, starts, budget):
+        """The cells of starts were connected through a cell which is
+        now blocked. Search from all of them at once, one cell each in
+        turn, merging the searches which meet. A search which runs out 
+        of cells before meeting the others has gone round a part of the
+        component which is now cut off, whose cells get a new label. 
+        The last search left keeps the old label, so only the smaller 
+        parts are relabelled. Return what is left of the budget of
+        cells to visit, negative if it ran out.
+        """
+        labels = self.labels
+        owner = {}
+        merged = {}
+        searches = {}
+        for k, i in enumerate(starts):
+            owner[i] = k
+            searches[k] = (collections.deque([i]), [i])
+
+        def resolve(k):
+            while k in merged:
+                k = merged[k]
+            return k
+
+        while len(searches) > 1:
+            for k in searches.keys():
+                if k not in searches or len(searches) == 1:
+                    continue
+                queue, seen = searches[k]
+                if not queue:
+                    label = len(self.parent)
+                    self.parent.append(label)
+                    for i in seen:
+                        labels[i] = label
+                    del searches[k]
+                    continue
+                i = queue.popleft()
+                budget -= 1
+                if budget < 0:
+                    return budget
+                for j in self._neighbours(i):
+                    other = owner.get(j)
+                    if other is None:
+                        owner[j] = k
+                        seen.append(j)
+                        queue.append(j)
+                        continue
+                    other = resolve(other)
+                    if other != k:
+                        # keep the search which has seen more cells, 
+                        # and go on with the rest of the neighbours in it
+                        keep, drop = (k, other) \
+                            if len(seen) >= len(searches[other][1]) \
+                            else (other, k)
+                        queue_d, seen_d = searches.pop(drop)
+                        searches[keep][0].extend(queue_d)
+                        searches[keep][1].extend(seen_d)
+                        merged[drop] = keep
+                        k = keep
+                        queue, seen = searches[k]
+        return budget
+
+    def _neighbours(self, i):
+        """Return the walkable cells beside the cell i horizontally or
+        vertically.
+        """
+        labels, n_col = self.labels, self.n_col
+        x = i % n_col
+        cells = []
+        if x > 0 and labels[i - 1] >= 0:
+            cells.append(i - 1)
+        if x < n_col - 1 and labels[i + 1] >= 0:
+            cells.append(i + 1)
+        if i >= n_col and labels[i - n_col] >= 0:
+            cells.append(i - n_col)
+        if i + n_col < len(labels) and labels[i + n_col] >= 0:
+            cells.append(i + n_col)
+        return cells
+
+    def _find(self, label):
+        parent = self.parent
+        while parent[label] != label:
+            # path halving
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+
+    def _union(self, a, b):
+        a = self._find(a)
+        b = self._find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+
+def components_of(grid):
+    """Return the Components of the GridMap, kept along with it.
+    """
+    return grid.derived('components', lambda: Components(grid))
+
+
+def unreachable(grid, source, target):
+    """Return whether the target can not be reached from the source 
+    on the GridMap, in constant time once the map is labelled.
+    """
+    return not components_of(grid).connected(source, target)
+
+
+def _test():
+    from graph import GridMap
+    nodes_map_raw = '''
+                    0000100000
+                    0000100000
+                    1111100000
+                    0000000111
+                    0000001000
+                    '''
+    grid = GridMap(nodes_map_raw.split())
+    comp = components_of(grid)
+    for a, b in (((0, 0), (3, 1)), ((0, 0), (9, 4)), ((0, 4), (9, 0)),
+                 ((9, 4), (8, 4))):
+        print a, b, comp.connected(a, b)
+
+if __name__ == '__main__':
+    from cProfile import Profile
+    p = Profile()
+    p.runcall(_test)
+    p.print_stats(sort = 1)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2011 by Xueqiao Xu <xueqiaoxu@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+from heapq import *
+
+import sys
+sys.path.insert(0, '..')
+
+from const.constants import *
+
+
+class ContractionHierarchy(object):
+    """The contraction hierarchy of a general graph, in the adjacency
+    list representation taken by Dijkstra. It may be directed.
+
+    The nodes are contracted one at a time, from the least important 
+    to the most important. Contracting a node v removes it from the 
+    remaining graph, adding a shortcut u -> w of weight 
+    dist(u, v) + dist(v, w) for each pair of its neighbours whose
+    shortest path went through v. The rank of a node is its position in
+    this order. Each shortest path of the original graph then has an 
+    equally short counterpart going up in rank and then down, which is
+    found by two small searches climbing up from both ends, see 
+    CHDijkstra.
+
+    The importance of a node is estimated by its edge difference (the 
+    shortcuts its contraction adds minus the edges it removes) plus 
+    the number of its neighbours already contracted, which spreads the
+    contraction evenly over the graph. The estimates are updated lazily
+    when a node is about to be contracted.
+    """
+
+    def __init__(self, graph):
+        """Contract the graph.
+
+        :Parameters:
+            graph : {nodeid1: {nodeid2: dist, ... }, ... }
+                Same as the graph of Dijkstra.
+        """
+        # the remaining graph, in both directions. Loops are dropped,
+        # as they are never part of a shortest path.
+        self._out = dict([(u, {}) for u in graph])
+        self._in = dict([(u, {}) for u in graph])
+        for u, adj in graph.iteritems():
+            for v, w in adj.iteritems():
+                if v != u:
+                    self._out[u][v] = w
+                    self._out.setdefault(v, {})
+                    self._in.setdefault(v, {})[u] = w
+
+        # the edges to higher ranked nodes: up[u] = {v: w} for the 
+        # edges u -> v, and down[v] = {u: w} for the edges u -> v 
+        # walked backwards from v
+        self.up = {}
+        self.down = {}
+        self.rank = {}
+        # the node skipped by each shortcut (u, w)
+        self.middle = {}
+        self.n_shortcuts = 0
+
+        self._contracted_neighbours = dict.fromkeys(self._out, 0)
+        self._contract_all()
+        del self._out, self._in, self._contracted_neighbours
+
+    def __len__(self):
+        return len(self.rank)
+
+    def unpack(self, u, v):
+        """Return the nodes of the original path of the edge u -> v,
+        without u.
+        """
+        nodes = []
+        stack = [(u, v)]
+        while stack:
+            a, b = stack.pop()
+            x = self.middle.get((a, b))
+            if x is None:
+                nodes.append(b)
+            else:
+                stack.append((x, b))
+                stack.append((a, x))
+        return nodes
+
+    def _contract_all(self):
+        heap = [(self._priority(v), v) for v in self._out]
+        heapify(heap)
+        while heap:
+            priority, v = heappop(heap)
+            # lazy update: the priority may have risen since it was 
+            # pushed, contract only if it is still the least one
+            priority = self._priority(v)
+            if heap and priority > heap[0][0]:
+                heappush(heap, (priority, v))
+                continue
+            self._contract(v)
+
+    def _priority(self, v):
+        removed = len(self._in[v]) + len(self._out[v])
+        added = len(self._shortcuts(v))
+        return added - removed + self._contracted_neighbours[v]
+
+    def _shortcuts(self, v):
+        """Return the list of (u, w, weight) shortcuts needed if v was
+        contracted now.
+        """
+        shortcuts = []
+        out = self._out[v]
+        for u, wu in self._in[v].iteritems():
+            targets = dict([(w, wu + ww) for w, ww in out.iteritems() 
+                            if w != u])
+            if not targets:
+                continue
+            witness = self._witness(u, v, targets)
+            for w, weight in targets.iteritems():
+                if witness.get(w, INF) > weight:
+                    shortcuts.append((u, w, weight))
+        return shortcuts
+
+    def _witness(self, source, skipped, targets):
+        """Run a Dijkstra search from source in the remaining graph 
+        without the skipped node, until the targets are settled, the
+        distances exceed the longest shortcut, or CH_WITNESS_SETTLED
+        nodes are settled. Return the distances found.
+        """
+        limit = max(targets.itervalues())
+        left = len(targets)
+        dist = {source: 0}
+        heap = [(0, source)]
+        settled = 0
+        out = self._out
+        while heap and settled < CH_WITNESS_SETTLED:
+            d, u = heappop(heap)
+            if d > dist[u]:
+                continue
+            if d > limit:
+                break
+            settled += 1
+            if u in targets:
+                left -= 1
+                if not left:
+                    break
+            for x, w in out[u].iteritems():
+                nd = d + w
+                if x != skipped and nd < dist.get(x, INF):
+                    dist[x] = nd
+                    heappush(heap, (nd, x))
+        return dist
+
+    def _contract(self, v):
+        for u, w, weight in self._shortcuts(v):
+            if weight < self._out[u].get(w, INF):
+                if w not in self._out[u]:
+                    self.n_shortcuts += 1
+                self._out[u][w] = weight
+                self._in[w][u] = weight
+                self.middle[(u, w)] = v
+
+        self.rank[v] = len(self.rank)
+        self.up[v] = self._out.pop(v)
+        self.down[v] = self._in.pop(v)
+        for w in self.up[v]:
+            del self._in[w][v]
+            self._contracted_neighbours[w] += 1
+        for u in self.down[v]:
+            del self._out[u][v]
+            self._contracted_neighbours[u] += 1
+
+
+class CHDijkstra(object):
+    """Point to point queries on a ContractionHierarchy.
+
+    A forward search from the source and a backward search from the 
+    target each follow only the edges leading to higher ranked nodes,
+    so they settle a small part of the graph. The shortest path goes 
+    through the node where the sum of their distances is the least, and
+    its shortcuts are unpacked into the nodes of the original graph. 
+    The path is in the same format as the one of Dijkstra.
+    """
+
+    def __init__(self, hierarchy, source, target):
+        """
+        :Parameters:
+            hierarchy : ContractionHierarchy
+                The contracted graph, which may be shared by any number
+                of queries.
+
+            source : nodeid 
+                Source node.
+
+            target : nodeid
+                Destination node.
+        """
+        self.hierarchy = hierarchy
+        self.source = source
+        self.target = target
+        self.path = []
+
+    def step(self, record = None):
+        """Starts the computation of the shortest path.
+        :Parametes:
+            record : deque
+                if a queue is specified, a CLOSE record of each node 
+                settled by either search will be pushed into the queue.
+        """
+        h = self.hierarchy
+        s, t = self.source, self.target
+        if s not in h.rank or t not in h.rank:
+            yield
+            return
+
+        # the state of the forward and backward searches
+        dist = ({s: 0}, {t: 0})
+        parent = ({}, {})
+        heaps = ([(0, s)], [(0, t)])
+        edges = (h.up, h.down)
+        best = INF
+        meet = None
+        while True:
+            # a search stops once its least distance exceeds the best
+            # path, as it can not find a better one any more
+            sides = [i for i in (0, 1) if heaps[i] and heaps[i][0][0] < best]
+            if not sides:
+                break
+            side = min(sides, key = lambda i: heaps[i][0][0])
+            d, u = heappop(heaps[side])
+            if d > dist[side][u]:
+                continue
+            if record != None:
+                record.append(('CLOSE', u))
+
+            other = dist[1 - side].get(u)
+            if other is not None and d + other < best:
+                best = d + other
+                meet = u
+            for v, w in edges[side][u].iteritems():
+                nd = d + w
+                if nd < dist[side].get(v, INF):
+                    dist[side][v] = nd
+                    parent[side][v] = u
+                    heappush(heaps[side], (nd, v))
+            yield
+
+        if meet is not None:
+            self._retrace(parent, meet)
+        yield
+
+    def _retrace(self, parent, meet):
+        """Join the upward paths from the source and the target at the
+        meeting node and unpack their shortcuts.
+        """
+        h = self.hierarchy
+        up = [meet]
+        while up[-1] != self.source:
+            up.append(parent[0][up[-1]])
+        up.reverse()
+        down = [meet]
+        while down[-1] != self.target:
+            down.append(parent[1][down[-1]])
+
+        path = [self.source]
+        for u, v in zip(up, up[1:]) + zip(down, down[1:]):
+            path.extend(h.unpack(u, v))
+        self.path = path
+
+
+def _test():
+    # a small road network: A - B - C - D with a slow direct road A - D
+    # and a one-way street D -> E
+    graph = {'A': {'B': 2, 'D': 9},
+             'B': {'A': 2, 'C': 3},
+             'C': {'B': 3, 'D': 2},
+             'D': {'C': 2, 'A': 9, 'E': 1},
+             'E': {}}
+    ch = ContractionHierarchy(graph)
+    print 'ranks:', sorted(ch.rank, key = ch.rank.get)
+    print 'shortcuts:', ch.n_shortcuts
+    for s, t in (('A', 'E'), ('E', 'A'), ('C', 'A')):
+        q = CHDijkstra(ch, s, t)
+        for i in q.step():
+            pass
+        print s, '->', t, q.path or 'no path'
+
+if __name__ == '__main__':
+    from cProfile import Profile
+    p = Profile()
+    p.runcall(_test)
+    p.print_stats(sort = 1)
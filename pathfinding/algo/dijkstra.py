@@ -21,17 +21,23 @@
 # THE SOFTWARE.
 
 from heapq import *
+from array import array
 
 import sys
 sys.path.insert(0, '..')
 
 from const.constants import *
-from graph import make_graph
+from graph import make_graph, CSRGraph
+from mapcache import load_map
+from components import unreachable
 
 
 class Dijkstra(object):
     """This class is designed for solving general graphs without
     negative weighted edges, not limited to grid maps.
+
+    For many queries on the same graph, contraction.CHDijkstra finds
+    the same paths on a graph preprocessed once.
     """
 
     def __init__(self, graph, source, target):
@@ -49,6 +55,9 @@ class Dijkstra(object):
                     graph = {'A': {'B': 1, 'C': 1},
                              'B': {'A': 1},
                              'C': {'A': 1}}
+                A CSRGraph returned by make_graph(s, csr = True) is 
+                also accepted, in which case dist and parent are arrays
+                indexed by the node numbers of the graph.
 
             source : nodeid 
                 Source coordinate.
@@ -61,14 +70,25 @@ class Dijkstra(object):
         self.target = target
         self.path = []
         
-        # record of each node's parent
-        self.parent = {} 
-        
-        # record of each node's estimate distance
-        self.dist = dict([(pos, INF) for pos in graph]) 
+        if isinstance(graph, CSRGraph):
+            n = len(graph)
+            self.parent = array('i', [-1]) * n
+            self.dist = array('i', [INF]) * n
+            self.closed = bytearray(n)
+        else:
+            # record of each node's parent
+            self.parent = {} 
+            
+            # record of each node's estimate distance
+            self.dist = dict([(pos, INF) for pos in graph]) 
 
-        # set of open nodes
-        self.nodes = set([pos for pos in graph])
+            # set of closed nodes, whose shortest distance is settled
+            self.closed = set()
+
+        # a priority queue of (distance, nodeid) pairs. A node may be
+        # pushed multiple times when its distance drops; the stale 
+        # entries are skipped when popped (lazy deletion).
+        self.open_list = []
        
     def step(self, record = None):
         """Starts the computation of shortest path.
@@ -77,21 +97,27 @@ class Dijkstra(object):
                 if a queue is specified, a record of each operation 
                 (OPEN, CLOSE, etc) will be pushed into the queue.
         """
+        if isinstance(self.graph, CSRGraph):
+            return self._step_csr(record)
+        return self._step(record)
+
+    def _step(self, record):
+        """The search on an adjacency-list-represented graph.
+        """
         self.dist[self.source] = 0
-        while self.dist:
+        heappush(self.open_list, (0, self.source))
+        while self.open_list:
             # get the node with minimum estimated distance
-            node = min(self.nodes, key = self.dist.__getitem__)
-            self.nodes.remove(node)
+            d, node = heappop(self.open_list)
+
+            # skip the outdated entries of already settled nodes
+            if node in self.closed or d > self.dist[node]:
+                continue
+            self.closed.add(node)
 
             if record != None:
                 record.append(('CLOSE', node))
             
-            # if the node with minimum estimated distance has the 
-            # distance of infinity, then there is no such path from 
-            # source to distance.
-            if self.dist[node] == INF:
-                break
-            
             # if the node is the target, then the path exists.
             if node == self.target:
                 self._retrace()
@@ -99,14 +125,121 @@ class Dijkstra(object):
 
             # inspect the adjacent nodes.
             for adj in self.graph[node]:
-                if adj in self.nodes:
-                    self._relax(node, adj, record)
+                if adj not in self.closed:
+                    if self._relax(node, adj, record):
+                        heappush(self.open_list, (self.dist[adj], adj))
                     if record != None:
                         record.append(('OPEN', adj))
             yield
+        # if the open list is exhausted before reaching the target, 
+        # there is no such path from source to target.
         yield
          
 
+    def _step_csr(self, record):
+        """The search on a CSRGraph. The node numbers are translated
+        back into coordinates in the records and the path.
+        """
+        g = self.graph
+        offsets, neighbours, weights = g.offsets, g.neighbours, g.weights
+        dist, parent, closed = self.dist, self.parent, self.closed
+        src = g.index(self.source)
+        dst = g.index(self.target)
+
+        dist[src] = 0
+        heappush(self.open_list, (0, src))
+        while self.open_list:
+            d, u = heappop(self.open_list)
+            if closed[u] or d > dist[u]:
+                continue
+            closed[u] = 1
+
+            if record != None:
+                record.append(('CLOSE', g.pos(u)))
+            
+            if u == dst:
+                self.path = [dst]
+                while self.path[-1] != src:
+                    self.path.append(parent[self.path[-1]])
+                self.path = [g.pos(i) for i in reversed(self.path)]
+                break
+
+            for k in xrange(offsets[u], offsets[u + 1]):
+                v = neighbours[k]
+                if closed[v]:
+                    continue
+                nd = d + weights[k]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    parent[v] = u
+                    heappush(self.open_list, (nd, v))
+                    if record != None:
+                        record.append(('VALUE', ('f', g.pos(v), nd)))
+                        record.append(('PARENT', (g.pos(v), g.pos(u))))
+                if record != None:
+                    record.append(('OPEN', g.pos(v)))
+            yield
+        yield
+
+    def solve(self):
+        """Find the shortest path like step, but in a plain loop without
+        the yields and the records, and return it.
+        """
+        if isinstance(self.graph, CSRGraph):
+            self._solve_csr()
+        else:
+            self._solve()
+        return self.path
+
+    def _solve(self):
+        graph, dist, parent, closed = self.graph, self.dist, self.parent, \
+                                      self.closed
+        open_list, target = self.open_list, self.target
+        dist[self.source] = 0
+        heappush(open_list, (0, self.source))
+        while open_list:
+            d, u = heappop(open_list)
+            if u in closed or d > dist[u]:
+                continue
+            closed.add(u)
+            if u == target:
+                self._retrace()
+                break
+            for v, w in graph[u].iteritems():
+                if v not in closed and d + w < dist[v]:
+                    dist[v] = d + w
+                    parent[v] = u
+                    heappush(open_list, (d + w, v))
+
+    def _solve_csr(self):
+        g = self.graph
+        offsets, neighbours, weights = g.offsets, g.neighbours, g.weights
+        dist, parent, closed = self.dist, self.parent, self.closed
+        open_list = self.open_list
+        src = g.index(self.source)
+        dst = g.index(self.target)
+
+        dist[src] = 0
+        heappush(open_list, (0, src))
+        while open_list:
+            d, u = heappop(open_list)
+            if closed[u] or d > dist[u]:
+                continue
+            closed[u] = 1
+            if u == dst:
+                path = [dst]
+                while path[-1] != src:
+                    path.append(parent[path[-1]])
+                self.path = [g.pos(i) for i in reversed(path)]
+                break
+            for k in xrange(offsets[u], offsets[u + 1]):
+                v = neighbours[k]
+                nd = d + weights[k]
+                if nd < dist[v] and not closed[v]:
+                    dist[v] = nd
+                    parent[v] = u
+                    heappush(open_list, (nd, v))
+
     def _relax(self, u, v, record_):
         """Relax an edge.
         :Parameters:
@@ -149,10 +282,64 @@ class GridDijkstra(Dijkstra):
     we presumed in this scenario, Dijkstra's algorithm explores 
     nodes in exactly the same way as a generic Breadth-First-Search 
     algorithm.
+
+    The graph is kept along with the map in the map cache, so it is
+    only built once for all the queries on the same map. With csr set,
+    or when raw_graph is a map already loaded by load_map, it is the
+    CSRGraph, otherwise the dict of dicts.
     """
-    def __init__(self, raw_graph):
-        g, s, t = make_graph(raw_graph)
+    def __init__(self, raw_graph, csr = False):
+        grid, s, t = load_map(raw_graph)
+        if csr or isinstance(raw_graph, tuple):
+            g = grid.csr()
+        else:
+            g = grid.derived('graph', lambda: make_graph(
+                    grid.rows, neighbours = grid.neighbours)[0])
         Dijkstra.__init__(self, g, s, t)
+        self.grid = grid
+
+    def step(self, record = None):
+        """Starts the computation of shortest path.
+        Refer to Dijkstra.step for the details.
+        """
+        if unreachable(self.grid, self.source, self.target):
+            return iter(())
+        return Dijkstra.step(self, record)
+
+    def solve(self):
+        """Same as Dijkstra.solve.
+        """
+        if unreachable(self.grid, self.source, self.target):
+            return self.path
+        return Dijkstra.solve(self)
+
+
+def csr_distances(g, source):
+    """Run Dijkstra's algorithm from the node number source over the 
+    whole CSRGraph, and return the arrays of the distance and parent of
+    every node, INF and -1 for the nodes not reached. On grid maps the
+    moves cost the same both ways, so the distance from the source is
+    also the distance to it, and the parent of a node is its next step
+    towards it.
+    """
+    offsets, neighbours, weights = g.offsets, g.neighbours, g.weights
+    n = len(g)
+    dist = array('i', [INF]) * n
+    parent = array('i', [-1]) * n
+    dist[source] = 0
+    heap = [(0, source)]
+    while heap:
+        d, u = heappop(heap)
+        if d > dist[u]:
+            continue
+        for k in xrange(offsets[u], offsets[u + 1]):
+            v = neighbours[k]
+            nd = d + weights[k]
+            if nd < dist[v]:
+                dist[v] = nd
+                parent[v] = u
+                heappush(heap, (nd, v))
+    return dist, parent
 
 
 def _test():
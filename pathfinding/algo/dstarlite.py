@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2011 by Xueqiao Xu <xueqiaoxu@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+from heapq import *
+from array import array
+
+import sys
+sys.path.insert(0, '..')
+
+from graph import MASK_MOVES, octile, InvalidMap
+from mapcache import load_map
+from components import unreachable
+from const.constants import *
+
+
+class DStarLite(object):
+    """D* Lite.
+    An incremental path finder which searches from the target towards
+    the source, and keeps its search state after the path is found. 
+    When the map is edited with update_map(), only the nodes whose 
+    distances to the target are affected by the edit are searched 
+    again, so replanning after a small edit costs far less than a new
+    search.
+
+    For each node, G is its distance to the target as last calculated,
+    and RHS the one-step lookahead 
+        RHS(u) = min(c(u, v) + G(v)) for each neighbour v of u
+    A node with G != RHS is inconsistent, and is kept in the priority
+    queue with the key
+        [min(G, RHS) + H(source, u) + km, min(G, RHS)]
+    where H is the Octile distance, and km the sum of the distances
+    the source has moved by, which keeps the old keys valid lower 
+    bounds instead of re-keying the queue. The search ends when the 
+    source is consistent and no key in the queue is smaller than its
+    own.
+
+    The source can be moved freely between the searches, but moving
+    the target or resizing the map restarts the search.
+    """
+
+    def __init__(self, raw_graph):
+        """Create a new instance of D* Lite path finder.
+
+        :Parameters:
+            raw_graph : str
+                A multi-line string representing the graph.
+        """
+        self._load(raw_graph)
+        self._reset()
+
+    def update_map(self, raw_graph):
+        """Switch to an edited version of the map, and prepare step() 
+        to repair the previous search.
+
+        :Return:
+            changed : int
+                the number of cells changed, or None if the search has
+                to be restarted.
+        """
+        old_rows = self.graph
+        old_size = (self.n_row, self.n_col)
+        old_target = self.target
+        last = self.source
+        self._load(raw_graph)
+        if (self.n_row, self.n_col) != old_size or \
+                self.target != old_target:
+            self._reset()
+            return None
+
+        n_row, n_col = self.n_row, self.n_col
+        if self.source != last:
+            # the keys in the queue were calculated with the H values
+            # from the old source, which may exceed the new ones by at
+            # most H(old source, new source).
+            self.km += octile(last, self.source)
+
+        # each changed cell changes the edges to and between its 
+        # neighbours, and so the RHS of all of them.
+        changed = 0
+        affected = set()
+        for y in xrange(n_row):
+            if old_rows[y] == self.graph[y]:
+                continue
+            for x in xrange(n_col):
+                if old_rows[y][x] != self.graph[y][x]:
+                    changed += 1
+                    for ny in xrange(max(y - 1, 0), min(y + 2, n_row)):
+                        for nx in xrange(max(x - 1, 0), 
+                                         min(x + 2, n_col)):
+                            affected.add(ny * n_col + nx)
+
+        t = self.target[1] * n_col + self.target[0]
+        for i in affected:
+            if i != t:
+                self.rhs[i] = self._lookahead(i)
+            self._update_vertex(i)
+        return changed
+
+    def step(self, record = None):
+        """Starts the computation of the shortest path.
+        Refer to AStar.step for the details. The G values recorded are
+        the distances to the target.
+        """
+        g, rhs = self.g, self.rhs
+        n_col = self.n_col
+        s = self.source[1] * n_col + self.source[0]
+        t = self.target[1] * n_col + self.target[0]
+        self.path = []
+        # the queued vertices are left for the next query, whose map 
+        # may join the components again
+        if unreachable(self.grid, self.source, self.target):
+            return
+
+        while True:
+            top = self._top()
+            if top is None:
+                break
+            k_old, u = top
+            if k_old >= self._key(s) and rhs[s] <= g[s]:
+                break
+            pos = (u % n_col, u // n_col)
+
+            k_new = self._key(u)
+            if k_old < k_new:
+                # the key was calculated before the source moved
+                self._push(u, k_new)
+            elif g[u] > rhs[u]:
+                # the distance of u dropped: settle it and propagate
+                # the new distance to the neighbours
+                g[u] = rhs[u]
+                del self.keys[u]
+                if record != None:
+                    record.append(('CLOSE', pos))
+                    record.append(('VALUE', ('g', pos, g[u])))
+                for v, cost in self._neighbours(u):
+                    if v != t and g[u] + cost < rhs[v]:
+                        rhs[v] = g[u] + cost
+                        self._update_vertex(v, record)
+            else:
+                # the distance of u rose: forget it, and recalculate
+                # the neighbours which got their RHS through u
+                g_old = g[u]
+                g[u] = INF
+                if record != None:
+                    record.append(('VALUE', ('g', pos, INF)))
+                for v, cost in self._neighbours(u):
+                    if v != t and rhs[v] == g_old + cost:
+                        rhs[v] = self._lookahead(v)
+                        self._update_vertex(v, record)
+                self._update_vertex(u, record)
+            yield
+
+        # the source may end overconsistent, with its distance known
+        # from RHS only
+        if rhs[s] < INF:
+            self._retrace()
+        yield
+
+    def _load(self, raw_graph):
+        self.grid, self.source, self.target = load_map(raw_graph)
+        self.graph = self.grid.rows
+        self.n_row = self.grid.n_row
+        self.n_col = self.grid.n_col
+        self.path = []
+        if not all((self.source, self.target)):
+            raise InvalidMap("No source or target given")
+
+    def _reset(self):
+        """Discard the search state and start again from the target.
+        """
+        size = self.n_row * self.n_col
+        self.g = array('i', [INF]) * size
+        self.rhs = array('i', [INF]) * size
+        self.km = 0
+
+        # the queue of (k1, k2, node) entries, and the current keys of
+        # the nodes in it. The entries whose keys differ from the 
+        # current ones are outdated, and skipped when met.
+        self.queue = []
+        self.keys = {}
+
+        t = self.target[1] * self.n_col + self.target[0]
+        self.rhs[t] = 0
+        self._push(t, self._key(t))
+
+    def _key(self, i):
+        m = min(self.g[i], self.rhs[i])
+        return (m + octile(self.source, (i % self.n_col, i // self.n_col)) +
+                self.km, m)
+
+    def _push(self, i, key):
+        self.keys[i] = key
+        heappush(self.queue, key + (i,))
+
+    def _top(self):
+        """Return (key, node) of the node with the smallest key in the
+        queue, or None if the queue is empty.
+        """
+        queue, keys = self.queue, self.keys
+        while queue:
+            k1, k2, i = queue[0]
+            if keys.get(i) == (k1, k2):
+                return (k1, k2), i
+            heappop(queue)
+        return None
+
+    def _update_vertex(self, i, record = None):
+        """Put the node into the queue with its current key if it is 
+        inconsistent, otherwise take it out of the queue.
+        """
+        if self.g[i] != self.rhs[i]:
+            if record != None and i not in self.keys:
+                record.append(('OPEN', (i % self.n_col, i // self.n_col)))
+            self._push(i, self._key(i))
+        elif i in self.keys:
+            del self.keys[i]
+
+    def _neighbours(self, i):
+        """Return the (node, cost) pairs of the moves from the node.
+        """
+        n_col = self.n_col
+        # the mask of a blocked node is 0
+        return [(i + dy * n_col + dx, cost) for dx, dy, cost in 
+                MASK_MOVES[self.grid.masks()[i]]]
+
+    def _lookahead(self, i):
+        """Return the RHS value of the node.
+        """
+        g = self.g
+        best = INF
+        for v, cost in self._neighbours(i):
+            if g[v] + cost < best:
+                best = g[v] + cost
+        return best
+
+    def _retrace(self):
+        """Follow the neighbours closest to the target from the source.
+        """
+        g, n_col = self.g, self.n_col
+        i = self.source[1] * n_col + self.source[0]
+        t = self.target[1] * n_col + self.target[0]
+        path = [i]
+        while i != t:
+            i = min([(g[v] + cost, v) for v, cost in self._neighbours(i)])[1]
+            path.append(i)
+        self.path = [(i % n_col, i // n_col) for i in path]
+
+
+def _test():
+    nodes_map_raw = '''
+                    S0000000000000000000000000100000000000
+                    00000000000000000000110000010000000000
+                    00000000000000000000100000001000000000
+                    10000111110101000001100000001000000000
+                    01111100010001000010100000010000000000
+                    00000100001111100100100001110000110000
+                    00001100000001011000000100000001000000
+                    00000100000000101000000000011110000001
+                    00000010000000000111111111100000000011
+                    00000001000000000000000001100000111100
+                    00000000110000000000000000010011000000
+                    00000000010000000001100000001000000000
+                    00000000010000000000110000000111111000
+                    00000000010000000000010000000000000000
+                    00000000011000111111111111111111111111
+                    000000000100000110000010000000000000T0
+                    00000000001100000100001000000000000000
+                    00000000000100000011000000000000000000
+                    00000000000010000000000000000000000000
+                    '''
+    dsl = DStarLite(nodes_map_raw)
+    for i in dsl.step():
+        pass
+    print 'Route length:', len(dsl.path)
+
+    # open a gap in the wall above the target and replan
+    edited = nodes_map_raw.replace('11111111111111111', 
+                                   '11111111111111101', 1)
+    print 'Changed cells:', dsl.update_map(edited)
+    for i in dsl.step():
+        pass
+
+    graph2 = [list(row) for row in edited.split()]
+    nr = len(graph2)
+    nc = len(graph2[0])
+    if dsl.path:
+        for y in xrange(nr):
+            for x in xrange(nc):
+                if (x, y) == dsl.source:
+                    print 'S',
+                elif (x, y) == dsl.target:
+                    print 'T',
+                elif (x, y) in dsl.path:
+                    print '.',
+                elif graph2[y][x] == BLOCKED:
+                    print 'X',
+                else:
+                    print ' ',
+            print
+        print 'Route length:', len(dsl.path)
+    else:
+        print 'Failed to find the path'
+
+if __name__ == '__main__':
+    from cProfile import Profile
+    p = Profile()
+    p.runcall(_test)
+    p.print_stats(sort = 1)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2011 by Xueqiao Xu <xueqiaoxu@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import threading
+import collections
+from array import array
+
+import sys
+sys.path.insert(0, '..')
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from graph import InvalidMap
+from dijkstra import csr_distances
+from mapcache import load_map
+from const.constants import *
+
+# the moving directions, indexed by the codes of a flow field. They are
+# the moves of the neighbour masks, in the same order.
+DIRECTIONS = MOVE_DIRECTIONS
+
+# the code of the cells without a next step: the target, and the 
+# blocked or unreachable cells
+NO_DIRECTION = -1
+
+# the direction code of each (dx, dy), at index (dy + 1) * 3 + dx + 1
+_CODES = [NO_DIRECTION] * 9
+for _code, (_dx, _dy) in enumerate(DIRECTIONS):
+    _CODES[(_dy + 1) * 3 + _dx + 1] = _code
+
+
+class FlowField(object):
+    """The distances of all the cells of a map to a single target, and
+    the direction of the next step towards it from each cell.
+
+    Any number of agents heading to the target follow the field in
+    constant time per step, without searching a path of their own. The
+    cell at (x, y) is stored at index y * n_col + x of each array:
+        dist : array('i') of the cost of the shortest path to the 
+            target, INF for the blocked and unreachable cells.
+        direction : array('b') of indices into DIRECTIONS, NO_DIRECTION
+            for the cells without a next step.
+    """
+    def __init__(self, n_row, n_col, target, dist, direction):
+        self.n_row = n_row
+        self.n_col = n_col
+        self.target = target
+        self.dist = dist
+        self.direction = direction
+
+    def distance(self, pos):
+        """Return the cost of the shortest path from pos to the target,
+        or INF if there is none.
+        """
+        x, y = pos
+        return self.dist[y * self.n_col + x]
+
+    def next_step(self, pos):
+        """Return the cell to move to from pos, or None if pos is the
+        target or can not reach it.
+        """
+        x, y = pos
+        code = self.direction[y * self.n_col + x]
+        if code == NO_DIRECTION:
+            return None
+        dx, dy = DIRECTIONS[code]
+        return (x + dx, y + dy)
+
+    def path(self, pos):
+        """Return the path from pos to the target by following the 
+        field, or [] if there is none.
+        """
+        if self.distance(pos) >= INF:
+            return []
+        path = [pos]
+        while path[-1] != self.target:
+            path.append(self.next_step(path[-1]))
+        return path
+
+    def nbytes(self):
+        return sum([a.itemsize * len(a) 
+                    for a in (self.dist, self.direction)])
+
+
+class _FlowFields(object):
+    """The flow fields computed on a map, keyed by their targets. Only
+    the FLOW_FIELDS_KEPT most recently used ones are kept.
+    """
+    def __init__(self):
+        self.fields = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, target, make):
+        with self.lock:
+            field = self.fields.pop(target, None)
+        if field is None:
+            field = make()
+        with self.lock:
+            self.fields[target] = field
+            while len(self.fields) > FLOW_FIELDS_KEPT:
+                self.fields.popitem(last = False)
+        return field
+
+    def nbytes(self):
+        with self.lock:
+            return sum([f.nbytes() for f in self.fields.values()])
+
+
+def flow_field(raw_graph, target = None):
+    """Compute the flow field of the map towards the target with a 
+    single Dijkstra search from the target. The fields are kept along
+    with the parsed map, so the same map and target are computed once.
+
+    :Parameters:
+        raw_graph : str
+            A multi-line string representing the graph.
+
+        target : (x, y)
+            The target of the field. Defaults to the target of the map.
+
+    :Return:
+        field : FlowField
+    """
+    grid, source, map_target = load_map(raw_graph)
+    if target is None:
+        target = map_target
+    if target is None:
+        raise InvalidMap("No target given")
+    x, y = target = tuple(target)
+    if not (0 <= x < grid.n_col and 0 <= y < grid.n_row) or \
+            grid.rows[y][x] == BLOCKED:
+        raise InvalidMap("Invalid target %r" % (target,))
+    fields = grid.derived('flow', _FlowFields)
+    return fields.get(target, lambda: _make_field(grid, target))
+
+
+def _make_field(grid, target):
+    g = grid.csr()
+    dist, parent = csr_distances(g, g.index(target))
+    if numpy is not None:
+        direction = _directions_numpy(parent, g.n_row, g.n_col)
+    else:
+        direction = _directions(parent, g.n_row, g.n_col)
+    return FlowField(g.n_row, g.n_col, target, dist, direction)
+
+
+def _directions(parent, n_row, n_col):
+    """Turn the parent of each node into the direction code of the move
+    to it.
+    """
+    direction = array('b', [NO_DIRECTION]) * len(parent)
+    codes = _CODES
+    for i, p in enumerate(parent):
+        if p >= 0:
+            dx = p % n_col - i % n_col
+            dy = p // n_col - i // n_col
+            direction[i] = codes[(dy + 1) * 3 + dx + 1]
+    return direction
+
+
+def _directions_numpy(parent, n_row, n_col):
+    """Same as _directions, but converts all the nodes at once.
+    """
+    parent = numpy.frombuffer(parent, dtype = numpy.intc)
+    nodes = numpy.arange(len(parent), dtype = numpy.intc)
+    # a node without a parent is taken as its own parent, whose move
+    # (0, 0) has no direction
+    parent = numpy.where(parent < 0, nodes, parent)
+    dx = parent % n_col - nodes % n_col
+    dy = parent // n_col - nodes // n_col
+    codes = numpy.array(_CODES, dtype = numpy.int8)
+    direction = codes[(dy + 1) * 3 + dx + 1]
+    return array('b', direction.tostring())
+
+
+def _test():
+    nodes_map_raw = '''
+                    S0000000000000000000000000100000000000
+                    00000000000000000000110000010000000000
+                    00000000000000000000100000001000000000
+                    10000111110101000001100000001000000000
+                    01111100010001000010100000010000000000
+                    00000100001111100100100001110000110000
+                    00001100000001011000000100000001000000
+                    00000100000000101000000000011110000001
+                    00000010000000000111111111100000000011
+                    00000001000000000000000001100000111100
+                    00000000110000000000000000010011000000
+                    00000000010000000001100000001000000000
+                    00000000010000000000110000000111111000
+                    00000000010000000000010000000000000000
+                    00000000011000111111111111111111111111
+                    000000000100000110000010000000000000T0
+                    00000000001100000100001000000000000000
+                    00000000000100000011000000000000000000
+                    00000000000010000000000000000000000000
+                    '''
+    field = flow_field(nodes_map_raw)
+    arrows = '^>v</\\\\/'
+    for y in xrange(field.n_row):
+        row = []
+        for x in xrange(field.n_col):
+            code = field.direction[y * field.n_col + x]
+            if (x, y) == field.target:
+                row.append('T')
+            elif code == NO_DIRECTION:
+                row.append('X' if field.distance((x, y)) == INF else '?')
+            else:
+                row.append(arrows[code])
+        print ' '.join(row)
+    print 'Route length:', len(field.path((0, 0)))
+
+if __name__ == '__main__':
+    from cProfile import Profile
+    p = Profile()
+    p.runcall(_test)
+    p.print_stats(sort = 1)
@@ -23,6 +23,14 @@
 import sys
 sys.path.insert(0, '..')
 
+import string
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from const.constants import *
 
 class InvalidMap(Exception): pass
@@ -35,19 +43,309 @@ def is_walkable(x, y, nr, nc, m):
            y >= 0 and y < nr and \
            m[y][x] != BLOCKED
 
-def make_graph(s): 
+class CSRGraph(object):
+    """A grid graph in compressed sparse row representation.
+
+    The cell at (x, y) is node number y * n_col + x. The neighbours of
+    node i are neighbours[offsets[i]:offsets[i + 1]], and the weights of
+    the corresponding edges are stored at the same positions of weights.
+    Blocked cells are nodes without any edges.
+
+    Each edge costs 8 bytes, whereas the dict of dicts returned by 
+    make_graph costs over a hundred.
+    """
+    def __init__(self, n_row, n_col, offsets, neighbours, weights):
+        self.n_row = n_row
+        self.n_col = n_col
+        self.offsets = offsets
+        self.neighbours = neighbours
+        self.weights = weights
+
+    def __len__(self):
+        return self.n_row * self.n_col
+
+    def index(self, pos):
+        """Return the node number of the coordinate.
+        """
+        x, y = pos
+        return y * self.n_col + x
+
+    def pos(self, i):
+        """Return the coordinate of the node number.
+        """
+        return (i % self.n_col, i // self.n_col)
+
+    def adjacent(self, i):
+        """Return a list of (node number, weight) pairs of the edges
+        leaving node i.
+        """
+        lo = self.offsets[i]
+        hi = self.offsets[i + 1]
+        return zip(self.neighbours[lo:hi], self.weights[lo:hi])
+
+    def nbytes(self):
+        """Return the number of bytes used by the arrays.
+        """
+        return sum([a.itemsize * len(a) 
+                    for a in (self.offsets, self.neighbours, self.weights)])
+
+
+class GridMap(object):
+    """The layout of a grid map, without its source and target.
+
+    The rows are the lines of the raw map with SOURCE and TARGET
+    replaced by NORMAL, so the same GridMap can be shared by queries 
+    with different endpoints. The structures derived from the layout
+    are built on first use and then kept along with it.
+
+    The neighbour mode, one of NEIGHBOURS_4, NEIGHBOURS_8_NO_CUT and 
+    NEIGHBOURS_8, sets the moves the finders make on the map.
+    """
+    def __init__(self, rows, neighbours = NEIGHBOURS_8):
+        self.rows = rows
+        self.n_row = len(rows)
+        self.n_col = len(rows[0])
+        self.neighbours = neighbours
+        self._csr = None
+        self._masks = None
+        self._padded = None
+        self._derived = {}
+
+    def csr(self):
+        """Return the CSRGraph of the map.
+        """
+        if self._csr is None:
+            self._csr = make_graph(self.rows, csr = True, 
+                                   neighbours = self.neighbours)[0]
+        return self._csr
+
+    def masks(self):
+        """Return the neighbour masks of the cells, see neighbour_masks.
+        The finders iterate the moves of MASK_MOVES[mask] instead of 
+        checking the cells around each node they expand.
+        """
+        if self._masks is None:
+            self._masks = neighbour_masks(self.rows, self.n_row, self.n_col,
+                                          self.neighbours)
+        return self._masks
+
+    def padded(self):
+        """Return the walkability of the cells with a border of blocked
+        cells around the map, see padded_cells. Finders which look at
+        cells other than the adjacent ones read them from there.
+        """
+        if self._padded is None:
+            self._padded = padded_cells(self.rows, self.n_col)
+        return self._padded
+
+    def with_neighbours(self, neighbours):
+        """Return the GridMap of the same rows with the neighbour mode.
+        """
+        if neighbours == self.neighbours:
+            return self
+        return GridMap(self.rows, neighbours)
+
+    def derived(self, key, make):
+        """Return the structure kept under the key. On first use, it is
+        built by make() and kept along with the map. Finders use this to
+        share the structures they precompute from the layout.
+        """
+        structure = self._derived.get(key)
+        if structure is None:
+            structure = self._derived[key] = make()
+        return structure
+
+    def patched(self, rows, cells):
+        """Return the GridMap of an edited version of this map.
+
+        :Parameters:
+            rows : the rows of the edited map.
+            cells : [(x, y), ...] the cells changed by the edit.
+
+        The derived structures with a patched(grid, cells) method are 
+        patched into structures of the new map. The others are built 
+        again on first use.
+        """
+        grid = GridMap(rows, self.neighbours)
+        n_row, n_col = self.n_row, self.n_col
+        w = n_col + 2
+        if self._padded is not None:
+            padded = grid._padded = bytearray(self._padded)
+            for x, y in cells:
+                padded[(y + 1) * w + x + 1] = rows[y][x] != BLOCKED
+        elif self._masks is not None:
+            # the masks are patched from the padded cells
+            padded = grid.padded()
+        if self._masks is not None:
+            # the moves from a cell only depend on the cells around it
+            masks = grid._masks = array('B', self._masks)
+            probes = mask_probes(w, self.neighbours)
+            for x, y in set([(x + dx, y + dy) for x, y in cells 
+                             for dx in (-1, 0, 1) for dy in (-1, 0, 1)]):
+                if 0 <= x < n_col and 0 <= y < n_row:
+                    masks[y * n_col + x] = cell_mask(
+                            padded, (y + 1) * w + x + 1, probes, 
+                            self.neighbours)
+        for key, structure in self._derived.items():
+            if hasattr(structure, 'patched'):
+                grid._derived[key] = structure.patched(grid, cells)
+        return grid
+
+    def nbytes(self):
+        """Return the approximate number of bytes used by the map and
+        the structures built so far.
+        """
+        if hasattr(self.rows, 'nbytes'):
+            # packed rows, see packedmap.py
+            total = self.rows.nbytes()
+        else:
+            total = sys.getsizeof(self.rows) + \
+                    sum([sys.getsizeof(row) for row in self.rows])
+        if self._csr is not None:
+            total += self._csr.nbytes()
+        if self._masks is not None:
+            total += len(self._masks)
+        if self._padded is not None:
+            total += len(self._padded)
+        for structure in self._derived.values():
+            if isinstance(structure, dict):
+                # the dict of dicts graph, see make_graph
+                total += sys.getsizeof(structure) + \
+                         sum([sys.getsizeof(adj) 
+                              for adj in structure.itervalues()])
+            else:
+                total += structure.nbytes()
+        return total
+
+
+# the moves (dx, dy, dist) of each neighbour mask, in the order of the
+# bits
+MASK_MOVES = [tuple([(dx, dy, DDIST if dx and dy else DIST) 
+                     for k, (dx, dy) in enumerate(MOVE_DIRECTIONS) 
+                         if mask >> k & 1])
+              for mask in xrange(256)]
+
+# the symbols of the cells to their walkability, as chars of 0 and 1
+_TO_WALKABLE = string.maketrans(''.join(map(chr, xrange(256))), 
+                                ''.join([chr(chr(c) != BLOCKED) 
+                                         for c in xrange(256)]))
+
+def padded_cells(rows, n_col):
+    """Return a bytearray holding 1 for the walkable cells and 0 for 
+    the blocked ones, with a border of blocked cells around the map. 
+    The cell (x, y) is at (y + 1) * (n_col + 2) + x + 1, so each of its
+    neighbours, inside the map or on the border, is at a fixed offset 
+    from it, and is looked up without checking the bounds of the map.
+    """
+    border = bytearray(n_col + 2)
+    cells = bytearray(border)
+    for row in rows:
+        cells += (BLOCKED + row + BLOCKED).translate(_TO_WALKABLE)
+    cells += border
+    return cells
+
+def mask_probes(w, neighbours = NEIGHBOURS_8):
+    """Return the (bit, offset, side_a, side_b) of each move on the
+    padded cells of a map of width w - 2: the offset of the cell the
+    move leads to, and those of the two cells beside a diagonal move, 
+    which are 0 for the other moves.
+    """
+    probes = []
+    for k, (dx, dy) in enumerate(MOVE_DIRECTIONS):
+        if dx and dy:
+            if neighbours == NEIGHBOURS_4:
+                continue
+            probes.append((1 << k, dy * w + dx, dx, dy * w))
+        else:
+            probes.append((1 << k, dy * w + dx, 0, 0))
+    return probes
+
+def cell_mask(cells, j, probes, neighbours = NEIGHBOURS_8):
+    """Return the neighbour mask of the cell at j of the padded cells,
+    0 if blocked, from the probes of mask_probes.
+    """
+    if not cells[j]:
+        return 0
+    mask = 0
+    for bit, offset, side_a, side_b in probes:
+        if not cells[j + offset]:
+            continue
+        if side_a:
+            # a diagonal move, beside one or two walkable cells
+            if neighbours == NEIGHBOURS_8_NO_CUT:
+                if not (cells[j + side_a] and cells[j + side_b]):
+                    continue
+            elif not (cells[j + side_a] or cells[j + side_b]):
+                continue
+        mask |= bit
+    return mask
+
+def neighbour_masks(rows, n_row, n_col, neighbours = NEIGHBOURS_8):
+    """Return an array('B') holding the neighbour mask of the cell 
+    (x, y) at y * n_col + x: bit k is set when the move 
+    MOVE_DIRECTIONS[k] can be made from the cell in the neighbour mode.
+    The masks are computed with vectorized NumPy operations when NumPy
+    is available, in bands of rows read one by one, so that a map of
+    packed rows is never decoded whole.
+    """
+    masks = array('B', [0]) * (n_row * n_col)
+    if numpy is not None:
+        height = max(1, MASK_BAND_CELLS // n_col)
+        for y0 in xrange(0, n_row, height):
+            y1 = min(y0 + height, n_row)
+            # the rows next to the band, if any, are needed as well
+            top, bottom = max(y0 - 1, 0), min(y1 + 1, n_row)
+            cells = _cells_numpy([rows[y] for y in xrange(top, bottom)], 
+                                 bottom - top, n_col)
+            padded = _padded_numpy(cells)[y0 - top:y1 - top + 2]
+            band = numpy.zeros((y1 - y0, n_col), dtype = numpy.uint8)
+            for k, edge in _moves_numpy(padded, neighbours):
+                band |= edge.astype(numpy.uint8) << k
+            masks[y0 * n_col:y1 * n_col] = array('B', band.tostring())
+        return masks
+    cells = padded_cells(rows, n_col)
+    w = n_col + 2
+    probes = mask_probes(w, neighbours)
+    for y in xrange(n_row):
+        j = (y + 1) * w + 1
+        for i in xrange(y * n_col, (y + 1) * n_col):
+            masks[i] = cell_mask(cells, j, probes, neighbours)
+            j += 1
+    return masks
+
+def octile(a, b):
+    """Return the Octile distance between the positions a and b, i.e.
+    the cost of the shortest path between them on a map without 
+    obstacles.
+    """
+    dx = abs(a[0] - b[0])
+    dy = abs(a[1] - b[1])
+    if dx < dy:
+        return DDIST * dx + DIST * (dy - dx)
+    return DDIST * dy + DIST * (dx - dy)
+
+def make_graph(s, csr = False, neighbours = NEIGHBOURS_8): 
     """
     Generate an adjacency-list-represented graph from a multi-line string.
     
     :Parameters:
-        s : str
-            A multi-line string representing the maze. 
+        s : str or sequence of str
+            A multi-line string representing the maze, or its rows, 
+            e.g. the rows of a GridMap, which are read as they are. 
             A sample string is as follows:
             s = '''
                 1001
                 0100
                 1001
                 '''
+
+        csr : bool
+            If true, return a CSRGraph instead of a dict of dicts.
+            The CSRGraph is built with vectorized NumPy operations 
+            when NumPy is available.
+
+        neighbours : int
+            The neighbour mode of the map, see GridMap.
         
     :Return:
         graph : {(x1, y1): {(x2, y2): dist, ... }, ... }
@@ -69,44 +367,149 @@ def make_graph(s):
 
     """
     try:
-        nodes_map = [list(row) for row in s.split()]
-        n_row = len(nodes_map)
-        n_col = len(nodes_map[0])
+        rows = s.split() if isinstance(s, basestring) else s
+        n_row = len(rows)
+        n_col = len(rows[0])
     except:
         raise InvalidMap("The given raw map may be invalid")
 
-    # put all available nodes into the graph
-    g = dict([((x, y), {})  
-            for x in xrange(n_col) 
-                for y in xrange(n_row)
-                    if nodes_map[y][x] != BLOCKED]) 
+    if csr and numpy is not None:
+        return _make_csr_graph_numpy(rows, n_row, n_col, neighbours)
+
+    masks = neighbour_masks(rows, n_row, n_col, neighbours)
+    if csr:
+        return _make_csr_graph(rows, masks, n_row, n_col)
+
+    g = {}
     source = None
     target = None
 
     for x in xrange(n_col):
         for y in xrange(n_row):
-            if nodes_map[y][x] == SOURCE:
+            if rows[y][x] == SOURCE:
                 source = (x, y)
-            elif nodes_map[y][x] == TARGET:
+            elif rows[y][x] == TARGET:
                 target = (x, y)
-            if is_walkable(x, y, n_row, n_col, nodes_map):
-                for i in xrange(len(XOFFSET)):
-                    # inspect horizontal and vertical adjacent nodes
-                    nx = x + XOFFSET[i]
-                    ny = y + YOFFSET[i]
-                    if is_walkable(nx, ny, n_row, n_col, nodes_map):
-                        g[(x, y)][(nx, ny)] = DIST
-                        # further inspect diagonal nodes
-                        nx = x + DAXOFFSET[i]
-                        ny = y + DAYOFFSET[i]
-                        if is_walkable(nx, ny, n_row, n_col, nodes_map):
-                            g[(x, y)][(nx, ny)] = DDIST
-                        nx = x + DBXOFFSET[i]
-                        ny = y + DBYOFFSET[i]
-                        if is_walkable(nx, ny, n_row, n_col, nodes_map):
-                            g[(x, y)][(nx, ny)] = DDIST
+            if rows[y][x] != BLOCKED:
+                g[(x, y)] = dict([((x + dx, y + dy), dist) for dx, dy, dist
+                                  in MASK_MOVES[masks[y * n_col + x]]])
     return g, source, target
 
+def _make_csr_graph(rows, masks, n_row, n_col):
+    """Build the CSRGraph of make_graph(s, csr = True).
+    """
+    offsets = array('i', [0])
+    neighbours = array('i')
+    weights = array('i')
+    source = None
+    target = None
+
+    for y in xrange(n_row):
+        for x in xrange(n_col):
+            if rows[y][x] == SOURCE:
+                source = (x, y)
+            elif rows[y][x] == TARGET:
+                target = (x, y)
+            for dx, dy, dist in MASK_MOVES[masks[y * n_col + x]]:
+                neighbours.append((y + dy) * n_col + x + dx)
+                weights.append(dist)
+            offsets.append(len(neighbours))
+    return CSRGraph(n_row, n_col, offsets, neighbours, weights), \
+           source, target
+
+def _cells_numpy(rows, n_row, n_col):
+    """Return the symbols of the map as a 2D array of bytes.
+    """
+    try:
+        cells = numpy.fromstring(''.join(rows), dtype = numpy.uint8)
+        return cells.reshape(n_row, n_col)
+    except ValueError:
+        raise InvalidMap("The given raw map may be invalid")
+
+def _padded_numpy(cells):
+    """Return the walkability of the cells as a boolean array, with a 
+    blocked border so that the neighbour of every cell in every 
+    direction is a plain slice.
+    """
+    n_row, n_col = cells.shape
+    padded = numpy.zeros((n_row + 2, n_col + 2), dtype = bool)
+    padded[1:-1, 1:-1] = cells != ord(BLOCKED)
+    return padded
+
+def _moves_numpy(padded, neighbours):
+    """Generate (k, edge) for the moves allowed in the neighbour mode,
+    where edge is a boolean array telling whether the move 
+    MOVE_DIRECTIONS[k] can be made from each of the cells inside the 
+    border of padded, computed for all of them at once with shifted 
+    walkability masks instead of probing each neighbour with 
+    is_walkable.
+    """
+    n_row, n_col = padded.shape[0] - 2, padded.shape[1] - 2
+
+    def shifted(dx, dy):
+        return padded[1 + dy:1 + dy + n_row, 1 + dx:1 + dx + n_col]
+
+    walkable = shifted(0, 0)
+    # as in cell_mask, a diagonal move needs one or both of the
+    # orthogonal cells beside it to be walkable, depending on the mode
+    for k, (dx, dy) in enumerate(MOVE_DIRECTIONS):
+        edge = walkable & shifted(dx, dy)
+        if dx and dy:
+            if neighbours == NEIGHBOURS_4:
+                continue
+            elif neighbours == NEIGHBOURS_8_NO_CUT:
+                edge &= shifted(dx, 0) & shifted(0, dy)
+            else:
+                edge &= shifted(dx, 0) | shifted(0, dy)
+        yield k, edge
+
+def _edges_numpy(cells, neighbours):
+    """Return a boolean array, where edges[y, x, k] tells whether the 
+    move MOVE_DIRECTIONS[k] can be made from (x, y) in the neighbour
+    mode, see _moves_numpy.
+    """
+    n_row, n_col = cells.shape
+    edges = numpy.zeros((n_row, n_col, len(MOVE_DIRECTIONS)), dtype = bool)
+    for k, edge in _moves_numpy(_padded_numpy(cells), neighbours):
+        edges[:, :, k] = edge
+    return edges
+
+def _make_csr_graph_numpy(rows, n_row, n_col, neighbours = NEIGHBOURS_8):
+    """Same as _make_csr_graph, but computes the edges of all the nodes
+    at once with _edges_numpy.
+    """
+    cells = _cells_numpy(rows, n_row, n_col)
+    edges = _edges_numpy(cells, neighbours)
+
+    # the k-th edge slot of node i is at i * 8 + k of the flat mask
+    slots = numpy.flatnonzero(edges.ravel()).astype(numpy.intc)
+    nodes, k = numpy.divmod(slots, len(MOVE_DIRECTIONS))
+    deltas = numpy.array([dy * n_col + dx for dx, dy in MOVE_DIRECTIONS],
+                         dtype = numpy.intc)
+    dists = numpy.array([DDIST if dx and dy else DIST 
+                         for dx, dy in MOVE_DIRECTIONS], dtype = numpy.intc)
+
+    offsets = numpy.zeros(n_row * n_col + 1, dtype = numpy.intc)
+    numpy.cumsum(edges.sum(axis = 2).ravel(), out = offsets[1:])
+    neighbours = nodes + deltas[k]
+    weights = dists[k]
+
+    # locate the source and target
+    flat = cells.ravel()
+    def locate(symbol):
+        found = numpy.flatnonzero(flat == ord(symbol))
+        if len(found):
+            return (int(found[-1] % n_col), int(found[-1] // n_col))
+    source = locate(SOURCE)
+    target = locate(TARGET)
+
+    # convert to plain arrays, which are much faster to index one
+    # item at a time in the search loops
+    graph = CSRGraph(n_row, n_col, 
+                     array('i', offsets.tostring()),
+                     array('i', neighbours.tostring()),
+                     array('i', weights.tostring()))
+    return graph, source, target
 
 
 if __name__ == '__main__':
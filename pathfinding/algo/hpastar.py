@@ -0,0 +1,560 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2011 by Xueqiao Xu <xueqiaoxu@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import threading
+from heapq import *
+
+import sys
+sys.path.insert(0, '..')
+
+from graph import MASK_MOVES, octile, InvalidMap
+from mapcache import load_map
+from components import unreachable
+from const.constants import *
+
+
+def search_box(grid, box, source, goal = None):
+    """Search the shortest paths from the source without leaving a 
+    rectangle of the map.
+
+    :Parameters:
+        grid : GridMap
+            the map.
+
+        box : (x0, y0, x1, y1)
+            the rectangle of the cells (x, y) with x0 <= x < x1 and 
+            y0 <= y < y1.
+
+        source : (x, y)
+            the node to start from.
+
+        goal : (x, y)
+            if given, the search is an A* with the Octile heuristic 
+            which stops when the goal is closed. Otherwise, it is a
+            Dijkstra's search of the whole rectangle.
+
+    :Return:
+        dist : {(x, y): distance from the source}
+            the distances of the closed nodes.
+
+        parent : {(x, y): (x, y)}
+            the parents of the nodes on the shortest paths.
+    """
+    x0, y0, x1, y1 = box
+    masks, n_col = grid.masks(), grid.n_col
+    dist = {}
+    g = {source: 0}
+    parent = {source: None}
+    open_list = [(0, source)]
+    while open_list:
+        pos = heappop(open_list)[1]
+        if pos in dist:
+            continue
+        d = dist[pos] = g[pos]
+        if pos == goal:
+            break
+
+        # both ends of a diagonal move being inside the box, the nodes 
+        # beside it are inside as well
+        x, y = pos
+        for dx, dy, cost in MASK_MOVES[masks[y * n_col + x]]:
+            nx = x + dx
+            ny = y + dy
+            if not (x0 <= nx < x1 and y0 <= ny < y1):
+                continue
+            npos = (nx, ny)
+            nd = d + cost
+            if npos not in g or nd < g[npos]:
+                g[npos] = nd
+                parent[npos] = pos
+                if goal is not None:
+                    heappush(open_list, (nd + octile(npos, goal), npos))
+                else:
+                    heappush(open_list, (nd, npos))
+    return dist, parent
+
+
+class ClusterGraph(object):
+    """The abstract graph of HPA*.
+
+    The map is partitioned into square clusters. Along the border of 
+    two adjacent clusters, each maximal run of pairs of facing walkable
+    cells is an entrance, which is linked by the pair in its middle, or
+    by the pairs at both ends if it is at least HPA_WIDE_ENTRANCE wide.
+    The cells of these pairs are the nodes of the abstract graph, with
+    an edge of cost DIST across the border, and edges between the nodes
+    of the same cluster weighted with their shortest distances inside 
+    the cluster.
+
+    The entrances are found when the graph is created, in a single scan
+    of the borders. The distances inside a cluster are calculated the 
+    first time a search reaches the cluster, and are then kept for all
+    the following queries on the same map.
+    """
+
+    def __init__(self, grid, cluster_size = HPA_CLUSTER_SIZE):
+        """
+        :Parameters:
+            grid : GridMap
+                the map to abstract.
+
+            cluster_size : int
+                the width and height of the clusters.
+        """
+        self.grid = grid
+        self.size = cluster_size
+
+        # {(x, y): {(x2, y2): cost, ...}, ...} the edges of the nodes
+        self.graph = {}
+
+        # {(cx, cy): [(x, y), ...]} the nodes of each cluster
+        self.clusters = {}
+
+        # the clusters whose inner edges have been calculated. The
+        # calculation is guarded by the lock, as the graph is shared 
+        # by the threads of the server through the map cache.
+        self._linked = set()
+        self._lock = threading.Lock()
+
+        self._find_entrances()
+
+    def cluster(self, pos):
+        """Return the (cx, cy) of the cluster containing the position.
+        """
+        return (pos[0] // self.size, pos[1] // self.size)
+
+    def box(self, cluster):
+        """Return the (x0, y0, x1, y1) rectangle of the cluster.
+        """
+        cx, cy = cluster
+        s = self.size
+        return (cx * s, cy * s, min((cx + 1) * s, self.grid.n_col), 
+                min((cy + 1) * s, self.grid.n_row))
+
+    def neighbours(self, pos):
+        """Return the {(x, y): cost} edges of the node, calculating the
+        edges inside its cluster if they are not known yet.
+        """
+        cluster = self.cluster(pos)
+        if cluster not in self._linked:
+            self._link_cluster(cluster)
+        return self.graph[pos]
+
+    def connect(self, pos):
+        """Return the distances inside its cluster from the position to
+        each reachable cell, used to connect the endpoints of a query.
+        """
+        box = self.box(self.cluster(pos))
+        x0, y0, x1, y1 = box
+        w = x1 - x0
+        dist = self._dijkstra(self._local_graph(box), 
+                              (pos[1] - y0) * w + pos[0] - x0)
+        return dict([((i % w + x0, i // w + y0), d) 
+                     for i, d in enumerate(dist) if d < INF])
+
+    def build(self):
+        """Calculate the edges inside all the clusters at once.
+        """
+        for cluster in self.clusters.keys():
+            if cluster not in self._linked:
+                self._link_cluster(cluster)
+
+    def patched(self, grid, cells):
+        """Return the ClusterGraph of an edited version of the map. 
+        The entrances are found again, and the edges of each linked 
+        cluster which has neither changed cells nor changed nodes are
+        copied instead of being calculated again.
+        """
+        graph = ClusterGraph(grid, self.size)
+        dirty = set([self.cluster(pos) for pos in cells])
+        with self._lock:
+            linked = list(self._linked)
+        for cluster in linked:
+            nodes = graph.clusters.get(cluster, [])
+            if cluster in dirty or \
+                    set(nodes) != set(self.clusters.get(cluster, [])):
+                continue
+            for u in nodes:
+                for v, cost in self.graph[u].iteritems():
+                    if self.cluster(v) == cluster:
+                        graph.graph[u][v] = cost
+            graph._linked.add(cluster)
+        return graph
+
+    def nbytes(self):
+        """Return the approximate number of bytes used by the graph.
+        """
+        total = sys.getsizeof(self.graph) + sys.getsizeof(self.clusters)
+        for pos, edges in self.graph.iteritems():
+            total += sys.getsizeof(pos) + sys.getsizeof(edges)
+        for nodes in self.clusters.itervalues():
+            total += sys.getsizeof(nodes)
+        return total
+
+    def _find_entrances(self):
+        n_row, n_col, s = self.grid.n_row, self.grid.n_col, self.size
+        # the borders between the columns x - 1 and x
+        for x in xrange(s, n_col, s):
+            for y0 in xrange(0, n_row, s):
+                self._add_entrances([((x - 1, y), (x, y)) 
+                                     for y in xrange(y0, min(y0 + s, n_row))])
+        # the borders between the rows y - 1 and y
+        for y in xrange(s, n_row, s):
+            for x0 in xrange(0, n_col, s):
+                self._add_entrances([((x, y - 1), (x, y)) 
+                                     for x in xrange(x0, min(x0 + s, n_col))])
+
+    def _add_entrances(self, pairs):
+        """Link the entrances along a border, given the pairs of facing
+        cells in order.
+        """
+        rows = self.grid.rows
+        run = []
+        for a, b in pairs + [(None, None)]:
+            if a is not None and rows[a[1]][a[0]] != BLOCKED and \
+                    rows[b[1]][b[0]] != BLOCKED:
+                run.append((a, b))
+                continue
+            if not run:
+                continue
+            if len(run) < HPA_WIDE_ENTRANCE:
+                links = [run[len(run) // 2]]
+            else:
+                links = [run[0], run[-1]]
+            for a, b in links:
+                self._add_node(a)
+                self._add_node(b)
+                self.graph[a][b] = DIST
+                self.graph[b][a] = DIST
+            run = []
+
+    def _add_node(self, pos):
+        if pos not in self.graph:
+            self.graph[pos] = {}
+            self.clusters.setdefault(self.cluster(pos), []).append(pos)
+
+    def _link_cluster(self, cluster):
+        """Calculate the edges between the nodes of the cluster.
+        """
+        with self._lock:
+            if cluster in self._linked:
+                return
+            box = self.box(cluster)
+            x0, y0, x1, y1 = box
+            w = x1 - x0
+            adj = self._local_graph(box)
+            nodes = self.clusters.get(cluster, [])
+            index = [(y - y0) * w + x - x0 for x, y in nodes]
+            # the distances are symmetric, so each node only searches
+            # for the nodes after it.
+            for i in xrange(len(nodes) - 1):
+                dist = self._dijkstra(adj, index[i], set(index[i + 1:]))
+                u = nodes[i]
+                for v, j in zip(nodes[i + 1:], index[i + 1:]):
+                    if dist[j] < INF:
+                        self.graph[u][v] = dist[j]
+                        self.graph[v][u] = dist[j]
+            self._linked.add(cluster)
+
+    def _local_graph(self, box):
+        """Return the adjacency lists of the cells of the box, in which
+        the cell (x, y) is numbered (y - y0) * (x1 - x0) + (x - x0), as
+        lists of (number, cost). The searches inside a cluster run on
+        these lists rather than on the map, as each cluster is searched
+        from several nodes.
+        """
+        x0, y0, x1, y1 = box
+        w = x1 - x0
+        masks, n_col = self.grid.masks(), self.grid.n_col
+        adj = []
+        for y in xrange(y0, y1):
+            for x in xrange(x0, x1):
+                # refer to search_box for the bounds, the mask of a 
+                # blocked cell is 0
+                adj.append([((y + dy - y0) * w + x + dx - x0, cost) 
+                            for dx, dy, cost in 
+                                MASK_MOVES[masks[y * n_col + x]]
+                                    if x0 <= x + dx < x1 and 
+                                       y0 <= y + dy < y1])
+        return adj
+
+    def _dijkstra(self, adj, source, targets = None):
+        """Return the list of the distances from the source to the 
+        cells of a local graph, INF for the unreachable ones. If the
+        targets are given, the search stops once all of them are 
+        reached, leaving the distances of the others unsettled.
+        """
+        dist = [INF] * len(adj)
+        dist[source] = 0
+        heap = [(0, source)]
+        left = len(targets) if targets else -1
+        while heap and left:
+            d, i = heappop(heap)
+            if d > dist[i]:
+                continue
+            if targets and i in targets:
+                left -= 1
+            for j, cost in adj[i]:
+                nd = d + cost
+                if nd < dist[j]:
+                    dist[j] = nd
+                    heappush(heap, (nd, j))
+        return dist
+
+
+class HPAStar(object):
+    """Hierarchical Path-Finding A* (HPA*).
+    Searches the ClusterGraph of the map instead of the grid, then 
+    refines the abstract path into a path on the grid by a local A* 
+    inside the cluster of each of its edges.
+
+    The source and the target are connected to the nodes of their 
+    clusters for the query only. The ClusterGraph is kept with the map
+    in the map cache, so the queries on the same map share it, and each
+    cluster is linked at most once.
+
+    When the source and the target lie in the same or adjacent 
+    clusters, the path is also searched inside these clusters, and the
+    shorter one is kept. The refined path is then smoothed, by searching
+    again between cells a few clusters apart along it.
+
+    *NOTE* The paths cross the borders of the clusters through the 
+    entrance nodes, so they may still be longer than the shortest ones,
+    in exchange for searching graphs far smaller than the map. There is
+    no fixed bound: on random maps, they were up to 1.3 times as long 
+    on queries a few clusters long, and within 15% on longer ones.
+    """
+
+    def __init__(self, raw_graph, cluster_size = HPA_CLUSTER_SIZE):
+        """Create a new instance of HPA* path finder.
+
+        :Parameters:
+            raw_graph : str
+                A multi-line string representing the graph.
+
+            cluster_size : int
+                the width and height of the clusters.
+        """
+        self.grid, self.source, self.target = load_map(raw_graph)
+        self.graph = self.grid.rows
+        self.n_row = self.grid.n_row
+        self.n_col = self.grid.n_col
+        if not all((self.source, self.target)):
+            raise InvalidMap("No source or target given")
+
+        grid = self.grid
+        self.abstraction = grid.derived(('hpa', cluster_size), 
+                lambda: ClusterGraph(grid, cluster_size))
+
+        # the nodes of the abstract graph the path goes through
+        self.abstract_path = []
+        self.path = []
+
+    def step(self, record = None):
+        """Starts the computation of the path.
+        Refer to AStar.step for the details. The records show the 
+        search of the abstract graph.
+        """
+        if unreachable(self.grid, self.source, self.target):
+            return
+
+        ab = self.abstraction
+        source, target = self.source, self.target
+
+        # the temporary edges from the source and to the target
+        s_dist = ab.connect(source)
+        s_edges = dict([(v, s_dist[v]) 
+                        for v in ab.clusters.get(ab.cluster(source), [])
+                            if v in s_dist])
+        if target in s_dist:
+            s_edges[target] = s_dist[target]
+        t_dist = ab.connect(target)
+        t_edges = dict([(v, t_dist[v]) 
+                        for v in ab.clusters.get(ab.cluster(target), [])
+                            if v in t_dist])
+
+        g = {source: 0}
+        parent = {source: None}
+        closed = set()
+        open_list = [(0, 0, source)]
+        while open_list:
+            pos = heappop(open_list)[2]
+            if pos in closed:
+                continue
+            closed.add(pos)
+            if record != None:
+                record.append(('CLOSE', pos))
+            if pos == target:
+                break
+
+            edges = []
+            if pos in ab.graph:
+                edges.extend(ab.neighbours(pos).iteritems())
+            if pos == source:
+                edges.extend(s_edges.iteritems())
+            if pos in t_edges:
+                edges.append((target, t_edges[pos]))
+
+            for npos, cost in edges:
+                if npos in closed:
+                    continue
+                ng = g[pos] + cost
+                if npos not in g or ng < g[npos]:
+                    if record != None and npos not in g:
+                        record.append(('OPEN', npos))
+                    g[npos] = ng
+                    parent[npos] = pos
+                    h = octile(npos, target)
+                    heappush(open_list, (ng + h, h, npos))
+                    if record != None:
+                        record.append(('VALUE', ('g', npos, ng)))
+                        record.append(('VALUE', ('h', npos, h)))
+                        record.append(('VALUE', ('f', npos, ng + h)))
+                        record.append(('PARENT', (npos, pos)))
+            yield
+
+        if target in closed:
+            self.abstract_path = self._retrace(parent, target)
+            # the windows of the second pass straddle those of the first
+            size = self.abstraction.size
+            self.path = self._smooth(self._refine(self.abstract_path), 
+                                     2 * size, 0)
+            self.path = self._smooth(self.path, 2 * size, size)
+
+        # a path between nearby cells need not go through the entrances
+        box = self._local_box()
+        if box is not None:
+            dist, parent = search_box(self.grid, box, source, target)
+            if dist.get(target, INF) < g.get(target, INF):
+                self.abstract_path = [source, target]
+                self.path = self._retrace(parent, target)
+        yield
+
+    def _smooth(self, path, window, start):
+        """Shorten the path a window of cells at a time, from the cell
+        at start: the shortest path between the ends of a window, inside
+        the rectangle they span, replaces the part of the path in the
+        window if cheaper, e.g. when the path turns to an entrance node
+        off the way.
+        """
+        smooth = path[:start + 1]
+        for i in xrange(start, len(path) - 1, window):
+            segment = path[i:i + window + 1]
+            (ux, uy), (vx, vy) = u, v = segment[0], segment[-1]
+            cost = sum([octile(a, b) for a, b in zip(segment, segment[1:])])
+            box = (min(ux, vx), min(uy, vy), max(ux, vx) + 1, 
+                   max(uy, vy) + 1)
+            dist, parent = search_box(self.grid, box, u, v)
+            if dist.get(v, INF) < cost:
+                segment = self._retrace(parent, v)
+            smooth.extend(segment[1:])
+        return smooth
+
+    def _local_box(self):
+        """Return the rectangle covering the clusters of the source and
+        the target if they are the same or adjacent ones, or None.
+        """
+        ab = self.abstraction
+        (sx, sy), (tx, ty) = ab.cluster(self.source), ab.cluster(self.target)
+        if abs(sx - tx) > 1 or abs(sy - ty) > 1:
+            return None
+        x0, y0, x1, y1 = ab.box((min(sx, tx), min(sy, ty)))
+        return (x0, y0) + ab.box((max(sx, tx), max(sy, ty)))[2:]
+
+    def _retrace(self, parent, pos):
+        path = [pos]
+        while parent[path[-1]] is not None:
+            path.append(parent[path[-1]])
+        path.reverse()
+        return path
+
+    def _refine(self, abstract_path):
+        """Replace each edge of the abstract path inside a cluster with
+        the shortest path found by A* inside that cluster.
+        """
+        ab = self.abstraction
+        path = abstract_path[:1]
+        for u, v in zip(abstract_path, abstract_path[1:]):
+            cluster = ab.cluster(u)
+            if cluster != ab.cluster(v):
+                # an edge across a border joins two adjacent cells
+                path.append(v)
+                continue
+            parent = search_box(self.grid, ab.box(cluster), u, v)[1]
+            path.extend(self._retrace(parent, v)[1:])
+        return path
+
+
+def _test():
+    nodes_map_raw = '''
+                    S0000000000000000000000000100000000000
+                    00000000000000000000110000010000000000
+                    00000000000000000000100000001000000000
+                    10000111110101000001100000001000000000
+                    01111100010001000010100000010000000000
+                    00000100001111100100100001110000110000
+                    00001100000001011000000100000001000000
+                    00000100000000101000000000011110000001
+                    00000010000000000111111111100000000011
+                    00000001000000000000000001100000111100
+                    00000000110000000000000000010011000000
+                    00000000010000000001100000001000000000
+                    00000000010000000000110000000111111000
+                    00000000010000000000010000000000000000
+                    00000000011000111111111111111111111111
+                    000000000100000110000010000000000000T0
+                    00000000001100000100001000000000000000
+                    00000000000100000011000000000000000000
+                    00000000000010000000000000000000000000
+                    '''
+    graph2 = [list(row) for row in nodes_map_raw.split()]
+    nr = len(graph2)
+    nc = len(graph2[0])
+    hpa = HPAStar(nodes_map_raw, 8)
+    for i in hpa.step():
+        pass
+    if hpa.path:
+        for y in xrange(nr):
+            for x in xrange(nc):
+                if (x, y) == hpa.source:
+                    print 'S',
+                elif (x, y) == hpa.target:
+                    print 'T',
+                elif (x, y) in hpa.abstract_path:
+                    print 'o',
+                elif (x, y) in hpa.path:
+                    print '.',
+                elif graph2[y][x] == BLOCKED:
+                    print 'X',
+                else:
+                    print ' ',
+            print
+        print 'Route length:', len(hpa.path)
+    else:
+        print 'Failed to find the path'
+
+if __name__ == '__main__':
+    from cProfile import Profile
+    p = Profile()
+    p.runcall(_test)
+    p.print_stats(sort = 1)
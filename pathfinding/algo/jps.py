@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2011 by Xueqiao Xu <xueqiaoxu@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from heapq import *
+
+import sys
+sys.path.insert(0, '..')
+
+from astar import AStar
+from components import unreachable
+from const.constants import *
+
+
+class JumpPointSearch(AStar):
+    """Jump Point Search.
+    An A* variant for uniform-cost grids. Instead of pushing every
+    adjacent node into the open list, it keeps moving straight or
+    diagonally from a node until it reaches a *jump point*: the target,
+    or a node with a neighbour which can not be reached optimally
+    without passing through it (a forced neighbour). Only the jump
+    points are opened, so large open areas are crossed without
+    expanding the nodes inside.
+
+    The moving rules are the same as AStar's: a diagonal move is
+    allowed when at least one of the two orthogonal nodes beside it is
+    walkable. The G value of a jump point is the octile distance along
+    the jumps, and the returned path lists every node on the way, just
+    like the other finders.
+
+    The jumps rely on these rules, so on a map of another neighbour
+    mode the search falls back to AStar's.
+    """
+
+    def __init__(self, raw_graph, heuristic = OCTILE):
+        """Create a new instance of Jump Point Search path finder.
+        Refer to AStar.__init__ for the parameters. The heuristic is
+        the Octile distance by default, as the Manhattan distance of 
+        AStar overestimates the cost of diagonal moves and would lead
+        to longer paths.
+        """
+        AStar.__init__(self, raw_graph, heuristic)
+
+    def step(self, record = None):
+        """Starts the computation of the shortest path.
+        Refer to AStar.step for the details.
+        """
+        if self.grid.neighbours != NEIGHBOURS_8:
+            for i in AStar.step(self, record):
+                yield
+            return
+        if unreachable(self.grid, self.source, self.target):
+            return
+
+        # add the source node into the open list
+        sx, sy = self.source
+        self.nodes[sy][sx].g = 0
+        self.nodes[sy][sx].f = 0
+        self.open_list.append((0, 0, self.source))
+        self.nodes[sy][sx].status = OPENED
+
+        while self.open_list:
+
+            # get the node with lowest F from the heap
+            x, y = heappop(self.open_list)[2]
+            if self.nodes[y][x].status == CLOSED:
+                continue
+            self.nodes[y][x].status = CLOSED
+            if record != None:
+                record.append(('CLOSE', (x, y)))
+
+            if (x, y) == self.target:
+                self._retrace()
+                break
+
+            # jump from the node in each of the pruned directions, and
+            # inspect the jump points found.
+            for dx, dy in self._directions(x, y):
+                jump_point = self._jump(x, y, dx, dy)
+                if jump_point:
+                    self._inspect_node(jump_point, (x, y), None, record)
+            yield
+
+    def solve(self):
+        """Run step to its end and return the path. The jumps are made
+        between the yields, which leaves little for a loop of its own 
+        to save.
+        """
+        for i in self.step():
+            pass
+        return self.path
+
+    def _directions(self, x, y):
+        """Return the directions worth jumping to from the node,
+        according to the direction it was reached from.
+        """
+        parent = self.nodes[y][x].parent
+        if parent is None:
+            return MOVE_DIRECTIONS
+
+        # the cells are read from the padded grid, at fixed offsets
+        # from the node whether it lies on the border of the map or not
+        cells, w = self.grid.padded(), self.n_col + 2
+        j = (y + 1) * w + x + 1
+        px, py = parent
+        dx = cmp(x, px)
+        dy = cmp(y, py)
+        dyw = dy * w
+        dirs = []
+        if dx and dy:
+            # the natural neighbours of a diagonal move
+            if cells[j + dyw]:
+                dirs.append((0, dy))
+            if cells[j + dx]:
+                dirs.append((dx, 0))
+            dirs.append((dx, dy))
+            # the forced neighbours
+            if not cells[j - dx] and cells[j + dyw]:
+                dirs.append((-dx, dy))
+            if not cells[j - dyw] and cells[j + dx]:
+                dirs.append((dx, -dy))
+        elif dx:
+            if cells[j + dx]:
+                dirs.append((dx, 0))
+                if not cells[j + w]:
+                    dirs.append((dx, 1))
+                if not cells[j - w]:
+                    dirs.append((dx, -1))
+        else:
+            if cells[j + dyw]:
+                dirs.append((0, dy))
+                if not cells[j + 1]:
+                    dirs.append((1, dy))
+                if not cells[j - 1]:
+                    dirs.append((-1, dy))
+        return dirs
+
+    def _jump(self, x, y, dx, dy):
+        """Keep moving from (x, y) in the direction (dx, dy). Return
+        the first jump point met, or None if an obstacle or the border
+        of the map is met first.
+        """
+        w = self.n_col + 2
+        j = self._jump_cell((y + 1) * w + x + 1, dx, dy * w)
+        if j is None:
+            return None
+        y, x = divmod(j, w)
+        return (x - 1, y - 1)
+
+    def _jump_cell(self, j, dx, dyw):
+        """Same as _jump, on the cells of the padded grid: the node is 
+        the cell j, and the direction is given by the offsets dx and 
+        dyw of the horizontal and vertical moves. The border stops the
+        jumps like any blocked cell.
+        """
+        cells = self.grid.padded()
+        w = self.n_col + 2
+        tx, ty = self.target
+        target = (ty + 1) * w + tx + 1
+        step = dyw + dx
+        while True:
+            # a diagonal move needs one of the orthogonal nodes beside
+            # it to be walkable
+            if not cells[j + step] or \
+                    (dx and dyw and not cells[j + dx] and 
+                     not cells[j + dyw]):
+                return None
+            j += step
+
+            if j == target:
+                return j
+
+            if dx and dyw:
+                if (cells[j - dx + dyw] and not cells[j - dx]) or \
+                   (cells[j + dx - dyw] and not cells[j - dyw]):
+                    return j
+                # a diagonal move stops where a horizontal or vertical
+                # jump from it would find a jump point
+                if self._jump_cell(j, dx, 0) is not None or \
+                        self._jump_cell(j, 0, dyw) is not None:
+                    return j
+            elif dx:
+                if (cells[j + dx + w] and not cells[j + w]) or \
+                   (cells[j + dx - w] and not cells[j - w]):
+                    return j
+            else:
+                if (cells[j + 1 + dyw] and not cells[j + 1]) or \
+                   (cells[j - 1 + dyw] and not cells[j - 1]):
+                    return j
+
+    def _try_update(self, node_pos, parent_pos, diagonal, record):
+        """Same as AStar._try_update, except that the cost of the move
+        is the octile distance between the two jump points, so the
+        diagonal flag is not used.
+        """
+        x, y = node_pos
+        px, py = parent_pos
+        ng = self.nodes[py][px].g + self._octile(abs(x - px), abs(y - py))
+        node = self.nodes[y][x]
+
+        if node.g == None or ng < node.g:
+            node.parent = (px, py)
+            node.g = ng
+            node.h = self._calc_h((x, y))
+            node.f = self._calc_f(node.g, node.h)
+
+            if record != None:
+                record.append(('VALUE', ('g', (x, y), node.g)))
+                record.append(('VALUE', ('h', (x, y), node.h)))
+                record.append(('VALUE', ('f', (x, y), node.f)))
+                record.append(('PARENT', ((x, y), (px, py))))
+            return True
+        return False
+
+    def _retrace(self):
+        """Reconstruct the path through the jump points, filling in
+        the nodes between each pair of consecutive jump points.
+        """
+        AStar._retrace(self)
+        path = self.path[:1]
+        for x, y in self.path[1:]:
+            px, py = path[-1]
+            dx = cmp(x, px)
+            dy = cmp(y, py)
+            while (px, py) != (x, y):
+                px += dx
+                py += dy
+                path.append((px, py))
+        self.path = path
+
+
+def _test():
+    nodes_map_raw = '''
+                    S0000000000000000000000000100000000000
+                    00000000000000000000110000010000000000
+                    00000000000000000000100000001000000000
+                    10000111110101000001100000001000000000
+                    01111100010001000010100000010000000000
+                    00000100001111100100100001110000110000
+                    00001100000001011000000100000001000000
+                    00000100000000101000000000011110000001
+                    00000010000000000111111111100000000011
+                    00000001000000000000000001100000111100
+                    00000000110000000000000000010011000000
+                    00000000010000000001100000001000000000
+                    00000000010000000000110000000111111000
+                    00000000010000000000010000000000000000
+                    00000000011000111111111111111111111111
+                    000000000100000110000010000000000000T0
+                    00000000001100000100001000000000000000
+                    00000000000100000011000000000000000000
+                    00000000000010000000000000000000000000
+                    '''
+    graph2 = [list(row) for row in nodes_map_raw.split()]
+    nr = len(graph2)
+    nc = len(graph2[0])
+    jps = JumpPointSearch(nodes_map_raw, OCTILE)
+    for i in jps.step():
+        pass
+    if jps.path:
+        for y in xrange(nr):
+            for x in xrange(nc):
+                if (x, y) == jps.source:
+                    print 'S',
+                elif (x, y) == jps.target:
+                    print 'T',
+                elif (x, y) in jps.path:
+                    print '.',
+                elif graph2[y][x] == BLOCKED:
+                    print 'X',
+                else:
+                    print ' ',
+            print
+        print 'Route length:', len(jps.path)
+    else:
+        print 'Failed to find the path'
+
+if __name__ == '__main__':
+    from cProfile import Profile
+    p = Profile()
+    p.runcall(_test)
+    p.print_stats(sort = 1)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2011 by Xueqiao Xu <xueqiaoxu@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os
+import struct
+import tempfile
+from array import array
+
+import sys
+sys.path.insert(0, '..')
+
+from graph import octile, InvalidMap
+from dijkstra import csr_distances
+from mapcache import map_key
+from const.constants import *
+
+# the directory where the landmark tables are saved and looked up, or
+# None to keep them in memory only
+cache_dir = None
+
+# the header of a landmark file: magic, number of rows, number of 
+# columns and number of landmarks. The landmarks and the tables follow
+# as uint32 arrays in the byte order of the machine.
+_HEADER = struct.Struct('=4sIII')
+_MAGIC = 'ALT1'
+
+
+class Landmarks(object):
+    """The ALT (A*, Landmarks and Triangle inequality) preprocessing of
+    a map.
+
+    A few landmark cells are picked, and the distances from each of 
+    them to every cell are computed with one Dijkstra search. Since for
+    any landmark L the triangle inequality gives
+        dist(v, t) >= |dist(L, t) - dist(L, v)|
+    the largest of these differences is a lower bound of the remaining
+    cost, which is much tighter than the geometric heuristics on maps 
+    with walls to go around.
+
+    The landmarks are picked one after another as the cell farthest 
+    from the ones picked so far, starting from the cell farthest from
+    the middle of the map. Each table is an array('I') of n_row * 
+    n_col distances, INF for the cells the landmark can not reach.
+    """
+    def __init__(self, n_row, n_col, landmarks, tables):
+        self.n_row = n_row
+        self.n_col = n_col
+        self.landmarks = landmarks
+        self.tables = tables
+
+    @classmethod
+    def build(cls, grid, count = ALT_LANDMARKS):
+        """Pick count landmarks on the GridMap and compute their tables.
+        """
+        g = grid.csr()
+        n = len(g)
+        start = _middle_cell(grid)
+        if start is None:
+            raise InvalidMap("No walkable cell on the map")
+
+        # the distance of each cell to the nearest landmark so far,
+        # 0 for the cells not reached, which are never picked
+        nearest = array('I', csr_distances(g, start)[0])
+        landmarks = []
+        tables = []
+        for k in xrange(count):
+            for i in xrange(n):
+                if nearest[i] == INF:
+                    nearest[i] = 0
+            i = max(xrange(n), key = nearest.__getitem__)
+            if nearest[i] == 0:
+                # fewer reachable cells than landmarks
+                break
+            table = array('I', csr_distances(g, i)[0])
+            landmarks.append(i)
+            tables.append(table)
+            for j in xrange(n):
+                if table[j] < nearest[j]:
+                    nearest[j] = table[j]
+        return cls(grid.n_row, grid.n_col, landmarks, tables)
+
+    def estimator(self, target):
+        """Return the heuristic function h(pos) of the target, which 
+        is the largest of the landmark bounds and the octile distance.
+        """
+        n_col = self.n_col
+        t = target[1] * n_col + target[0]
+        # the landmarks which can not reach the target tell nothing
+        pairs = [(table, table[t]) for table in self.tables 
+                 if table[t] < INF]
+
+        def h(pos):
+            i = pos[1] * n_col + pos[0]
+            best = octile(pos, target)
+            for table, dt in pairs:
+                d = table[i] - dt
+                if d < 0:
+                    d = -d
+                if d > best:
+                    best = d
+            return best
+        return h
+
+    def save(self, path):
+        """Write the tables to the file. The file is replaced at once,
+        so that concurrent readers never see it half-written.
+        """
+        fd, tmp = tempfile.mkstemp(dir = os.path.dirname(path) or '.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, self.n_row, self.n_col, 
+                                 len(self.landmarks)))
+            array('I', self.landmarks).tofile(f)
+            for table in self.tables:
+                table.tofile(f)
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read the tables written by save(). Raise IOError if the file
+        is not a landmark file or is truncated.
+        """
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                raise IOError("Truncated landmark file %s" % path)
+            magic, n_row, n_col, count = _HEADER.unpack(header)
+            if magic != _MAGIC:
+                raise IOError("Not a landmark file %s" % path)
+            try:
+                landmarks = array('I')
+                landmarks.fromfile(f, count)
+                tables = []
+                for k in xrange(count):
+                    table = array('I')
+                    table.fromfile(f, n_row * n_col)
+                    tables.append(table)
+            except EOFError:
+                raise IOError("Truncated landmark file %s" % path)
+        return cls(n_row, n_col, list(landmarks), tables)
+
+    def nbytes(self):
+        return sum([t.itemsize * len(t) for t in self.tables])
+
+
+def landmarks_of(grid, count = ALT_LANDMARKS):
+    """Return the Landmarks of the GridMap, kept along with it. If 
+    cache_dir is set, the tables are looked up there before being 
+    built, and saved there once built.
+    """
+    return grid.derived(('alt', count), lambda: _load_or_build(grid, count))
+
+
+def _load_or_build(grid, count):
+    if cache_dir is None:
+        return Landmarks.build(grid, count)
+    key = map_key('\n'.join(grid.rows))[1]
+    if grid.neighbours != NEIGHBOURS_8:
+        # the distances depend on the moves allowed
+        key += '-n%d' % grid.neighbours
+    path = os.path.join(cache_dir, '%s-%d.alt' % (key, count))
+    try:
+        landmarks = Landmarks.load(path)
+        if (landmarks.n_row, landmarks.n_col) == (grid.n_row, grid.n_col):
+            return landmarks
+    except IOError:
+        pass
+    landmarks = Landmarks.build(grid, count)
+    try:
+        landmarks.save(path)
+    except (IOError, OSError), why:
+        print 'failed to save the landmarks:', why
+    return landmarks
+
+
+def _middle_cell(grid):
+    """Return the node number of the walkable cell nearest to the 
+    middle of the map, or None if there is none.
+    """
+    mx = grid.n_col // 2
+    my = grid.n_row // 2
+    best = None
+    for y, row in enumerate(grid.rows):
+        for x, cell in enumerate(row):
+            if cell != BLOCKED:
+                d = octile((x, y), (mx, my))
+                if best is None or d < best[0]:
+                    best = (d, y * grid.n_col + x)
+    return best and best[1]
+
+
+def _test():
+    from astar import AStar
+    nodes_map_raw = '''
+                    S0000000000000000000000000100000000000
+                    00000000000000000000110000010000000000
+                    00000000000000000000100000001000000000
+                    10000111110101000001100000001000000000
+                    01111100010001000010100000010000000000
+                    00000100001111100100100001110000110000
+                    00001100000001011000000100000001000000
+                    00000100000000101000000000011110000001
+                    00000010000000000111111111100000000011
+                    00000001000000000000000001100000111100
+                    00000000110000000000000000010011000000
+                    00000000010000000001100000001000000000
+                    00000000010000000000110000000111111000
+                    00000000010000000000010000000000000000
+                    00000000011000111111111111111111111111
+                    000000000100000110000010000000000000T0
+                    00000000001100000100001000000000000000
+                    00000000000100000011000000000000000000
+                    00000000000010000000000000000000000000
+                    '''
+    for heuristic in (OCTILE, ALT):
+        a = AStar(nodes_map_raw, heuristic)
+        record = []
+        for i in a.step(record):
+            pass
+        print 'Route length:', len(a.path), 'closed nodes:', \
+              len([r for r in record if r[0] == 'CLOSE'])
+
+if __name__ == '__main__':
+    from cProfile import Profile
+    p = Profile()
+    p.runcall(_test)
+    p.print_stats(sort = 1)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2011 by Xueqiao Xu <xueqiaoxu@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import hashlib
+import threading
+import collections
+
+import sys
+sys.path.insert(0, '..')
+
+from graph import GridMap, InvalidMap
+from const.constants import *
+
+
+class MapCache(object):
+    """A least-recently-used cache of GridMaps, keyed by the hash of the
+    map with its source and target stripped.
+
+    The cache is shared by the threads of the server, so all the
+    operations are guarded by a lock.
+    """
+
+    def __init__(self, max_bytes = MAP_CACHE_BYTES):
+        """
+        :Parameters:
+            max_bytes : int
+                When the GridMaps in the cache use more bytes than
+                this, the least recently used ones are evicted.
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._maps = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._maps)
+
+    def get(self, key, make):
+        """Return the GridMap cached under the key. If there is none,
+        make() is called to build a new one, which is then cached.
+        """
+        with self._lock:
+            grid = self._maps.pop(key, None)
+            if grid is None:
+                self.misses += 1
+                grid = make()
+            else:
+                self.hits += 1
+            # re-insert to mark it as the most recently used
+            self._maps[key] = grid
+            self._evict()
+            return grid
+
+    def peek(self, key):
+        """Return the GridMap cached under the key, or None, without 
+        counting it as a use.
+        """
+        with self._lock:
+            return self._maps.get(key)
+
+    def nbytes(self):
+        """Return the number of bytes used by the cached GridMaps.
+        """
+        with self._lock:
+            return self._nbytes()
+
+    def stats(self):
+        """Return a dict of the hits, misses, entries and bytes used.
+        """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'entries': len(self._maps),
+                    'bytes': self._nbytes()}
+
+    def clear(self):
+        with self._lock:
+            self._maps.clear()
+
+    def _nbytes(self):
+        # the GridMaps grow as their structures get built, so the sizes
+        # are summed up each time instead of being tracked.
+        return sum([grid.nbytes() for grid in self._maps.itervalues()])
+
+    def _evict(self):
+        """Evict the least recently used GridMaps until the cache fits
+        in max_bytes. The most recent one is always kept.
+        """
+        total = self._nbytes()
+        while total > self.max_bytes and len(self._maps) > 1:
+            key, grid = self._maps.popitem(last = False)
+            total -= grid.nbytes()
+
+
+# the cache shared by the whole process
+map_cache = MapCache()
+
+
+def map_key(raw_graph):
+    """Return the normalized map text with SOURCE and TARGET stripped,
+    its cache key, and the coordinates of the source and target.
+    """
+    text = '\n'.join(raw_graph.split())
+    source = _locate(text, SOURCE)
+    target = _locate(text, TARGET)
+    stripped = text.replace(SOURCE, NORMAL).replace(TARGET, NORMAL)
+    return stripped, hashlib.sha1(stripped).hexdigest(), source, target
+
+
+def _locate(text, symbol):
+    """Return the coordinate of the last occurrence of the symbol in
+    the normalized map text, or None if it does not occur.
+    """
+    i = text.rfind(symbol)
+    if i < 0:
+        return None
+    line_start = text.rfind('\n', 0, i) + 1
+    return (i - line_start, text.count('\n', 0, i))
+
+
+def load_map(raw_graph, cache = map_cache):
+    """Parse the raw map through the cache.
+
+    :Parameters:
+        raw_graph : str or tuple
+            A multi-line string representing the graph, or a
+            (grid, source, target) tuple returned by load_map, which
+            is returned as it is. The batch queries use the latter to
+            share one parsed map between many finders.
+
+        cache : MapCache
+            The cache to look up, or None to always parse the map.
+
+    :Return:
+        grid : GridMap
+            the layout of the map.
+
+        source : (x, y)
+            source coordinate, or None if not given.
+
+        target : (x, y)
+            target coordinate, or None if not given.
+    """
+    if isinstance(raw_graph, tuple):
+        return raw_graph
+    stripped, key, source, target = map_key(raw_graph)
+    if not stripped:
+        raise InvalidMap("The given raw map may be invalid")
+    make = lambda: GridMap(stripped.split('\n'))
+    if cache is None:
+        return make(), source, target
+    return cache.get(key, make), source, target
+
+
+def map_diff(old_raw, new_raw):
+    """Return the list of (x, y, symbol) changes which turn the old
+    raw map into the new one, or None if their sizes differ.
+    """
+    old_rows = old_raw.split()
+    new_rows = new_raw.split()
+    if len(old_rows) != len(new_rows) or \
+            [len(row) for row in old_rows] != [len(row) for row in new_rows]:
+        return None
+    changes = []
+    for y, (old, new) in enumerate(zip(old_rows, new_rows)):
+        if old != new:
+            changes.extend([(x, y, new[x]) for x in xrange(len(new)) 
+                            if old[x] != new[x]])
+    return changes
+
+
+def patch_map(raw_graph, changes, cache = map_cache):
+    """Apply the changes to the raw map and return the new raw map.
+
+    If the GridMap of the old map is in the cache, the GridMap of the
+    new map is derived from it and cached too, keeping the structures
+    which can be patched instead of building them again.
+
+    :Parameters:
+        changes : [(x, y, symbol), ...]
+            the new symbols of the cells. Setting SOURCE or TARGET 
+            moves it, the cell it leaves becoming NORMAL.
+    """
+    rows = raw_graph.split()
+    if not rows:
+        raise InvalidMap("The given raw map may be invalid")
+    n_row = len(rows)
+    n_col = len(rows[0])
+
+    # the rows being changed, as lists of symbols
+    touched = {}
+    for change in changes:
+        x, y, symbol = change
+        if not (0 <= x < n_col and 0 <= y < n_row) or \
+                symbol not in (NORMAL, BLOCKED, SOURCE, TARGET):
+            raise InvalidMap("Invalid change %r" % (change,))
+        if symbol in (SOURCE, TARGET):
+            for sy in xrange(n_row):
+                row = touched.get(sy, rows[sy])
+                if symbol in row:
+                    touched.setdefault(sy, list(row))[row.index(symbol)] = \
+                            NORMAL
+        touched.setdefault(y, list(rows[y]))[x] = symbol
+
+    old_rows = dict([(y, rows[y]) for y in touched])
+    for y, row in touched.iteritems():
+        rows[y] = ''.join(row)
+    new_raw = '\n'.join(rows)
+
+    old_grid = cache.peek(map_key(raw_graph)[1]) if cache else None
+    if old_grid is not None:
+        # the cells whose layout changed, not counting the moves of the
+        # source and the target
+        cells = []
+        for y, old in old_rows.iteritems():
+            old = old.replace(SOURCE, NORMAL).replace(TARGET, NORMAL)
+            new = rows[y].replace(SOURCE, NORMAL).replace(TARGET, NORMAL)
+            cells.extend([(x, y) for x in xrange(n_col) if old[x] != new[x]])
+        stripped, key = map_key(new_raw)[:2]
+        cache.get(key, lambda: old_grid.patched(stripped.split('\n'), cells))
+    return new_raw
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2011 by Xueqiao Xu <xueqiaoxu@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os
+import mmap
+import string
+import struct
+import binascii
+import tempfile
+
+import sys
+sys.path.insert(0, '..')
+
+from graph import GridMap, InvalidMap
+from const.constants import *
+
+# the header of a packed map file: magic, number of rows, number of
+# columns, and the source and target coordinates, -1 if not given. The
+# rows follow, each one padded to whole bytes, with a bit per cell set
+# for the BLOCKED cells, starting from the highest bit.
+_HEADER = struct.Struct('=4sIIiiii')
+_MAGIC = 'PFM1'
+
+# the symbols of the cells to bits and back
+_TO_BITS = string.maketrans(NORMAL + SOURCE + TARGET + BLOCKED, '0001')
+_FROM_BITS = string.maketrans('01', NORMAL + BLOCKED)
+
+
+class PackedRows(dict):
+    """The rows of a map kept as bits in a buffer, usually a memory
+    mapped map file, in place of a list of strings.
+
+    rows[y] decodes the row y into a string of NORMAL and BLOCKED, so
+    that the finders look up the cells with rows[y][x] as on any other
+    map. The decoded rows are kept as the items of the dict, which the
+    lookups of the finders find without calling back into Python, until
+    PACKED_ROWS_CACHED of them are, and then dropped all together; a 
+    search mostly reads the rows around its frontier, which are decoded
+    again soon.
+    """
+    def __init__(self, buf, n_row, n_col, offset = 0):
+        dict.__init__(self)
+        self.buf = buf
+        self.n_row = n_row
+        self.n_col = n_col
+        self.offset = offset
+        self.stride = (n_col + 7) // 8
+
+    def __len__(self):
+        return self.n_row
+
+    def __missing__(self, y):
+        if not 0 <= y < self.n_row:
+            raise IndexError('row index out of range')
+        if dict.__len__(self) >= PACKED_ROWS_CACHED:
+            self.clear()
+        row = self[y] = self._decode(y)
+        return row
+
+    def __iter__(self):
+        # decoded one by one, without filling the cache
+        for y in xrange(self.n_row):
+            yield self.get(y) or self._decode(y)
+
+    def _decode(self, y):
+        start = self.offset + y * self.stride
+        bits = int(binascii.hexlify(self.buf[start:start + self.stride]), 16)
+        row = format(bits, '0%db' % (self.stride * 8))[:self.n_col]
+        return row.translate(_FROM_BITS)
+
+    def nbytes(self):
+        """Return the number of bytes of the packed rows, and of the
+        decoded rows kept.
+        """
+        return self.n_row * self.stride + \
+               sum([sys.getsizeof(row) for row in self.itervalues()])
+
+
+def pack_row(row):
+    """Return the bits of the row of a map as a string of bytes.
+    """
+    bits = row.translate(_TO_BITS)
+    bits += '0' * (-len(bits) % 8)
+    return binascii.unhexlify('%0*x' % (len(bits) // 4, int(bits, 2)))
+
+
+def save_packed(raw_graph, path):
+    """Write the raw map into a packed map file. The file is replaced
+    at once, so that concurrent readers never see it half-written.
+
+    :Parameters:
+        raw_graph : str
+            A multi-line string representing the map.
+        path : str
+            The name of the file.
+    """
+    _write_packed(raw_graph.split(), path)
+
+
+def pack_map_file(text_path, path):
+    """Convert a map file in the text format of the raw maps into a 
+    packed map file, reading it line by line. Only the line being read
+    is held in memory, so there is no limit on the size of the map.
+
+    :Parameters:
+        text_path : str
+            The name of the text map file.
+        path : str
+            The name of the packed map file to write.
+    """
+    with open(text_path, 'rb') as f:
+        # the rows are split from the lines as raw_graph.split() does
+        _write_packed((row for line in f for row in line.split()), path)
+
+
+def load_map_file(text_path, path = None):
+    """Read a text map file line by line into a packed grid.
+
+    :Parameters:
+        text_path : str
+            The name of the text map file.
+        path : str
+            If given, the packed map file to write and then open, see
+            pack_map_file. Otherwise the packed rows are kept in memory.
+
+    :Return:
+        A (grid, source, target) tuple like the one of open_packed.
+    """
+    if path is not None:
+        pack_map_file(text_path, path)
+        return open_packed(path)
+    buf = bytearray()
+    with open(text_path, 'rb') as f:
+        n_row, n_col, source, target = _pack_rows(
+                (row for line in f for row in line.split()), buf.extend)
+    rows = PackedRows(buf, n_row, n_col)
+    return GridMap(rows), source, target
+
+
+def _write_packed(rows, path):
+    """Write the rows, given by any iterable, into a packed map file.
+    The header is written last, once the size of the map is known.
+    """
+    fd, tmp = tempfile.mkstemp(dir = os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, 0, 0, -1, -1, -1, -1))
+            n_row, n_col, source, target = _pack_rows(rows, f.write)
+            f.seek(0)
+            f.write(_HEADER.pack(*((_MAGIC, n_row, n_col) + 
+                                   (source or (-1, -1)) + 
+                                   (target or (-1, -1)))))
+        os.rename(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+
+
+def _pack_rows(rows, write):
+    """Pack the rows, given by any iterable, one by one and pass the
+    bytes of each to write. Return the number of rows and columns, and
+    the source and target found on the way, None if not found.
+    """
+    ends = {SOURCE: None, TARGET: None}
+    n_row = n_col = 0
+    for row in rows:
+        if not n_row:
+            n_col = len(row)
+        elif len(row) != n_col:
+            raise InvalidMap("Row %d of the map is %d cells long instead "
+                             "of %d" % (n_row, len(row), n_col))
+        # the last occurrences count, as in the raw maps
+        for symbol in (SOURCE, TARGET):
+            x = row.rfind(symbol)
+            if x >= 0:
+                ends[symbol] = (x, n_row)
+        write(pack_row(row))
+        n_row += 1
+    if not n_row:
+        raise InvalidMap("The given raw map may be invalid")
+    return n_row, n_col, ends[SOURCE], ends[TARGET]
+
+
+def open_packed(path):
+    """Memory map a packed map file.
+
+    :Return:
+        A (grid, source, target) tuple like the one of load_map, which
+        can be passed to the finders in place of a raw map. The rows of
+        the grid are read from the file as they are needed, but the 
+        finders still build structures with a few bytes per cell of 
+        the map, such as the components and the neighbour masks.
+    """
+    with open(path, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            raise InvalidMap("Empty packed map file %s" % path)
+    if len(buf) < _HEADER.size:
+        raise InvalidMap("Truncated packed map file %s" % path)
+    magic, n_row, n_col, sx, sy, tx, ty = _HEADER.unpack(buf[:_HEADER.size])
+    if magic != _MAGIC:
+        raise InvalidMap("Not a packed map file %s" % path)
+    rows = PackedRows(buf, n_row, n_col, _HEADER.size)
+    if not n_row or not n_col or \
+            len(buf) < _HEADER.size + n_row * rows.stride:
+        raise InvalidMap("Truncated packed map file %s" % path)
+    source = (sx, sy) if sx >= 0 else None
+    target = (tx, ty) if tx >= 0 else None
+    return GridMap(rows), source, target
+
+
+def _test():
+    from astar import ArrayAStar
+    nodes_map_raw = '''
+                    S000100000
+                    0110101110
+                    0000100010
+                    0111111010
+                    000000001T
+                    '''
+    path = os.path.join(tempfile.gettempdir(), 'packedmap_test.pfm')
+    save_packed(nodes_map_raw, path)
+    loaded = open_packed(path)
+    grid, source, target = loaded
+    for row in grid.rows:
+        print row
+    print source, target
+    print ArrayAStar(loaded, OCTILE).solve()
+    os.remove(path)
+
+    text_path = os.path.join(tempfile.gettempdir(), 'packedmap_test.txt')
+    with open(text_path, 'w') as f:
+        f.write(nodes_map_raw)
+    loaded = load_map_file(text_path)
+    print ArrayAStar(loaded, OCTILE).solve() == \
+          ArrayAStar(nodes_map_raw, OCTILE).solve()
+    os.remove(text_path)
+
+if __name__ == '__main__':
+    from cProfile import Profile
+    p = Profile()
+    p.runcall(_test)
+    p.print_stats(sort = 1)
@@ -31,6 +31,11 @@
 # - del self.producer_fifo[0]
 # + if self.producer_fifo:
 # +     del self.producer_fifo[0]
+#
+# In initiate_send():
+# - keeps sending until the socket would block, instead of returning
+#   after the first send.
+# - runs under send_lock, as the server pushes data from its threads.
 # ======================================================================
 
 r"""A class supporting chat-style (command/response) protocols.
@@ -56,6 +61,7 @@ you - by calling your self.found_terminator() method.
 
 import socket
 import asyncore
+import threading
 from collections import deque
 from sys import py3kwarning
 from warnings import filterwarnings, catch_warnings
@@ -84,6 +90,11 @@ class async_chat (asyncore.dispatcher):
         # we toss the use of the "simple producer" and replace it with
         # a pure deque, which the original fifo was a wrapping of
         self.producer_fifo = deque()
+
+        # data is pushed by the calculating threads as well as sent by
+        # the main loop, and both must not send the head of the fifo
+        # at the same time.
+        self.send_lock = threading.RLock()
         asyncore.dispatcher.__init__ (self, sock, map)
 
     def collect_incoming_data(self, data):
@@ -214,6 +225,10 @@ class async_chat (asyncore.dispatcher):
         self.producer_fifo.append(None)
 
     def initiate_send(self):
+        with self.send_lock:
+            self._initiate_send()
+
+    def _initiate_send(self):
         while self.producer_fifo and self.connected:
             first = self.producer_fifo[0]
             # handle empty string/buffer or None entry
@@ -251,8 +266,12 @@ class async_chat (asyncore.dispatcher):
                 else:
                     if self.producer_fifo:
                         del self.producer_fifo[0]
-            # we tried to send some actual data
-            return
+
+            # keep sending until the socket would block. Data pushed by
+            # the calculating threads would otherwise wait for the next
+            # select() of the main loop to be sent.
+            if num_sent < len(data):
+                return
 
     def discard_buffers (self):
         # Emergencies only!
@@ -0,0 +1,887 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2011 by Xueqiao Xu <xueqiaoxu@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import sys
+import time
+import tempfile
+import random
+import cPickle
+import multiprocessing
+from math import log, hypot
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from algo.astar import *
+from algo.dijkstra import *
+from algo.bidirbfs import *
+from algo import graph
+from algo.graph import make_graph, is_walkable, MASK_MOVES
+from algo.jps import *
+from algo.bidirastar import *
+from algo.arastar import *
+from algo.hpastar import *
+from algo.dstarlite import *
+from algo.batch import route_batch
+from algo.flowfield import flow_field
+from algo.landmarks import Landmarks
+from algo.contraction import ContractionHierarchy, CHDijkstra
+from algo.components import components_of
+from algo.packedmap import save_packed, open_packed, load_map_file
+from algo.mapcache import map_cache, map_diff, patch_map, load_map
+from const.constants import *
+
+
+def gen_map(n_row, n_col, density = 0.2, seed = 0):
+    """Generate a random multi-line map string with the source at the
+    top-left corner and the target at the bottom-right corner.
+
+    :Parameters:
+        density : float
+            the probability of each cell being BLOCKED.
+        seed : hashable
+            seed of the random generator, so that the same map will
+            be generated across runs.
+    """
+    rand = random.Random(seed)
+    rows = []
+    for y in xrange(n_row):
+        rows.append(''.join([BLOCKED if rand.random() < density else NORMAL
+                             for x in xrange(n_col)]))
+    rows[0] = SOURCE + rows[0][1:]
+    rows[-1] = rows[-1][:-1] + TARGET
+    return '\n'.join(rows)
+
+
+HEURISTICS = [('manhattan', MANHATTAN), ('euclidean', EUCLIDEAN),
+              ('chebyshev', CHEBYSHEV), ('octile', OCTILE)]
+
+
+def drain(finder, record = None):
+    """Run the step generator of the finder to its end and return
+    the elapsed time in seconds.
+    """
+    start = time.time()
+    for i in finder.step(record):
+        pass
+    return time.time() - start
+
+
+def bench_dijkstra(sizes):
+    """Time GridDijkstra on square maps of increasing size, using both
+    the dict-of-dicts graph and the CSRGraph. If the search runs in 
+    O((V + E) log V), the ns/((V+E)logV) columns stay roughly constant
+    as the map grows.
+    """
+    print '%8s %10s %10s %10s %14s %10s %14s' % ('size', 'V', 'E', 
+            'seconds', 'ns/((V+E)logV)', 'csr secs', 'ns/((V+E)logV)')
+    for n in sizes:
+        raw = gen_map(n, n)
+        dij = GridDijkstra(raw)
+        v = len(dij.graph)
+        e = sum([len(adj) for adj in dij.graph.itervalues()])
+        t = drain(dij)
+        t_csr = drain(GridDijkstra(raw, csr = True))
+        scale = 1e9 / ((v + e) * log(v, 2))
+        print '%8s %10d %10d %10.3f %14.2f %10.3f %14.2f' % (
+                '%dx%d' % (n, n), v, e, t, t * scale, t_csr, t_csr * scale)
+
+
+def bench_astar(sizes):
+    """Time AStar and ArrayAStar with each heuristic on square maps of
+    increasing size.
+    """
+    print '%8s %12s %10s %10s %10s %10s' % (('size', 'finder') + 
+            tuple([name for name, h in HEURISTICS]))
+    for n in sizes:
+        raw = gen_map(n, n)
+        for finder in (AStar, ArrayAStar):
+            times = [drain(finder(raw, h)) for name, h in HEURISTICS]
+            print '%8s %12s %10.3f %10.3f %10.3f %10.3f' % (('%dx%d' % (n, n),
+                    finder.__name__) + tuple(times))
+
+
+def deep_sizeof(obj):
+    """Return the total size in bytes of the object and all the 
+    dicts, tuples and numbers it references. Shared objects are 
+    counted once.
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.iterkeys())
+            stack.extend(o.itervalues())
+        elif isinstance(o, tuple):
+            stack.extend(o)
+    return total
+
+
+def bench_graph_memory(sizes):
+    """Compare the memory used by the dict-of-dicts graph and the 
+    CSRGraph built by make_graph on square maps.
+    """
+    print '%10s %10s %12s %12s %10s %10s' % ('size', 'E', 'dict bytes',
+            'csr bytes', 'dict B/E', 'csr B/E')
+    for n in sizes:
+        raw = gen_map(n, n)
+        csr = make_graph(raw, csr = True)[0]
+        e = len(csr.neighbours)
+        d_bytes = deep_sizeof(make_graph(raw)[0])
+        c_bytes = csr.nbytes()
+        print '%10s %10d %12d %12d %10.1f %10.1f' % ('%dx%d' % (n, n), 
+                e, d_bytes, c_bytes, float(d_bytes) / e, 
+                float(c_bytes) / e)
+
+
+def bench_make_graph(sizes):
+    """Time the construction of the dict-of-dicts graph, the CSRGraph
+    built with Python loops over the neighbour masks, which count in 
+    the time, and the CSRGraph built with NumPy.
+    """
+    print '%10s %10s %10s %10s' % ('size', 'dict', 'csr loops', 
+                                   'csr numpy')
+    for n in sizes:
+        raw = gen_map(n, n)
+        rows = raw.split()
+        builders = [lambda: make_graph(raw),
+                    lambda: graph._make_csr_graph(
+                        rows, graph.neighbour_masks(rows, n, n), n, n)]
+        if graph.numpy is not None:
+            builders.append(lambda: graph._make_csr_graph_numpy(rows, n, n))
+        times = [float('nan')] * 3
+        for i, build in enumerate(builders):
+            start = time.time()
+            build()
+            times[i] = time.time() - start
+        print '%10s %10.3f %10.3f %10.3f' % (('%dx%d' % (n, n),) + 
+                                             tuple(times))
+
+
+def count_closed(finder):
+    """Run the finder with a record and return the elapsed time and
+    the number of nodes closed.
+    """
+    record = []
+    t = drain(finder, record)
+    return t, len([r for r in record if r[0] == 'CLOSE'])
+
+
+def bench_jps(sizes):
+    """Compare the time and the number of closed nodes of AStar and 
+    JumpPointSearch on open and cluttered square maps.
+    """
+    print '%8s %8s %10s %10s %10s %10s' % ('size', 'density', 
+            'astar secs', 'closed', 'jps secs', 'closed')
+    for n in sizes:
+        for density in (0.0, 0.1, 0.3):
+            raw = gen_map(n, n, density)
+            print '%8s %8.2f %10.3f %10d %10.3f %10d' % ((
+                    '%dx%d' % (n, n), density) + 
+                    count_closed(AStar(raw, OCTILE)) + 
+                    count_closed(JumpPointSearch(raw, OCTILE)))
+
+
+def bench_bidir(sizes):
+    """Compare the time and the number of closed nodes of AStar and
+    BiDirAStar on square maps, with the Octile heuristic.
+    """
+    print '%8s %8s %10s %10s %10s %10s' % ('size', 'density', 
+            'astar secs', 'closed', 'bidir secs', 'closed')
+    for n in sizes:
+        for density in (0.0, 0.1, 0.3):
+            raw = gen_map(n, n, density)
+            print '%8s %8.2f %10.3f %10d %10.3f %10d' % ((
+                    '%dx%d' % (n, n), density) + 
+                    count_closed(AStar(raw, OCTILE)) + 
+                    count_closed(BiDirAStar(raw, OCTILE)))
+
+
+def bench_weighted(sizes):
+    """Compare AStar with the weights 1, 1.5, 2 and 3, and report when 
+    ARA* starting from the weight 3 finds its first and its last path,
+    with the costs of those paths. All use the Octile heuristic.
+    """
+    print '%8s %10s %10s %10s %10s' % ('size', 'finder', 'secs', 
+                                       'closed', 'cost')
+    for n in sizes:
+        raw = gen_map(n, n)
+        size = '%dx%d' % (n, n)
+        for w in (1, 1.5, 2, 3):
+            a = AStar(raw, OCTILE, w)
+            print '%8s %10s %10.3f %10d %10d' % ((size, 'W=%s' % w) + 
+                    count_closed(a) + (path_cost(a.path),))
+        ara = ARAStar(raw, OCTILE, 3)
+        record = []
+        start = time.time()
+        paths = []
+        for i in ara.step(record):
+            if record and record[-1][0] == 'PATH':
+                paths.append((time.time() - start, record[-1][1]))
+            del record[:]
+        for name, (t, path) in zip(('ARA* first', 'ARA* last'), 
+                                   (paths[0], paths[-1])):
+            print '%8s %10s %10.3f %10s %10d' % (size, name, t, '', 
+                                                 path_cost(path))
+
+
+def bench_hpa(sizes):
+    """Time HPAStar on a map seen for the first time, which links the
+    clusters it searches, the linking of all the other clusters, and 
+    the queries with other endpoints on the same map, compared to 
+    AStar with the Octile heuristic. The costs are the totals of the
+    warm queries.
+    """
+    print '%8s %10s %10s %10s %10s %10s %10s' % ('size', 'cold secs', 
+            'link secs', 'hpa secs', 'cost', 'astar secs', 'cost')
+    for n in sizes:
+        raw = gen_map(n, n)
+        map_cache.clear()
+        hpa = HPAStar(raw)
+        cold = drain(hpa)
+        start = time.time()
+        hpa.abstraction.build()
+        link = time.time() - start
+        secs = [0, 0]
+        costs = [0, 0]
+        for seed in xrange(5):
+            moved = move_endpoints(raw, seed)
+            for k, finder in enumerate((HPAStar, 
+                                        lambda raw: AStar(raw, OCTILE))):
+                start = time.time()
+                a = finder(moved)
+                drain(a)
+                secs[k] += time.time() - start
+                costs[k] += path_cost(a.path)
+        print '%8s %10.3f %10.3f %10.3f %10d %10.3f %10d' % (
+                '%dx%d' % (n, n), cold, link, secs[0], costs[0], 
+                secs[1], costs[1])
+
+
+def toggle_cells(raw, count, seed):
+    """Return the map with count random cells other than the source
+    and the target toggled between NORMAL and BLOCKED.
+    """
+    rand = random.Random(seed)
+    rows = [list(row) for row in raw.split()]
+    while count:
+        y = rand.randrange(len(rows))
+        x = rand.randrange(len(rows[0]))
+        if rows[y][x] in (NORMAL, BLOCKED):
+            rows[y][x] = BLOCKED if rows[y][x] == NORMAL else NORMAL
+            count -= 1
+    return '\n'.join([''.join(row) for row in rows])
+
+
+def bench_dstar(sizes):
+    """Time DStarLite on a new map and on 5 successive edits of 3 
+    cells each, compared to new AStar searches with the Octile 
+    heuristic. The edit columns are the averages of the 5 edits.
+    """
+    print '%8s %10s %10s %10s %10s %10s' % ('size', 'dstar secs', 
+            'astar secs', 'edit dstar', 'edit astar', 'same cost')
+    for n in sizes:
+        raw = gen_map(n, n)
+        dsl = DStarLite(raw)
+        first = drain(dsl)
+        a = AStar(raw, OCTILE)
+        first_a = drain(a)
+        same = path_cost(dsl.path) == path_cost(a.path)
+        secs = [0, 0]
+        for seed in xrange(5):
+            raw = toggle_cells(raw, 3, seed)
+            start = time.time()
+            dsl.update_map(raw)
+            drain(dsl)
+            secs[0] += time.time() - start
+            a = AStar(raw, OCTILE)
+            secs[1] += drain(a)
+            same = same and path_cost(dsl.path) == path_cost(a.path)
+        print '%8s %10.3f %10.3f %10.4f %10.4f %10s' % ('%dx%d' % (n, n),
+                first, first_a, secs[0] / 5, secs[1] / 5, same)
+
+
+def bench_map_diff(sizes):
+    """Compare sending an edit of 3 cells as a new MAP and as a 
+    MAPDIFF: the size of the message, and the time to answer an 
+    HPAStar query on the edited map, starting from a cache holding the
+    old map with all its clusters linked.
+    """
+    print '%8s %10s %10s %10s %10s' % ('size', 'map bytes', 'diff bytes',
+                                       'map secs', 'diff secs')
+    for n in sizes:
+        raw = gen_map(n, n)
+        edited = toggle_cells(raw, 3, n)
+        changes = map_diff(raw, edited)
+        secs = []
+        for patch in (False, True):
+            map_cache.clear()
+            HPAStar(raw).abstraction.build()
+            start = time.time()
+            if patch:
+                edited = patch_map(raw, changes)
+            drain(HPAStar(edited))
+            secs.append(time.time() - start)
+        print '%8s %10d %10d %10.3f %10.3f' % (('%dx%d' % (n, n), 
+                len(cPickle.dumps(('MAP', edited))), 
+                len(cPickle.dumps(('MAPDIFF', changes)))) + tuple(secs))
+
+
+def bench_batch(sizes):
+    """Time 100 ArrayAStar queries between random pairs of nodes on the 
+    same map, sent one by one as maps with their own endpoints, and 
+    sent together to route_batch, in this process and in a pool of 
+    cpu_count() processes.
+    """
+    processes = multiprocessing.cpu_count()
+    print '%8s %10s %10s %10s' % ('size', 'single', 'batch', 
+                                  'batch x%d' % processes)
+    for n in sizes:
+        raw = gen_map(n, n)
+        rand = random.Random(n)
+        rows = raw.replace(SOURCE, NORMAL).replace(TARGET, NORMAL).split()
+        cells = [(x, y) for y in xrange(n) for x in xrange(n) 
+                 if rows[y][x] == NORMAL]
+        pairs = [(rand.choice(cells), rand.choice(cells)) 
+                 for i in xrange(100)]
+
+        map_cache.clear()
+        start = time.time()
+        for (sx, sy), (tx, ty) in pairs:
+            query = [list(row) for row in rows]
+            query[sy][sx] = SOURCE
+            query[ty][tx] = TARGET
+            drain(ArrayAStar('\n'.join([''.join(row) for row in query]),
+                             OCTILE))
+        secs = [time.time() - start]
+        for p in (1, processes):
+            map_cache.clear()
+            start = time.time()
+            route_batch(raw, pairs, processes = p)
+            secs.append(time.time() - start)
+        print '%8s %10.3f %10.3f %10.3f' % (('%dx%d' % (n, n),) + 
+                                            tuple(secs))
+
+
+def bench_flow_field(sizes):
+    """Time the flow field towards the target of the map, and walking
+    100 agents from random cells to the target along it, compared to
+    the route_batch queries of the same agents.
+    """
+    print '%8s %10s %10s %10s' % ('size', 'field secs', 'walk secs', 
+                                  'batch secs')
+    for n in sizes:
+        raw = gen_map(n, n)
+        rand = random.Random(n)
+        rows = raw.split()
+        cells = [(x, y) for y in xrange(n) for x in xrange(n) 
+                 if rows[y][x] == NORMAL]
+        agents = [rand.choice(cells) for i in xrange(100)]
+
+        map_cache.clear()
+        start = time.time()
+        field = flow_field(raw)
+        secs = [time.time() - start]
+        start = time.time()
+        for pos in agents:
+            if field.distance(pos) < INF:
+                while pos != field.target:
+                    pos = field.next_step(pos)
+        secs.append(time.time() - start)
+        start = time.time()
+        route_batch(raw, [(pos, field.target) for pos in agents], 
+                    processes = 1)
+        secs.append(time.time() - start)
+        print '%8s %10.3f %10.3f %10.3f' % (('%dx%d' % (n, n),) + 
+                                            tuple(secs))
+
+
+def bench_alt(sizes):
+    """Time the landmark preprocessing of square maps, building the 
+    tables and loading them back from disk, and compare AStar with the
+    Octile and ALT heuristics on 20 queries with random endpoints: the
+    total search time and number of closed nodes.
+    """
+    print '%8s %10s %10s %10s %10s %10s %10s' % ('size', 'build secs',
+            'load secs', 'octile', 'closed', 'alt', 'closed')
+    path = os.path.join(tempfile.gettempdir(), 'benchmark.alt')
+    for n in sizes:
+        raw = gen_map(n, n, 0.3)
+        grid = load_map(raw)[0]
+        start = time.time()
+        alt = Landmarks.build(grid)
+        build = time.time() - start
+        alt.save(path)
+        start = time.time()
+        Landmarks.load(path)
+        load = time.time() - start
+        os.remove(path)
+
+        results = []
+        for h in (OCTILE, ALT):
+            secs = closed = 0
+            for seed in xrange(20):
+                t, c = count_closed(AStar(move_endpoints(raw, seed), h))
+                secs += t
+                closed += c
+            results.extend([secs, closed])
+        print '%8s %10.3f %10.3f %10.3f %10d %10.3f %10d' % ((
+                '%dx%d' % (n, n), build, load) + tuple(results))
+
+
+def gen_road_graph(n, seed = 0):
+    """Generate a road-like graph of n * n junctions, each placed 
+    near a point of a square lattice and linked to its right and lower
+    neighbours, with 20% of the roads missing. The weight of a road is
+    its length.
+    """
+    rand = random.Random(seed)
+    pos = [(x + rand.random() * 0.6, y + rand.random() * 0.6) 
+           for y in xrange(n) for x in xrange(n)]
+    graph = dict([(i, {}) for i in xrange(n * n)])
+    for i in xrange(n * n):
+        for j in (i + 1 if (i + 1) % n else None, i + n):
+            if j is None or j >= n * n or rand.random() < 0.2:
+                continue
+            (x1, y1), (x2, y2) = pos[i], pos[j]
+            w = int(hypot(x1 - x2, y1 - y2) * 100)
+            graph[i][j] = graph[j][i] = w
+    return graph
+
+
+def bench_contraction(sizes):
+    """Time the contraction of road-like graphs of size * size nodes,
+    and compare 50 queries between random nodes answered by Dijkstra
+    and by CHDijkstra: the total time and number of nodes settled.
+    """
+    print '%8s %10s %10s %10s %10s %10s %10s' % ('nodes', 'shortcuts', 
+            'build secs', 'dijk secs', 'settled', 'ch secs', 'settled')
+    for n in sizes:
+        graph = gen_road_graph(n)
+        start = time.time()
+        ch = ContractionHierarchy(graph)
+        build = time.time() - start
+        rand = random.Random(n)
+        pairs = [(rand.randrange(n * n), rand.randrange(n * n))
+                 for i in xrange(50)]
+        results = []
+        for make in (lambda s, t: Dijkstra(graph, s, t),
+                     lambda s, t: CHDijkstra(ch, s, t)):
+            secs = settled = 0
+            for s, t in pairs:
+                query_secs, closed = count_closed(make(s, t))
+                secs += query_secs
+                settled += closed
+            results.extend([secs, settled])
+        print '%8d %10d %10.3f %10.3f %10d %10.3f %10d' % ((n * n, 
+                ch.n_shortcuts, build) + tuple(results))
+
+
+def bench_components(sizes):
+    """Time the labelling of the components of square maps whose target
+    is walled in, the patching of the labels for 5 edits of 3 cells 
+    each (on average), and an ArrayAStar query for the target, which is
+    answered by the labels, compared to exploring the component of the
+    source as the search did before.
+    """
+    print '%8s %10s %10s %10s %10s' % ('size', 'label secs', 'patch secs',
+                                       'query secs', 'explore')
+    for n in sizes:
+        rows = [list(row) for row in gen_map(n, n).split()]
+        rows[n - 1][n - 2] = rows[n - 2][n - 1] = BLOCKED
+        raw = '\n'.join([''.join(row) for row in rows])
+
+        map_cache.clear()
+        grid, source, target = load_map(raw)
+        start = time.time()
+        comp = components_of(grid)
+        secs = [time.time() - start]
+
+        patch = 0
+        for seed in xrange(5):
+            edited = toggle_cells(raw, 3, seed).split()
+            cells = [(x, y) for y in xrange(n) for x in xrange(n)
+                     if edited[y][x] != rows[y][x]]
+            edited = graph.GridMap(edited)
+            start = time.time()
+            comp.patched(edited, cells)
+            patch += time.time() - start
+        secs.append(patch / 5)
+
+        secs.append(drain(ArrayAStar(raw, OCTILE)))
+        csr = grid.csr()
+        start = time.time()
+        csr_distances(csr, csr.index(source))
+        secs.append(time.time() - start)
+        print '%8s %10.3f %10.4f %10.5f %10.3f' % (('%dx%d' % (n, n),) + 
+                                                   tuple(secs))
+
+
+def bench_solve(sizes):
+    """Compare draining step with calling solve, for the finders which
+    have a loop of their own for it, on square maps.
+    """
+    print '%8s %12s %10s %10s %8s' % ('size', 'finder', 'step secs', 
+                                      'solve secs', 'speedup')
+    finders = [('AStar', lambda raw: AStar(raw, OCTILE)),
+               ('ArrayAStar', lambda raw: ArrayAStar(raw, OCTILE)),
+               ('Dijkstra', lambda raw: GridDijkstra(raw, csr = True)),
+               ('BiDirBFS', BiDirBFS)]
+    for n in sizes:
+        raw = gen_map(n, n)
+        for name, finder in finders:
+            step = drain(finder(raw))
+            a = finder(raw)
+            start = time.time()
+            a.solve()
+            solve = time.time() - start
+            print '%8s %12s %10.3f %10.3f %8.2f' % ('%dx%d' % (n, n), name,
+                                                   step, solve, step / solve)
+
+
+def query_peak_memory(load):
+    """Return the growth of the peak memory, in megabytes, of a process
+    loading a map by calling load and running an ArrayAStar query on it,
+    or None where it can not be measured. The structures the query 
+    builds along with the map, such as the components and the neighbour
+    masks, count as well.
+    """
+    if resource is None:
+        return None
+
+    def run(queue):
+        # the peak of a forked process starts from the memory in use
+        base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        ArrayAStar(load(), OCTILE).solve()
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        queue.put(peak - base)
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target = run, args = (queue,))
+    process.start()
+    growth = queue.get()
+    process.join()
+    # in kilobytes on Linux, in bytes on Mac OS X
+    return growth / (1024.0 ** 2 if sys.platform == 'darwin' else 1024.0)
+
+
+def bench_packed_map(sizes):
+    """Compare a map given as a string with the same map in a packed
+    map file: the size of the map, the time to load it and the memory
+    used by its grid afterwards, the time of an ArrayAStar query, and
+    the peak memory of a process loading the map and running the query
+    (which is far more than the grid, see query_peak_memory).
+    """
+    print '%8s %10s %10s %10s %10s %10s %10s %10s %10s %9s %9s' % (
+            'size', 'raw bytes', 'file bytes', 'parse secs', 'open secs', 
+            'raw grid', 'packed', 'raw query', 'packed', 'raw MB', 
+            'packed MB')
+    path = os.path.join(tempfile.gettempdir(), 'benchmark.pfm')
+    for n in sizes:
+        raw = gen_map(n, n)
+        save_packed(raw, path)
+        map_cache.clear()
+        peaks = [query_peak_memory(lambda: raw), 
+                 query_peak_memory(lambda: open_packed(path))]
+        start = time.time()
+        loaded = load_map(raw)
+        secs = [time.time() - start]
+        start = time.time()
+        packed = open_packed(path)
+        secs.append(time.time() - start)
+        nbytes = [loaded[0].nbytes(), packed[0].nbytes()]
+        for m in (loaded, packed):
+            a = ArrayAStar(m, OCTILE)
+            start = time.time()
+            a.solve()
+            secs.append(time.time() - start)
+        print '%8s %10d %10d %10.4f %10.4f %10d %10d %10.3f %10.3f' % ((
+                '%dx%d' % (n, n), len(raw), os.path.getsize(path)) + 
+                tuple(secs[:2] + nbytes + secs[2:])),
+        print ' '.join(['%9s' % ('%.1f' % peak if peak is not None else '-')
+                        for peak in peaks])
+    os.remove(path)
+
+
+def bench_map_file(sizes):
+    """Compare loading a text map file by reading it whole and parsing
+    the string, with streaming it row by row into a packed grid: the 
+    time, and the bytes held afterwards, by the string and the grid or
+    by the packed grid.
+    """
+    print '%8s %10s %10s %10s %10s %10s' % ('size', 'file bytes', 
+            'read secs', 'held', 'stream secs', 'held')
+    path = os.path.join(tempfile.gettempdir(), 'benchmark.map')
+    for n in sizes:
+        with open(path, 'wb') as f:
+            f.write(gen_map(n, n))
+        map_cache.clear()
+        start = time.time()
+        with open(path, 'rb') as f:
+            raw = f.read()
+        grid = load_map(raw)[0]
+        read = time.time() - start
+        held = len(raw) + grid.nbytes()
+        del raw, grid
+        start = time.time()
+        packed = load_map_file(path)[0]
+        print '%8s %10d %10.4f %10d %10.4f %10d' % ('%dx%d' % (n, n), 
+                os.path.getsize(path), read, held, time.time() - start, 
+                packed.nbytes())
+    os.remove(path)
+
+
+def bench_neighbours(sizes):
+    """Time building the neighbour masks of square maps, and A* on 
+    them, in each neighbour mode, with the G value of the path found.
+    """
+    print '%8s %8s %10s %10s %8s' % ('size', 'mode', 'mask secs', 
+                                     'A* secs', 'G')
+    modes = [('4', NEIGHBOURS_4), ('8-nocut', NEIGHBOURS_8_NO_CUT), 
+             ('8', NEIGHBOURS_8)]
+    for n in sizes:
+        grid, source, target = load_map(gen_map(n, n))
+        for name, mode in modes:
+            g = grid.with_neighbours(mode)
+            start = time.time()
+            g.masks()
+            masks = time.time() - start
+            a = ArrayAStar((g, source, target), OCTILE)
+            start = time.time()
+            a.solve()
+            search = time.time() - start
+            dst = target[1] * n + target[0]
+            print '%8s %8s %10.4f %10.3f %8s' % ('%dx%d' % (n, n), name, 
+                    masks, search, a.g[dst] if a.path else '-')
+
+
+def bench_expansion(sizes):
+    """Measure the throughput of the neighbour expansion over all the 
+    walkable cells of square maps, in cells per second: probing the 
+    cells around with is_walkable, as the finders did, against reading
+    them from the padded grid, and iterating the neighbour masks. 
+    """
+    print '%8s %12s %12s %12s' % ('size', 'is_walkable', 'padded', 
+                                  'masks')
+
+    def probe_rows(grid, cells):
+        rows, n_row, n_col = grid.rows, grid.n_row, grid.n_col
+        count = 0
+        for x, y in cells:
+            for k in xrange(4):
+                nx = x + XOFFSET[k]
+                ny = y + YOFFSET[k]
+                if is_walkable(nx, ny, n_row, n_col, rows):
+                    count += 1
+                    for nx, ny in ((x + DAXOFFSET[k], y + DAYOFFSET[k]),
+                                   (x + DBXOFFSET[k], y + DBYOFFSET[k])):
+                        if is_walkable(nx, ny, n_row, n_col, rows):
+                            count += 1
+        return count
+
+    def probe_padded(grid, cells):
+        padded, w = grid.padded(), grid.n_col + 2
+        # the same probes, at fixed offsets in the padded grid
+        offsets = [(YOFFSET[k] * w + XOFFSET[k], 
+                    DAYOFFSET[k] * w + DAXOFFSET[k], 
+                    DBYOFFSET[k] * w + DBXOFFSET[k]) for k in xrange(4)]
+        count = 0
+        for x, y in cells:
+            j = (y + 1) * w + x + 1
+            for o, a, b in offsets:
+                if padded[j + o]:
+                    count += 1
+                    if padded[j + a]:
+                        count += 1
+                    if padded[j + b]:
+                        count += 1
+        return count
+
+    def iterate_masks(grid, cells):
+        masks, n_col = grid.masks(), grid.n_col
+        count = 0
+        for x, y in cells:
+            for dx, dy, dist in MASK_MOVES[masks[y * n_col + x]]:
+                count += 1
+        return count
+
+    for n in sizes:
+        grid = load_map(gen_map(n, n))[0]
+        cells = [(x, y) for y in xrange(n) for x in xrange(n) 
+                 if grid.rows[y][x] != BLOCKED]
+        grid.padded()
+        grid.masks()
+        rates = []
+        for expand in (probe_rows, probe_padded, iterate_masks):
+            start = time.time()
+            expand(grid, cells)
+            rates.append(len(cells) / (time.time() - start))
+        print '%8s %12d %12d %12d' % (('%dx%d' % (n, n),) + tuple(rates))
+
+
+def bench_heuristics(sizes):
+    """Run AStar with every heuristic on a corpus of generated maps of
+    each size, and report the total number of closed nodes, the total
+    path cost, and the number of paths longer than the shortest ones
+    found by Dijkstra.
+    """
+    print '%8s %10s %10s %10s %10s %10s %10s' % ('size', 'heuristic',
+            'admissible', 'secs', 'closed', 'cost', 'suboptimal')
+    for n in sizes:
+        corpus = [gen_map(n, n, density, seed) 
+                  for density in (0.0, 0.1, 0.2, 0.3)
+                      for seed in xrange(5)]
+        best = []
+        for raw in corpus:
+            dij = GridDijkstra(raw, csr = True)
+            drain(dij)
+            best.append(path_cost(dij.path))
+        for name, h in HEURISTICS:
+            secs = closed = cost = suboptimal = 0
+            for raw, shortest in zip(corpus, best):
+                a = AStar(raw, h)
+                t, c = count_closed(a)
+                secs += t
+                closed += c
+                cost += path_cost(a.path)
+                suboptimal += path_cost(a.path) > shortest
+            print '%8s %10s %10s %10.3f %10d %10d %10d' % (
+                    '%dx%d' % (n, n), name, AStar.h_admissible[h], 
+                    secs, closed, cost, suboptimal)
+
+
+def path_cost(path):
+    """Return the cost of moving along the path.
+    """
+    cost = 0
+    for (x1, y1), (x2, y2) in zip(path, path[1:]):
+        cost += DDIST if x1 != x2 and y1 != y2 else DIST
+    return cost
+
+
+def move_endpoints(raw, seed):
+    """Return the map with the source and target moved to random
+    NORMAL cells, so that the layout of the map stays the same.
+    """
+    rand = random.Random(seed)
+    rows = [list(row) for row in 
+            raw.replace(SOURCE, NORMAL).replace(TARGET, NORMAL).split()]
+    for symbol in (SOURCE, TARGET):
+        while True:
+            y = rand.randrange(len(rows))
+            x = rand.randrange(len(rows[0]))
+            if rows[y][x] == NORMAL:
+                rows[y][x] = symbol
+                break
+    return '\n'.join([''.join(row) for row in rows])
+
+
+def bench_map_cache(sizes):
+    """Time the construction of the finders on a map seen for the
+    first time and on the same map with other endpoints.
+    """
+    finders = [('AStar', AStar), ('BiDirBFS', BiDirBFS),
+               ('GridDijkstra', lambda raw: GridDijkstra(raw, csr = True))]
+    print '%10s %14s %10s %10s' % ('size', 'finder', 'cold secs', 
+                                   'warm secs')
+    for n in sizes:
+        raw = gen_map(n, n)
+        for name, finder in finders:
+            map_cache.clear()
+            start = time.time()
+            finder(raw)
+            cold = time.time() - start
+            start = time.time()
+            finder(move_endpoints(raw, n))
+            warm = time.time() - start
+            print '%10s %14s %10.4f %10.4f' % ('%dx%d' % (n, n), name,
+                                               cold, warm)
+    print 'map cache:', map_cache.stats()
+
+
+BENCHMARKS = {'alt': bench_alt,
+              'astar': bench_astar,
+              'batch': bench_batch,
+              'bidir': bench_bidir,
+              'components': bench_components,
+              'contraction': bench_contraction,
+              'dijkstra': bench_dijkstra,
+              'dstar': bench_dstar,
+              'expansion': bench_expansion,
+              'flow-field': bench_flow_field,
+              'graph-memory': bench_graph_memory,
+              'heuristics': bench_heuristics,
+              'hpa': bench_hpa,
+              'jps': bench_jps,
+              'map-cache': bench_map_cache,
+              'map-diff': bench_map_diff,
+              'map-file': bench_map_file,
+              'packed-map': bench_packed_map,
+              'make-graph': bench_make_graph,
+              'neighbours': bench_neighbours,
+              'solve': bench_solve,
+              'weighted': bench_weighted}
+
+DEFAULT_SIZES = [50, 100, 200, 400]
+
+
+def print_help():
+    print """usage: benchmark.py [-b name] [-s size[,size ...]]
+example: benchmark.py -b dijkstra -s 100,200,500
+
+Available benchmarks: %s
+By default all the benchmarks are run on sizes %s""" % (
+        ', '.join(sorted(BENCHMARKS)),
+        ','.join(map(str, DEFAULT_SIZES)))
+
+
+if __name__ == '__main__':
+    names = sorted(BENCHMARKS)
+    sizes = DEFAULT_SIZES
+    import getopt
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hb:s:', ['help'])
+        for o, a in opts:
+            if o in ('-h', '--help'):
+                print_help()
+                raise SystemExit
+            elif o == '-b':
+                names = a.split(',')
+            elif o == '-s':
+                sizes = map(int, a.split(','))
+        benches = [BENCHMARKS[name] for name in names]
+    except (getopt.GetoptError, ValueError, LookupError):
+        print "Invalid arguments\n"
+        print_help()
+        raise SystemExit
+    for name, bench in zip(names, benches):
+        print '==', name, '=='
+        bench(sizes)
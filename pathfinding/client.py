@@ -33,6 +33,7 @@ import asynchatmod as asynchat
 import pygame
 from pygame.locals import *
 
+from algo.mapcache import map_diff
 from const.constants import *
 
 
@@ -68,7 +69,16 @@ class CoreClient(asynchat.async_chat, threading.Thread):
                          'CLOSE': self._cmd_close,
                          'VALUE': self._cmd_value,
                          'PARENT': self._cmd_parent,
-                         'PATH': self._cmd_path}
+                         'PATH': self._cmd_path,
+                         'NOMAP': self._cmd_nomap}
+
+        # the last map sent to the server, so that only the cells 
+        # changed since then are sent next time
+        self.last_map = None
+
+        # the arguments of the last calc, to send the query again with
+        # the full map if the server could not apply the changes
+        self.last_calc = None
 
         # algorithm dictionary
         self.algo_dict = {ASTARM: 'ASTARM',
@@ -120,7 +130,13 @@ class CoreClient(asynchat.async_chat, threading.Thread):
         """Request for starting the calculation.
         """
         data_algo = cPickle.dumps(('ALGO', self.algo_dict[algo])) + TERM
-        data_map = cPickle.dumps(('MAP', str_map)) + TERM
+        changes = map_diff(self.last_map, str_map) if self.last_map else None
+        if changes is None:
+            data_map = cPickle.dumps(('MAP', str_map)) + TERM
+        else:
+            data_map = cPickle.dumps(('MAPDIFF', changes)) + TERM
+        self.last_map = str_map
+        self.last_calc = (str_map, algo, speed)
         data_speed = cPickle.dumps(('SPEED', speed)) + TERM
         data_start = cPickle.dumps(('START', '')) + TERM
 
@@ -170,6 +186,13 @@ class CoreClient(asynchat.async_chat, threading.Thread):
     def _cmd_path(self, arg):
         self.path_callback(arg)
 
+    def _cmd_nomap(self, arg):
+        # the server dropped the changes sent last, send the full map
+        print 'map changes rejected:', arg
+        self.last_map = None
+        if self.last_calc:
+            self.calc(*self.last_calc)
+
     
 
 
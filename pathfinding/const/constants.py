@@ -29,6 +29,18 @@ DAYOFFSET = (-1, 1, 1, -1)
 DBXOFFSET = (-1, 1, 1, -1) 
 DBYOFFSET = (-1, -1, 1, 1)
 
+# the moves to the neighbouring cells, horizontal and vertical ones 
+# first. Bit k of the neighbour mask of a cell, see GridMap.masks(), 
+# tells whether the move MOVE_DIRECTIONS[k] can be made from it.
+MOVE_DIRECTIONS = ((0, -1), (1, 0), (0, 1), (-1, 0), 
+                   (1, -1), (-1, -1), (1, 1), (-1, 1))
+
+# the neighbour modes of a map, i.e. the moves allowed from a cell:
+NEIGHBOURS_4        = 0 # the horizontal and vertical moves only,
+NEIGHBOURS_8_NO_CUT = 1 # and the diagonal ones beside two walkable cells,
+NEIGHBOURS_8        = 2 # or beside at least one, cutting the corner of 
+                        # the other cell (the default)
+
 NORMAL  = '0'
 BLOCKED = '1'
 SOURCE  = 'S'
@@ -42,9 +54,46 @@ DIST  = 10
 DDIST = 14 # diagonal distance
 INF   = int(1e9)
 
+# the size limit of the parsed map cache in bytes
+MAP_CACHE_BYTES = 256 * 1024 * 1024
+
 MANHATTAN = 0
 EUCLIDEAN = 1
 CHEBYSHEV = 2
+OCTILE    = 3
+ALT       = 4 # landmarks and the triangle inequality, see algo/landmarks.py
+
+# the number of landmarks of the ALT heuristic
+ALT_LANDMARKS = 8
+
+# the default weight of the heuristic in weighted A* and the initial
+# one of ARA*, and the amount ARA* lowers it by after each path found
+DEFAULT_WEIGHT  = 2.0
+ARA_WEIGHT_STEP = 0.5
+
+# the width and height of the clusters of HPA*, and the width from 
+# which an entrance between two clusters is linked by two transitions
+HPA_CLUSTER_SIZE  = 16
+HPA_WIDE_ENTRANCE = 6
+
+# the number of nodes a witness search of the contraction hierarchy
+# settles before giving up and adding the shortcut
+CH_WITNESS_SETTLED = 64
+
+# the number of flow fields, each towards its own target, kept along
+# with a map
+FLOW_FIELDS_KEPT = 16
+
+# the fraction of the cells of a map the searches for the parts of a 
+# cut component may visit before the whole map is labelled again
+SPLIT_SEARCH_SHARE = 0.0625
+
+# the number of rows of a packed map kept decoded at a time
+PACKED_ROWS_CACHED = 1024
+
+# the number of cells whose neighbour masks are computed at a time 
+# with NumPy
+MASK_BAND_CELLS = 1 << 20
 
 ASTARM   = 0
 ASTARE   = 1
@@ -61,6 +110,18 @@ CTARGET = 2
 # used by C/S communication
 # =======================================
 TERM = '<end>' # line terminator
+
+# the size limit of the server's route cache in bytes
+ROUTE_CACHE_BYTES = 64 * 1024 * 1024
+
+# a search process sends the records of its steps to the server in
+# batches of up to STREAM_STEPS steps, held for at most STREAM_SECS 
+# seconds, and checks one of CANCEL_SLOTS flags for a stop request. It
+# waits while JOB_BATCHES of its batches are not taken by the server.
+STREAM_STEPS = 64
+STREAM_SECS  = 0.05
+CANCEL_SLOTS = 1024
+JOB_BATCHES  = 4
 RUNNING = 0
 STOPPED = 1
 
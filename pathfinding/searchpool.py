@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2011 by Xueqiao Xu <xueqiaoxu@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import time
+import Queue
+import threading
+import multiprocessing
+
+from const.constants import *
+
+# the result queue, the cancellation flags and the counts of batches
+# taken by the server of a search process, set by _init_worker
+_results = None
+_cancelled = None
+_taken = None
+
+
+class PathRecord(list):
+    """A record which keeps the PATH entries only, so that the finders
+    run under a deadline do not spend time on records nobody reads.
+    """
+
+    def append(self, entry):
+        if entry[0] == 'PATH':
+            list.append(self, entry)
+
+
+class SearchPool(object):
+    """A pool of worker processes running the searches of the server, 
+    so that the searches of concurrent clients run on all the cores
+    instead of taking turns on the interpreter lock of the server.
+
+    The worker runs the search at full speed and sends back the records
+    of its steps in batches. A dispatcher thread hands each batch to 
+    the queue of its job, from which the server sends the records to 
+    its client at the pace of the client. The job queues are bounded:
+    a worker waits while JOB_BATCHES of its batches are not taken from
+    the queue, so a slow client does not let the records of the whole
+    search pile up in the server.
+    
+    Each job queue receives the messages:
+        ('RECORDS', steps): a list of steps, each being the list of 
+            the records appended during that step.
+        ('DONE', (path, finished)): the path found, and whether the 
+            search ended before its deadline.
+        ('ERROR', why): the search raised an exception.
+    """
+
+    def __init__(self, processes = None):
+        """
+        :Parameters:
+            processes : int
+                The number of worker processes, cpu_count() by default.
+        """
+        self.results = multiprocessing.Queue()
+        self.cancelled = multiprocessing.RawArray('i', CANCEL_SLOTS)
+        self.taken = multiprocessing.RawArray('i', CANCEL_SLOTS)
+        self.pool = multiprocessing.Pool(processes, _init_worker,
+                                         (self.results, self.cancelled,
+                                          self.taken))
+        self.jobs = {}
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+        dispatcher = threading.Thread(target = self._dispatch)
+        dispatcher.daemon = True
+        dispatcher.start()
+
+    def submit(self, finder, raw_graph, end = None):
+        """Start a search in a worker process.
+
+        :Parameters:
+            finder : callable
+                The finder factory, called with raw_graph in the worker.
+                It must be picklable.
+
+            raw_graph : str
+                A multi-line string representing the graph.
+
+            end : float
+                If given, the search is run under a deadline: it stops 
+                when time.time() reaches end, and only its PATH records
+                are sent, as soon as they are appended.
+
+        :Return:
+            job_id : int
+                The id to cancel the job with.
+
+            job : JobQueue
+                The queue receiving the messages of the job.
+        """
+        with self.lock:
+            job_id = self.next_id
+            self.next_id += 1
+            job = self.jobs[job_id] = JobQueue(self.taken, 
+                                               job_id % CANCEL_SLOTS)
+        self.cancelled[job_id % CANCEL_SLOTS] = 0
+        self.taken[job_id % CANCEL_SLOTS] = 0
+        self.pool.apply_async(_search, (job_id, finder, raw_graph, end))
+        return job_id, job
+
+    def cancel(self, job_id):
+        """Stop the job, and drop the messages it has not sent yet.
+        """
+        self.cancelled[job_id % CANCEL_SLOTS] = job_id
+        with self.lock:
+            self.jobs.pop(job_id, None)
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def _dispatch(self):
+        while True:
+            job_id, kind, data = self.results.get()
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if kind != 'RECORDS':
+                    self.jobs.pop(job_id, None)
+            if job is not None:
+                job.put((kind, data))
+
+
+class JobQueue(Queue.Queue):
+    """The queue of the messages of a job, holding up to JOB_BATCHES 
+    batches of records and the final message. Each batch taken out is 
+    counted in the shared array the worker reads to wait for room.
+    """
+
+    def __init__(self, taken, slot):
+        Queue.Queue.__init__(self, JOB_BATCHES + 1)
+        self.taken = taken
+        self.slot = slot
+
+    def _get(self):
+        message = Queue.Queue._get(self)
+        if message[0] == 'RECORDS':
+            # the count is only written by the thread reading the queue
+            self.taken[self.slot] += 1
+        return message
+
+
+def _init_worker(results, cancelled, taken):
+    global _results, _cancelled, _taken
+    _results = results
+    _cancelled = cancelled
+    _taken = taken
+
+
+def _wait_room(job_id, sent, end):
+    """Wait until the server has taken enough of the batches of the job
+    for another one to fit in its queue. Return False if the job is 
+    cancelled or its deadline is reached meanwhile.
+    """
+    slot = job_id % CANCEL_SLOTS
+    while sent - _taken[slot] >= JOB_BATCHES:
+        if _cancelled[slot] == job_id or \
+                end is not None and time.time() >= end:
+            return False
+        time.sleep(STREAM_SECS / 10)
+    return True
+
+
+def _search(job_id, finder, raw_graph, end):
+    """Run a search in a worker process, see SearchPool.submit().
+    """
+    put = _results.put
+    slot = job_id % CANCEL_SLOTS
+    try:
+        a = finder(raw_graph)
+        q = [] if end is None else PathRecord()
+        steps = []
+        sent = 0
+        flushed = time.time()
+        finished = True
+        for i in a.step(q):
+            if end is None:
+                steps.append(q[:])
+            elif q and _wait_room(job_id, sent, end):
+                # the improved paths of an anytime search are sent at 
+                # once. One found after the deadline while the queue is 
+                # full is dropped, the DONE message carries it anyway.
+                put((job_id, 'RECORDS', [q[:]]))
+                sent += 1
+            del q[:]
+            if _cancelled[slot] == job_id:
+                return
+            now = time.time()
+            if end is not None and now >= end:
+                finished = False
+                break
+            if len(steps) >= STREAM_STEPS or \
+                    (steps and now - flushed >= STREAM_SECS):
+                # without a deadline, only a cancellation stops the wait
+                if not _wait_room(job_id, sent, end):
+                    return
+                put((job_id, 'RECORDS', steps))
+                sent += 1
+                steps = []
+                flushed = time.time()
+        if steps:
+            if not _wait_room(job_id, sent, end):
+                return
+            put((job_id, 'RECORDS', steps))
+        put((job_id, 'DONE', (a.path, finished)))
+    except Exception, why:
+        put((job_id, 'ERROR', '%s: %s' % (type(why).__name__, why)))
@@ -23,18 +23,33 @@
 import os
 import sys
 import time
+import base64
 import socket
 import thread
+import threading
+import Queue
 import cPickle
 import asyncore
 import functools
+import multiprocessing
 import collections
 
 import asynchatmod as asynchat
+from searchpool import SearchPool, PathRecord
 
 from algo.astar import *
 from algo.dijkstra import *
 from algo.bidirbfs import *
+from algo.jps import *
+from algo.bidirastar import *
+from algo.arastar import *
+from algo.hpastar import *
+from algo.dstarlite import *
+from algo.batch import route_batch
+from algo.flowfield import flow_field
+from algo import landmarks
+from algo.mapcache import map_cache, map_key, patch_map
+from algo.graph import InvalidMap
 from const.constants import *
 
 class MainServer(asyncore.dispatcher):
@@ -61,6 +76,81 @@ class MainServer(asyncore.dispatcher):
         SecondaryServer(sock)
 
 
+class RouteCache(object):
+    """A least-recently-used cache of the results sent to the clients,
+    keyed by (map hash, algorithm, weight, deadline mode, source, 
+    target). The heuristic is part of the algorithm name, and the weight
+    is None for the finders which do not use it.
+
+    Each result is kept as the serialized messages sent to the client:
+    the PATH message, and the event stream that led to it if it fits in
+    the cache. It is shared by the threads of all the secondary servers.
+
+    The results are keyed by the hash of the content of the map, so they
+    never go stale when a client edits its map, and other clients may
+    still query the old one. The least recently used results are evicted
+    once the cache is full.
+    """
+
+    def __init__(self, max_bytes = ROUTE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._routes = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the (path data, events data) cached under the key,
+        or None. The events data is None if it was not kept.
+        """
+        with self._lock:
+            route = self._routes.pop(key, None)
+            if route is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._routes[key] = route
+            return route
+
+    def put(self, key, path_data, events_data):
+        """Cache a result. The events are dropped if the result would
+        not fit in the cache otherwise.
+        """
+        if self._size(path_data, events_data) > self.max_bytes:
+            events_data = None
+        size = self._size(path_data, events_data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._routes.pop(key, None)
+            if old is not None:
+                self.nbytes -= self._size(*old)
+            self._routes[key] = (path_data, events_data)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                k, route = self._routes.popitem(last = False)
+                self.nbytes -= self._size(*route)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'entries': len(self._routes),
+                    'bytes': self.nbytes}
+
+    def _size(self, path_data, events_data):
+        return len(path_data) + len(events_data or '')
+
+
+# the cache shared by all the secondary servers
+route_cache = RouteCache()
+
+# the SearchPool running the searches, or None to run them in threads
+# of the server. It is created by main() before the server starts.
+search_pool = None
+
+
 class SecondaryServer(asynchat.async_chat):
 
     def __init__(self, sock):
@@ -83,7 +173,12 @@ class SecondaryServer(asynchat.async_chat):
         # command dictionary, dispatches each incomming command
         self.cmd_dict = {'ALGO': self._set_algo,
                          'MAP': self._set_map,
+                         'MAPDIFF': self._patch_map,
                          'SPEED': self._set_speed,
+                         'WEIGHT': self._set_weight,
+                         'DEADLINE': self._set_deadline,
+                         'BATCH': self._batch,
+                         'FLOWFIELD': self._flow_field,
                          'START': self._start,
                          'STOP': self._stop}
 
@@ -95,14 +190,51 @@ class SecondaryServer(asynchat.async_chat):
                 functools.partial(AStar, heuristic = EUCLIDEAN),
             'ASTARC': 
                 functools.partial(AStar, heuristic = CHEBYSHEV),
+            'ASTARO': 
+                functools.partial(AStar, heuristic = OCTILE),
+            'ASTARL': 
+                functools.partial(AStar, heuristic = ALT),
             'DIJKSTRA': 
-                GridDijkstra,
+                functools.partial(GridDijkstra, csr = True),
             'BDBFS':
-                BiDirBFS}
+                BiDirBFS,
+            'JPS':
+                functools.partial(JumpPointSearch, heuristic = OCTILE),
+            'BDASTAR':
+                functools.partial(BiDirAStar, heuristic = OCTILE),
+            'WASTAR':
+                functools.partial(AStar, heuristic = OCTILE),
+            'ARASTAR':
+                functools.partial(ARAStar, heuristic = OCTILE),
+            'HPASTAR':
+                HPAStar,
+            'DSTARLITE':
+                DStarLite}
+
+        # the algorithms taking the weight set by the WEIGHT command
+        self.weighted = ('WASTAR', 'ARASTAR')
+
+        # the algorithms run in this process even if there is a search
+        # pool, as they reuse what this process keeps between queries:
+        # the HPA* abstraction patched by MAPDIFF, and the D* Lite 
+        # planner of the connection.
+        self.in_process = ('HPASTAR', 'DSTARLITE')
 
         self.algo = None
+        self.algo_name = None
         self.map = None
+        self.map_hash = None
+        self.endpoints = None
         self.interval = None
+        self.weight = DEFAULT_WEIGHT
+
+        # the time limit of a calculation in seconds, or None
+        self.deadline = None
+
+        # the D* Lite finder of the last query on this connection, 
+        # which repairs its search for the next query instead of 
+        # starting over.
+        self.planner = None
         
 
     def collect_incoming_data(self, data):
@@ -126,16 +258,46 @@ class SecondaryServer(asynchat.async_chat):
     def _set_algo(self, arg):
         try:
             self.algo = self.algo_dict[arg]
+            self.algo_name = arg
             print 'CMD: set algorithm:'
             print arg
         except (ValueError, LookupError), why:
             print why
 
     def _set_map(self, arg):
-        self.map = arg
+        self._use_map(arg)
         print 'CMD: set map:'
         print self.map
 
+    def _patch_map(self, arg):
+        """Apply a list of (x, y, symbol) changes to the current map,
+        see mapcache.patch_map().
+
+        If the changes can not be applied, the map is dropped, as the 
+        following changes would be applied to another map than the one 
+        of the client, and ('NOMAP', reason) asks the client to send 
+        the full map again. The queries are ignored until it does.
+        """
+        if self.map is None:
+            why = 'no map to patch'
+        else:
+            try:
+                self._use_map(patch_map(self.map, arg))
+                print 'CMD: patch map:'
+                print len(arg), 'cells changed'
+                return
+            except (InvalidMap, TypeError, ValueError), why:
+                why = str(why)
+        print why
+        self.map = None
+        self.push(cPickle.dumps(('NOMAP', why)) + TERM)
+
+    def _use_map(self, raw):
+        map_hash, source, target = map_key(raw)[1:]
+        self.map = raw
+        self.map_hash = map_hash
+        self.endpoints = (source, target)
+
     def _set_speed(self, arg):
         try:
             speed = arg
@@ -145,26 +307,210 @@ class SecondaryServer(asynchat.async_chat):
         except ValueError, why:
             print why
             
+    def _set_weight(self, arg):
+        try:
+            self.weight = max(float(arg), 1.0)
+            print 'CMD: set weight:'
+            print self.weight
+        except (TypeError, ValueError), why:
+            print why
+
+    def _set_deadline(self, arg):
+        """Set the time limit of the calculations in milliseconds. Zero
+        or None removes the limit.
+        """
+        try:
+            self.deadline = float(arg) / 1000 if arg else None
+            print 'CMD: set deadline:'
+            print '%s ms' % arg if self.deadline else 'none'
+        except (TypeError, ValueError), why:
+            print why
+
     def _start(self, arg):
-        if all((self.algo, self.map, self.interval)):
+        if self.algo and self.map and (self.interval or self.deadline):
+            # send the cached result at once if the same query has
+            # been answered before
+            route = route_cache.get(self._route_key())
+            if route is not None:
+                path_data, events_data = route
+                if events_data:
+                    self.push(events_data)
+                self.push(path_data)
+                print 'sent cached result', route_cache.stats()
+                return
             self.status = RUNNING
-            thread.start_new_thread(self._step, ())
+            # the time spent setting up the finder counts against the
+            # deadline as well
+            end = time.time() + self.deadline if self.deadline else None
+            if search_pool is not None and \
+                    self.algo_name not in self.in_process:
+                thread.start_new_thread(self._relay, (end,))
+            else:
+                thread.start_new_thread(self._step, (end,))
             print 'start calculation ...'
 
+    def _batch(self, arg):
+        """Find the paths between a list of (source, target) pairs on
+        the current map with the current algorithm, and send them all 
+        in one PATHS message.
+        """
+        if not (self.algo and self.map):
+            return
+        try:
+            pairs = [(tuple(s), tuple(t)) for s, t in arg]
+        except (TypeError, ValueError), why:
+            print why
+            return
+        thread.start_new_thread(self._route_batch, (pairs,))
+        print 'CMD: batch of', len(pairs), 'queries'
+
+    def _route_batch(self, pairs):
+        """This method will be running in a new thread."""
+        pool = search_pool.pool if search_pool is not None else None
+        paths = route_batch(self.map, pairs, self._algo(), pool = pool)
+        self.push(cPickle.dumps(('PATHS', paths)) + TERM)
+
+    def _flow_field(self, arg):
+        """Send the flow field of the current map towards the given 
+        target, or towards the target of the map if arg is None. See
+        algo.flowfield.
+        """
+        if not self.map:
+            return
+        thread.start_new_thread(self._send_flow_field, (arg,))
+        print 'CMD: flow field to', arg
+
+    def _send_flow_field(self, target):
+        """This method will be running in a new thread, sending the 
+        field as ('FLOWFIELD', (target, dist, direction)), where dist
+        and direction are the strings of its arrays, base64 encoded so 
+        that they can not contain the terminator.
+        """
+        try:
+            field = flow_field(self.map, target)
+        except (InvalidMap, TypeError, ValueError), why:
+            print why
+            return
+        data = (field.target, base64.b64encode(field.dist.tostring()),
+                base64.b64encode(field.direction.tostring()))
+        self.push(cPickle.dumps(('FLOWFIELD', data)) + TERM)
+
     def _stop(self, arg):
         self.status = STOPPED
         print 'stop'
 
-    def _step(self):
+    def _step(self, end = None):
         """This method will be running in a new thread, periodically sending
-        the client each step of the algorithm.
+        the client each step of the algorithm. If end is given, the 
+        calculation is run under a deadline, see _step_until().
+        """
+        key = self._route_key()
+        a = self._finder()
+        try:
+            if end is not None:
+                self._step_until(a, key, end)
+            else:
+                self._step_events(a, key)
+        finally:
+            # the search state stays valid even if the calculation was
+            # stopped, so the finder can be reused anyway.
+            if isinstance(a, DStarLite):
+                self.planner = a
+
+    def _relay(self, end = None):
+        """This method will be running in a new thread, running the 
+        search in the search pool and sending the client the records it
+        streams back, at the pace set by the speed unless the search is
+        run under the deadline end.
+        """
+        key = self._route_key()
+        job_id, job = search_pool.submit(self._algo(), self.map, end)
+
+        # the events sent so far, kept for the route cache until they
+        # exceed its size limit
+        events = [] if end is None else None
+        events_size = 0
+        while True:
+            try:
+                kind, data = job.get(True, 0.1)
+            except Queue.Empty:
+                if self.status != RUNNING:
+                    search_pool.cancel(job_id)
+                    return
+                continue
+            if kind == 'ERROR':
+                print 'search failed:', data
+                self.status = STOPPED
+                return
+            if kind == 'DONE':
+                break
+            for records in data:
+                for entry in records:
+                    message = cPickle.dumps(entry) + TERM
+                    self.push(message)
+                    if events is not None:
+                        events.append(message)
+                        events_size += len(message)
+                        if events_size > route_cache.max_bytes:
+                            events = None
+                if end is None:
+                    time.sleep(self.interval)
+                if self.status != RUNNING:
+                    search_pool.cancel(job_id)
+                    return
+
+        path, finished = data
+        data = cPickle.dumps(('PATH', path)) + TERM
+        # stopped before the client gets the path, which may start
+        # the next query at once
+        self.status = STOPPED
+        self.push(data)
+        # a result cut short by the deadline depends on the load of the
+        # server, so only the complete ones are cached.
+        if finished:
+            route_cache.put(key, data, 
+                            ''.join(events) if events is not None else None)
+
+    def _finder(self):
+        """Create the finder of the current query, or take back the D*
+        Lite finder of the previous one and update it with the map.
+        """
+        planner = self.planner
+        if self.algo_name == 'DSTARLITE' and planner is not None:
+            # a concurrent query on this connection gets its own finder
+            self.planner = None
+            changed = planner.update_map(self.map)
+            print 'replanning,', changed, 'cells changed'
+            return planner
+        return self._algo()(self.map)
+
+    def _algo(self):
+        """Return the finder factory of the current algorithm, with
+        the current weight applied to the weighted ones.
+        """
+        if self.algo_name in self.weighted:
+            return functools.partial(self.algo, weight = self.weight)
+        return self.algo
+
+    def _step_events(self, a, key):
+        """Run the algorithm, sending the client its events at the pace
+        set by the speed.
         """
-        a = self.algo(self.map)
         q = collections.deque()
+
+        # the events sent so far, kept for the route cache until they
+        # exceed its size limit
+        events = []
+        events_size = 0
         for i in a.step(q):
             while q:
                 data = cPickle.dumps(q.popleft()) + TERM
                 self.push(data)
+                if events is not None:
+                    events.append(data)
+                    events_size += len(data)
+                    if events_size > route_cache.max_bytes:
+                        events = None
             time.sleep(self.interval)
             if self.status != RUNNING:
                 break
@@ -172,40 +518,104 @@ class SecondaryServer(asynchat.async_chat):
             # if the algorithm successfully terminated without interrupt,
             # then send the path
             data = cPickle.dumps(('PATH', a.path)) + TERM
-            self.push(data)
+            # stopped before the client gets the path, which may start
+            # the next query at once
             self.status = STOPPED
+            self.push(data)
+            route_cache.put(key, data, 
+                            ''.join(events) if events is not None else None)
+
+    def _step_until(self, a, key, end):
+        """Run the algorithm without pausing until it terminates or the
+        time reaches end, then send the best path found. No events are
+        sent except the PATH records of the anytime algorithms, which 
+        are sent as soon as each improved path is found.
+        """
+        q = PathRecord()
+        for i in a.step(q):
+            for entry in q:
+                self.push(cPickle.dumps(entry) + TERM)
+            del q[:]
+            if self.status != RUNNING:
+                return
+            if time.time() >= end:
+                finished = False
+                break
+        else:
+            finished = True
+        data = cPickle.dumps(('PATH', a.path)) + TERM
+        # stopped before the client gets the path, which may start
+        # the next query at once
+        self.status = STOPPED
+        self.push(data)
+        # a result cut short by the deadline depends on the load of the
+        # server, so only the complete ones are cached.
+        if finished:
+            route_cache.put(key, data, None)
+
+    def _route_key(self):
+        # the weight only tells apart the results of the finders using it
+        weight = self.weight if self.algo_name in self.weighted else None
+        return (self.map_hash, self.algo_name, weight, 
+                bool(self.deadline)) + self.endpoints
 
 
-def main(addr):
+def main(addr, workers = None):
+    """Start the server on addr. The searches are run by a pool of 
+    worker processes, by default one per CPU if there are several, or
+    in threads of the server if workers is 0.
+    """
+    global search_pool
+    if workers is None:
+        cpus = multiprocessing.cpu_count()
+        workers = cpus if cpus > 1 else 0
+    # the pool is forked before the server opens any socket
+    if workers:
+        search_pool = SearchPool(workers)
     server = MainServer(addr)
     try:
         asyncore.loop()
     except KeyboardInterrupt:
         server.close()
+        if search_pool is not None:
+            search_pool.close()
         print 'quit'
 
 
 def print_help():
-    print """usage: server.py [-p port]
-example: server.py -p 27182
+    print """usage: server.py [-p port] [-c route_cache_mb] [-w workers] 
+                 [-l landmark_dir]
+example: server.py -p 27182 -c 128 -w 4 -l /var/cache/pathfinding
 
-The default port is 31416"""
+The default port is 31416
+The default route cache size is %dMB
+The default number of search processes is the number of CPUs, or 0 on
+a single CPU, which runs the searches in threads of the server
+The landmark tables of ASTARL are saved in landmark_dir if given""" % (
+        ROUTE_CACHE_BYTES >> 20)
 
 
 if __name__ == '__main__':
     host = 'localhost'
     port = 31416
+    workers = None
     import getopt
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'hp:', ['help'])
+        opts, args = getopt.getopt(sys.argv[1:], 'hp:c:w:l:', ['help'])
         for o, a in opts:
             if o in ('-h', '--help'):
                 print_help()
                 raise SystemExit
             elif o == '-p':
                 port = int(a)
+            elif o == '-c':
+                route_cache.max_bytes = int(a) << 20
+            elif o == '-w':
+                workers = int(a)
+            elif o == '-l':
+                landmarks.cache_dir = a
     except (getopt.GetoptError, ValueError): 
         print "Invalid arguments\n"
         print_help()
         raise SystemExit
-    main((host, port))
+    main((host, port), workers)